@@ -0,0 +1,263 @@
+from datetime import datetime
+import os
+import numpy as np
+import pandas as pd
+import downsample
+import gridEngine
+from mongoDB import decode_cursor, parse_iso, geo_filters, COUNT_MODES, RANGE_ARGS, SORT_KEY
+from outlierEngine import find_outliers, outlier_columns, ALL_FIELDS, METHODS
+
+# Argument parsing and response shapes shared by the Flask app (flaskWebApp.py)
+# and its asyncio counterpart (asyncWebApp.py). Invalid arguments raise
+# ValueError, which both apps answer with a 400.
+
+# How /api/stats and /api/outliers are computed, overridable per request with ?mode=
+#   stats:    "incremental" (stored aggregates), "pandas" or "pushdown" (MongoDB aggregation)
+#   outliers: "pandas" or "pushdown"
+STATS_MODE = os.getenv("STATS_MODE", "incremental")
+OUTLIERS_MODE = os.getenv("OUTLIERS_MODE", "pandas")
+STATS_MODES = ["incremental", "pandas", "pushdown"]
+OUTLIERS_MODES = ["pandas", "pushdown"]
+LAYOUTS = ["records", "columnar"]
+
+ROUTES = {
+    "/api/health": "returns API status",
+    "/api/observations":
+    {
+        "return documents with optional query parameters":
+        [
+            "survey (survey day, e.g. 2021-10-21)",
+            "start/end (ISO timestamps in local survey time, without an offset, e.g. 2021-10-21T10:30:00)",
+            "bbox (min_lon,min_lat,max_lon,max_lat)",
+            "near (lat,lon) with radius_m (meters)",
+            "min_time, max_time (hh:mm:ss time of day)",
+            "min_temp, max_temp",
+            "min_sal, max_sal",
+            "min_odo, max_odo",
+            "limit, (default 100, 1 to 1000)",
+            "skip (for pagination)",
+            "cursor (the 'next' token of the previous page, faster than skip)",
+            "count (exact, estimated or none, default exact; pages requested with a cursor get no exact count)",
+            "fields (comma-separated list of fields to return)",
+            "layout (records or columnar, default records)",
+            "send 'Accept: application/x-ndjson' to stream every match without the limit"
+        ]
+    },
+    "/api/stats": "count, mean, min, max, and percentiles (25%, 50%, 75%), optional mode (incremental, pandas, pushdown)",
+    "/api/outliers" : "return a list of flagged records, optional mode (pandas, pushdown) and layout (records, columnar)",
+    "/api/observations/downsample": "field reduced to about 'points' points (default 1000, max 10000) for charts, optional x (default the timestamp), method (lttb, minmax, mean), extra (fields of the picked rows to return too) and the survey, start/end, bbox, near/radius_m and min_/max_ filters",
+    "/api/grid": "count, mean, min and max of temperature, pH and ODO per map cell, optional cell_m (cell size in meters, default 25), shape (square, hex) and the filters of /api/observations",
+    "/api/debug/explain": "query plan, keys and docs examined for the same arguments as /api/observations",
+    "/api/metrics": "request, query/pandas/serialize phase and MongoDB command metrics in the Prometheus text format",
+}
+
+
+def check_fields(fields, known_fields=None):
+    # names of stored fields only: no bookkeeping (_key, _hash, _id) or operator ($) names
+    invalid = [field for field in fields if field.startswith(("_", "$")) or "\0" in field]
+    if not invalid and known_fields:
+        invalid = [field for field in fields if field not in known_fields]
+    if invalid:
+        raise ValueError(f"Unknown fields: {invalid}")
+    return fields
+
+
+def observation_params(args, known_fields=None):
+    """Parameters of an /api/observations request; `fields` must be among known_fields if given."""
+    name_args = ["survey", "start", "end", "bbox", "near", "radius_m", "min_time", "max_time", "min_temp", "max_temp", "min_sal", "max_sal", "min_odo", "max_odo", "limit", "skip", "cursor", "count", "fields", "layout"]
+    params = {}
+    for i in range(len(name_args)):
+        flask_request = args.get(name_args[i])
+        if flask_request: params.update({name_args[i] : flask_request})
+
+    if len(params) == 0 and len(args.keys()) > 0:
+        raise ValueError("Arguments provided are not supported.")
+
+    if not "limit" in params:
+        params["limit"] = 100
+    else:
+        params["limit"] = int(params["limit"])
+        if params["limit"] < 1:
+            raise ValueError("limit must be at least 1")
+        if params["limit"] > 1000:
+            params["limit"] = 1000
+    if not "skip" in params:
+        params["skip"] = 0
+    else:
+        params["skip"] = int(params["skip"])
+        if params["skip"] < 0:
+            raise ValueError("skip can't be negative")
+
+    if "fields" in params:
+        params["fields"] = check_fields([field for field in params["fields"].split(",") if field], known_fields)
+    if params.get("layout", "records") not in LAYOUTS:
+        raise ValueError("layout must be records or columnar")
+
+    if params.get("count", "exact") not in COUNT_MODES:
+        raise ValueError(f"count must be one of {COUNT_MODES}")
+
+    if "cursor" in params:
+        decode_cursor(params["cursor"])
+    filter_params(params)
+    return params
+
+
+def filter_params(params):
+    # start/end become datetimes and the geo arguments are checked here, so a
+    # malformed one is a 400 before any query
+    for name in RANGE_ARGS:
+        if name in params:
+            params[name] = parse_iso(params[name])
+    geo_filters(params)
+    return params
+
+
+def export_params(params):
+    # exports stream every match, the paging arguments don't apply
+    for name in ["limit", "skip", "count", "layout"]:
+        params.pop(name, None)
+    return params
+
+
+def columnar(documents, fields=None):
+    # one array per field instead of repeating every key in every row
+    fields = fields or list(dict.fromkeys(key for doc in documents for key in doc))
+    return fields, {field: [doc.get(field) for doc in documents] for field in fields}
+
+
+def observations_body(data, layout, fields=None):
+    if len(data["items"]) == 0:
+        return {}
+    if layout == "columnar":
+        fields, columns = columnar(data["items"], fields)
+        return {"count": data["count"], "fields": fields, "columns": columns, "next": data["next"]}
+    return {"count": data["count"], "items": data["items"], "next": data["next"]}
+
+
+def outlier_params(args, known_fields=None):
+    """(method, k, field, mode, layout) of an /api/outliers request; field is None for every column.
+    Fields outside known_fields (the numeric fields of the collection) are rejected in every mode."""
+    mode = args.get("mode", OUTLIERS_MODE)
+    layout = args.get("layout", "records")
+    name_args = ["field", "method", "k"]
+    params = {}
+    for i in range(len(name_args)):
+        flask_request = args.get(name_args[i])
+        if flask_request: params.update({name_args[i] : flask_request})
+
+    if (name_args != list(params.keys())) or (params["method"] not in METHODS) or (mode not in OUTLIERS_MODES) or (layout not in LAYOUTS):
+        raise ValueError("Arguments provided are not supported.")
+
+    # field can be "All Columns", one column, or several (repeated or comma-separated)
+    field = None
+    fields = [f for value in args.getlist("field") for f in value.split(",")]
+    if not (len(fields) == 1 and fields[0] in ALL_FIELDS):
+        field = fields
+        missing = [f for f in fields if known_fields is not None and f not in known_fields]
+        if missing:
+            raise ValueError(f"Not numeric columns of the dataset: {missing}")
+    k = float(params["k"])
+    if not (np.isfinite(k) and k > 0):
+        raise ValueError("k must be a positive number")
+    return params["method"], k, field, mode, layout
+
+
+def outliers_body(items, layout):
+    if layout == "columnar":
+        fields, columns = columnar(items)
+        return {"count": len(items), "fields": fields, "columns": columns}
+    return {"count": len(items), "items": items}
+
+
+def pandas_outliers(documents, method, k, field, layout):
+    df = pd.DataFrame(documents)
+    if layout == "columnar":
+        # flagged rows stay NumPy arrays all the way to the encoder
+        columns = outlier_columns(df, method, k, field)
+        count = len(next(iter(columns.values()), []))
+        return {"count": count, "fields": list(columns), "columns": columns}
+    return outliers_body(find_outliers(df, method, k, field), layout)
+
+
+def pandas_stats(documents):
+    # numeric columns only, like the incremental and pushdown modes (no timestamp)
+    numbers = pd.DataFrame(documents).select_dtypes(include="number")
+    if numbers.columns.empty:
+        return {}
+    summary = numbers.describe()
+    # NumPy values go to the encoder as they are
+    return {col: dict(zip(summary.index, summary[col].to_numpy())) for col in summary.columns}
+
+
+FILTER_ARGS = ["survey", "start", "end", "bbox", "near", "radius_m", "min_time", "max_time", "min_temp", "max_temp", "min_sal", "max_sal", "min_odo", "max_odo"]
+
+
+def downsample_params(args):
+    """(filters, x, field, points, method, extra) of an /api/observations/downsample request."""
+    field = args.get("field")
+    if not field:
+        raise ValueError("field is required")
+    x = args.get("x", SORT_KEY)
+    points = min(max(int(args.get("points", 1000)), 3), 10000)
+    method = args.get("method", "lttb")
+    if method not in downsample.METHODS:
+        raise ValueError(f"method must be one of {downsample.METHODS}")
+    # other fields of the picked rows (a chart's colour or size), only for methods that pick rows
+    extra = check_fields([name for name in args.get("extra", "").split(",") if name])
+    if extra and method == "mean":
+        raise ValueError("extra needs a method that picks rows (lttb, minmax)")
+    check_fields([x, field])
+    filters = filter_params({name: args.get(name) for name in FILTER_ARGS if args.get(name)})
+    return filters, x, field, points, method, extra
+
+
+def downsample_body(documents, x, field, points, method, extra=()):
+    raw_x = np.array([doc.get(x) for doc in documents], dtype=object)
+    ys = pd.to_numeric(pd.Series([doc.get(field) for doc in documents], dtype=object), errors="coerce").to_numpy(dtype="float64")
+    # the timestamp is reduced as seconds since the epoch, hh:mm:ss text as seconds since midnight
+    is_datetime = any(isinstance(value, datetime) for value in raw_x)
+    is_time = not is_datetime and any(isinstance(value, str) for value in raw_x)
+    if is_datetime:
+        xs = downsample.datetime_seconds(raw_x)
+    elif is_time:
+        xs = downsample.time_seconds(raw_x)
+    else:
+        xs = pd.to_numeric(pd.Series(raw_x), errors="coerce").to_numpy(dtype="float64")
+
+    rows = downsample.finite_rows(xs, ys)
+    rows = rows[np.argsort(xs[rows], kind="stable")]
+    dx, dy, picked = downsample.downsample(xs[rows], ys[rows], points, method)
+    if picked is not None and (is_datetime or is_time):
+        dx = raw_x[rows[picked]].tolist()
+    elif is_datetime:
+        dx = downsample.format_datetimes(dx)
+    elif is_time:
+        dx = downsample.format_seconds(dx)
+    columns = {x: dx, field: dy}
+    if extra:
+        picked_rows = rows[picked]
+        columns.update({name: [documents[i].get(name) for i in picked_rows] for name in extra if name not in columns})
+    return {"count": len(documents), "points": len(dy), "method": method,
+            "fields": list(columns), "columns": columns}
+
+
+def grid_params(args):
+    """(filters, shape, cell_m) of an /api/grid request."""
+    shape = args.get("shape", "square")
+    if shape not in gridEngine.SHAPES:
+        raise ValueError(f"shape must be one of {gridEngine.SHAPES}")
+    cell_m = float(args.get("cell_m", 25))
+    if not np.isfinite(cell_m):
+        raise ValueError("cell_m must be a finite number")
+    cell_m = min(max(cell_m, 1.0), 100000.0)
+    filters = filter_params({name: args.get(name) for name in FILTER_ARGS if args.get(name)})
+    return filters, shape, cell_m
+
+
+def grid_body(documents, shape, cell_m):
+    lat, lon, columns = gridEngine.grid_arrays(documents)
+    grid = gridEngine.bin_points(lat, lon, columns, shape, cell_m)
+    # one array per cell attribute; cells where a field has no value get null
+    return {"shape": shape, "cell_m": cell_m, "ref_lat": grid["ref_lat"], "points": grid["points"],
+            "cells": len(grid["count"]), "lat": grid["lat"], "lon": grid["lon"], "count": grid["count"],
+            "stats": grid["stats"]}
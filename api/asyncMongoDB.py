@@ -0,0 +1,104 @@
+import asyncio
+import mongoConnection
+import statsEngine
+from mongoDB import (collection_name, cached_generation, remember_generation, META_COLLECTION, cached_fields, remember_fields, HIDDEN_FIELDS, page_request, page_response, stream_request, series_request, grid_request, sample_numeric_fields, stats_pipeline,
+                     stats_from_row, bounds_pipeline, outliers_pipeline, get_stats, upload_MONGO)
+
+# Async counterparts of the mongoDB.py functions used by asyncWebApp.py. The
+# filters and pipelines come from mongoDB.py, only the round trips differ:
+# they go through pymongo's AsyncMongoClient, so a request waiting on MongoDB
+# doesn't hold a thread.
+
+def get_collection():
+    return mongoConnection.get_async_db()[collection_name()]
+
+def get_stats_collection():
+    return mongoConnection.get_async_db()[collection_name() + '_stats']
+
+def get_meta_collection():
+    return mongoConnection.get_async_db()[META_COLLECTION]
+
+
+async def current_generation():
+    # the same in-memory copy as mongoDB.current_generation, which uploads update
+    value = cached_generation()
+    if value is not None:
+        return value
+    doc = await get_meta_collection().find_one({"_id": "generation"})
+    return remember_generation(doc["value"] if doc else 0)
+
+
+async def first(cursor):
+    async for doc in cursor:
+        return doc
+    return None
+
+
+async def query(params):
+    if len(params) == 0:
+        items = await get_collection().find().to_list()
+        return ({"count": len(items), "items": items})
+
+    page_query = page_request(params)
+    result = await first(await get_collection().aggregate(page_query["pipeline"]))
+    count = await get_collection().estimated_document_count() if page_query["estimated"] else None
+    return page_response(page_query, result, count)
+
+
+async def document_fields():
+    return cached_fields() or remember_fields(await get_collection().find_one({}, {"_id": 0, **HIDDEN_FIELDS}))
+
+
+def stream(params):
+    """Unbounded async cursor over the matching documents, for NDJSON exports."""
+    return get_collection().find(**stream_request(params))
+
+
+def series(params, x, y, extra=()):
+    return get_collection().find(**series_request(params, x, y, extra))
+
+
+def grid(params, fields):
+    return get_collection().find(**grid_request(params, fields))
+
+
+async def get_stats():
+    state = await get_stats_collection().find_one({"_id": statsEngine.STATS_ID})
+    stats = statsEngine.describe_state(state)
+    if stats is None:
+        # first request on an existing collection: the rebuild is the synchronous one
+        stats = await asyncio.to_thread(get_stats)
+    return stats
+
+
+async def numeric_fields():
+    state = await get_stats_collection().find_one({"_id": statsEngine.STATS_ID}, {"fields.name": 1})
+    fields = statsEngine.state_field_names(state)
+    if not fields:
+        fields = sample_numeric_fields(await get_collection().find_one({}, {"_id": 0}))
+    return fields
+
+
+async def stats_pushdown():
+    fields = await numeric_fields()
+    if not fields:
+        return {}
+    row = await first(await get_collection().aggregate(stats_pipeline(fields)))
+    return stats_from_row(fields, row)
+
+
+async def outliers_pushdown(method, k, checked=None):
+    fields = await numeric_fields()
+    checked = checked or fields
+    row = await first(await get_collection().aggregate(bounds_pipeline(method, checked)))
+    pipeline = outliers_pipeline(method, k, fields, checked, row)
+    if pipeline is None:
+        return {"count": 0, "items": []}
+    items = await (await get_collection().aggregate(pipeline)).to_list()
+    return {"count": len(items), "items": items}
+
+
+async def upload(documents):
+    # uploads keep the threaded batch writer and its stats bookkeeping; they
+    # are rare, and this keeps one implementation of the dedupe and CAS logic
+    return await asyncio.to_thread(upload_MONGO, documents)
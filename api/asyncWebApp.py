@@ -0,0 +1,161 @@
+from quart import Quart, Response, jsonify, request, abort
+from apiCommon import ROUTES, STATS_MODE, observation_params, export_params, observations_body, outlier_params, outliers_body, pandas_outliers, pandas_stats, downsample_params, downsample_body, grid_params, grid_body
+from gridEngine import GRID_FIELDS
+from ingest import read_documents
+from mongoDB import ensure_indexes_in_background, pushdown_unsupported
+from pymongo.errors import OperationFailure
+from mongoConnection import health, ping_async
+from responseCache import cached_async
+from serializer import compress_response_async, dumps
+import asyncMongoDB
+import asyncio
+import io
+import time
+
+# asyncio version of flaskWebApp.py, same routes and responses. MongoDB round
+# trips are awaited instead of blocking a worker thread, so one process keeps
+# serving while hundreds of requests wait on the database; pandas work runs in
+# a thread so it doesn't stall the event loop. Run it with an ASGI server:
+#
+#   hypercorn asyncWebApp:app --bind 0.0.0.0:5050
+#
+# Indexes, the response cache and compression are the Flask app's; only the
+# request metrics aren't wired in here.
+
+app = Quart(__name__)
+# uploads are read whole before parsing, like a Flask request without a limit
+app.config["MAX_CONTENT_LENGTH"] = None
+app.after_request(compress_response_async)
+ensure_indexes_in_background()
+cache_response = cached_async(asyncMongoDB.current_generation)
+
+def timed(response, start):
+    response.headers["Server-Timing"] = f"compute;dur={(time.perf_counter() - start) * 1000:.1f}"
+    return response
+
+def fallback(response, mode):
+    response.headers["X-Pushdown-Fallback"] = mode
+    return response
+
+def json_response(result, status=200):
+    return Response(dumps(result), status=status, mimetype="application/json")
+
+@app.route('/')
+async def index():
+    return jsonify({"routes": ROUTES})
+
+@app.route('/api/health',methods=['GET'])
+async def status():
+    mongo = health(await ping_async())
+    status = {"status": "OK" if mongo["ok"] else "DEGRADED", "mongoDB": "ONLINE" if mongo["ok"] else "OFFLINE", "details": mongo}
+    return json_response(status, 200 if mongo["ok"] else 503)
+
+@app.route('/api/upload', methods=['POST'])
+async def upload():
+    try:
+        body = io.BytesIO(await request.get_data())
+        documents = read_documents(body, request.mimetype, request.content_encoding)
+        results = await asyncMongoDB.upload(documents)
+    except (ValueError, OSError) as e:
+        return json_response(f'Error. {e}', 400)
+    return json_response(results)
+
+def request_params(parse):
+    try:
+        return parse(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+@app.route('/api/observations',methods=['GET'])
+@cache_response
+async def observations():
+    known_fields = await asyncMongoDB.document_fields() if request.args.get("fields") else None
+    params = request_params(lambda args: observation_params(args, known_fields))
+
+    if request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        params = export_params(params)
+        async def generate():
+            async for doc in asyncMongoDB.stream(params):
+                yield dumps(doc) + b"\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    layout = params.pop("layout", "records")
+    return json_response(observations_body(await asyncMongoDB.query(params), layout, params.get("fields")))
+
+# Chart-sized version of one field: the reduction runs here, only `points` points are sent
+@app.route('/api/observations/downsample',methods=['GET'])
+@cache_response
+async def observations_downsample():
+    start = time.perf_counter()
+    filters, x, field, points, method, extra = request_params(downsample_params)
+    documents = await asyncMongoDB.series(filters, x, field, extra).to_list()
+    try:
+        result = await asyncio.to_thread(downsample_body, documents, x, field, points, method, extra)
+    except ValueError as e:
+        abort(400, str(e))
+    return timed(json_response(result), start)
+
+@app.route('/api/grid',methods=['GET'])
+@cache_response
+async def grid_cells():
+    start = time.perf_counter()
+    filters, shape, cell_m = request_params(grid_params)
+    documents = await asyncMongoDB.grid(filters, GRID_FIELDS).to_list()
+    result = await asyncio.to_thread(grid_body, documents, shape, cell_m)
+    return timed(json_response(result), start)
+
+@app.route('/api/stats',methods=['GET'])
+@cache_response
+async def stats():
+    start = time.perf_counter()
+    mode = request.args.get("mode", STATS_MODE)
+    used = mode
+    if mode == "incremental":
+        result = await asyncMongoDB.get_stats()
+    elif mode == "pushdown":
+        try:
+            result = await asyncMongoDB.stats_pushdown()
+        except OperationFailure as e:
+            if not pushdown_unsupported(e):
+                raise
+            print(f"Stats pushdown not supported by the server, using the incremental stats: {e}")
+            used = "incremental"
+            result = await asyncMongoDB.get_stats()
+    elif mode == "pandas":
+        documents = (await asyncMongoDB.query({})).get("items")
+        result = await asyncio.to_thread(pandas_stats, documents)
+    else:
+        abort(400, "Arguments provided are not supported.")
+    response = json_response(result)
+    if used != mode:
+        fallback(response, used)
+    return timed(response, start)
+
+@app.route('/api/outliers',methods=['GET'])
+@cache_response
+async def outliers():
+    start = time.perf_counter()
+    known_fields = await asyncMongoDB.numeric_fields()
+    method, k, field, mode, layout = request_params(lambda args: outlier_params(args, known_fields))
+
+    if mode == "pushdown":
+        try:
+            result = await asyncMongoDB.outliers_pushdown(method, k, field)
+            return timed(json_response(outliers_body(result["items"], layout)), start)
+        except OperationFailure as e:
+            if not pushdown_unsupported(e):
+                raise
+            print(f"Outliers pushdown not supported by the server, using pandas: {e}")
+
+    documents = (await asyncMongoDB.query({})).get("items")
+    try:
+        result = await asyncio.to_thread(pandas_outliers, documents, method, k, field, layout)
+    except ValueError as e:
+        abort(400, str(e))
+    response = json_response(result)
+    if mode == "pushdown":
+        fallback(response, "pandas")
+    return timed(response, start)
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5050)
@@ -0,0 +1,151 @@
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Column-per-file storage for the survey CSVs in database/.
+# database/2022-oct7.csv is converted into database/2022-oct7.cols/ holding one
+# .npy file per column plus meta.json (source mtime, row count, dtypes and the
+# min/max of every numeric column). Columns are opened with np.load(mmap_mode="r"),
+# so reading a few of the ~70 columns only touches those files and numeric
+# data is never parsed or copied.
+#
+#   python columnarStore.py ../database/*.csv
+
+SUFFIX = ".cols"
+META_FILE = "meta.json"
+
+
+def store_path(csv_path):
+    return os.path.splitext(csv_path)[0] + SUFFIX
+
+
+def read_meta(store):
+    with open(os.path.join(store, META_FILE)) as f:
+        return json.load(f)
+
+
+def is_fresh(csv_path):
+    """True if the store exists and was built from the current version of the CSV."""
+    try:
+        meta = read_meta(store_path(csv_path))
+    except (OSError, ValueError):
+        return False
+    return meta["source_mtime"] == os.path.getmtime(csv_path)
+
+
+def convert(csv_path):
+    """Write the columnar store for csv_path and return its directory."""
+    df = pd.read_csv(csv_path)
+    store = store_path(csv_path)
+    # unique per call, so threads converting the same file don't share it
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(store) + ".tmp-", dir=os.path.dirname(store) or ".")
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        s = df[name]
+        entry = {"name": name, "file": f"{i:03d}.npy"}
+        if pd.api.types.is_numeric_dtype(s):
+            values = s.to_numpy()
+            entry["kind"] = "number"
+            if s.notna().any():
+                entry["min"] = float(s.min())
+                entry["max"] = float(s.max())
+        else:
+            # fixed-width unicode so it can be memory-mapped too; "" stands for a missing cell
+            values = np.array(s.fillna("").astype(str).tolist(), dtype=str)
+            entry["kind"] = "str"
+        entry["dtype"] = values.dtype.str
+        np.save(os.path.join(tmp, entry["file"]), values)
+        columns.append(entry)
+
+    meta = {"source": os.path.basename(csv_path), "source_mtime": os.path.getmtime(csv_path),
+            "rows": len(df), "columns": columns}
+    with open(os.path.join(tmp, META_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+
+    swap_in(tmp, store)
+    return store
+
+
+def swap_in(tmp, store):
+    # readers never see half a store: a non-empty directory can't be renamed
+    # over, so the old store is renamed aside, the new one renamed in, and the
+    # old one removed (readers that already opened its files keep them)
+    aside = tmp + ".old"
+    try:
+        os.replace(store, aside)
+    except FileNotFoundError:
+        # no store yet, or a concurrent convert moved it first
+        aside = None
+    try:
+        os.replace(tmp, store)
+    except OSError:
+        # a concurrent convert of the same CSV swapped in its copy first
+        shutil.rmtree(tmp, ignore_errors=True)
+    if aside:
+        shutil.rmtree(aside, ignore_errors=True)
+
+
+def select(meta, columns=None):
+    if columns is None:
+        return meta["columns"]
+    by_name = {c["name"]: c for c in meta["columns"]}
+    missing = [c for c in columns if c not in by_name]
+    if missing:
+        raise KeyError(f"Columns not in {meta['source']}: {missing}")
+    return [by_name[c] for c in columns]
+
+
+def read_arrays(store, columns=None):
+    """Memory-mapped arrays of the requested columns, {name: np.memmap}."""
+    meta = read_meta(store)
+    return {c["name"]: np.load(os.path.join(store, c["file"]), mmap_mode="r") for c in select(meta, columns)}
+
+
+def read_frame(store, columns=None):
+    """DataFrame of the requested columns; numeric ones wrap the memory maps without copying."""
+    meta = read_meta(store)
+    data = {}
+    for c in select(meta, columns):
+        values = np.load(os.path.join(store, c["file"]), mmap_mode="r")
+        if c["kind"] == "str":
+            values = pd.Series(values.astype(object)).replace("", np.nan)
+        data[c["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def ensure_store(csv_path):
+    """Metadata of an up-to-date store for csv_path, built if needed; None if it can't be written."""
+    try:
+        if not is_fresh(csv_path):
+            convert(csv_path)
+        return read_meta(store_path(csv_path))
+    except OSError as e:
+        # e.g. a read-only deployment, the CSV still works
+        print(f"Columnar store unavailable for {csv_path}: {e}")
+        return None
+
+
+def load_frame(csv_path, columns=None):
+    """Read a survey through its columnar store, falling back to the CSV."""
+    if ensure_store(csv_path) is not None:
+        try:
+            return read_frame(store_path(csv_path), columns)
+        except OSError as e:
+            # caught between the two renames of a concurrent convert
+            print(f"Columnar store of {csv_path} changed while reading: {e}")
+    return pd.read_csv(csv_path, usecols=columns)[columns] if columns else pd.read_csv(csv_path)
+
+
+if __name__ == '__main__':
+    paths = [path for pattern in sys.argv[1:] for path in glob.glob(pattern)]
+    if not paths:
+        print("Usage: python columnarStore.py <csv files or globs>")
+        sys.exit(1)
+    for path in paths:
+        print(f"{path} -> {convert(path)}")
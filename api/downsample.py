@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Reduce a time series to a target number of points for plotting.
+#   lttb    Largest-Triangle-Three-Buckets: keeps the points that shape the line
+#   minmax  lowest and highest point of every bucket, so spikes survive
+#   mean    one averaged point per bucket (not actual rows)
+# lttb and minmax return indices of actual rows, so the caller can keep the
+# rest of each row (color, size columns). Series must be sorted by x.
+
+METHODS = ["lttb", "minmax", "mean"]
+
+
+def time_seconds(values):
+    """Seconds since midnight of "hh:mm:ss" strings or datetime.time values, NaN where unparsable."""
+    text = pd.Series(values, dtype=object).astype(str)
+    return pd.to_timedelta(text, errors="coerce").dt.total_seconds().to_numpy()
+
+
+def format_seconds(seconds):
+    seconds = np.round(seconds).astype(np.int64)
+    return [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds]
+
+
+def datetime_seconds(values):
+    """Seconds since the epoch of datetime values, NaN where missing."""
+    stamps = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce")
+    return (stamps - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+
+
+def format_datetimes(seconds):
+    return pd.to_datetime(np.round(seconds * 1000).astype(np.int64), unit="ms").to_pydatetime().tolist()
+
+
+def bucket_ids(n, buckets):
+    # equal-count buckets over positions 0..n-1
+    return (np.arange(n) * buckets // n).astype(np.int64)
+
+
+def lttb_indices(x, y, points):
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    # first and last points are kept, the n-2 others are split into points-2 buckets;
+    # integer edges, a float linspace can land just below an exact edge
+    edges = np.arange(points - 1, dtype=np.int64) * (n - 2) // (points - 2) + 1
+    # the "next" point of each bucket is the average of the following bucket
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])[1:]
+    avg_y = np.append(sums_y / sizes, y[-1])[1:]
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # doubled triangle areas against the previous pick and the next bucket's average, for the whole bucket at once
+        area = np.abs((x[a] - avg_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(x, y, points):
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    buckets = bucket_ids(n, max(points // 2, 1))
+    # sorted by (bucket, y): the first row of each bucket is its minimum, the last its maximum
+    order = np.lexsort((y, buckets))
+    starts = np.flatnonzero(np.diff(buckets[order], prepend=-1))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def mean_buckets(x, y, points):
+    n = len(x)
+    if points >= n:
+        return x, y
+    buckets = bucket_ids(n, points)
+    counts = np.bincount(buckets, minlength=points)
+    return np.bincount(buckets, x, points) / counts, np.bincount(buckets, y, points) / counts
+
+
+def downsample(x, y, points, method="lttb"):
+    """(x, y, indices) reduced to about `points` points; indices is None for "mean"."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {METHODS}")
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    if method == "mean":
+        mx, my = mean_buckets(x, y, points)
+        return mx, my, None
+    indices = lttb_indices(x, y, points) if method == "lttb" else minmax_indices(x, y, points)
+    return x[indices], y[indices], indices
+
+
+def finite_rows(x, y):
+    """Positions of the rows where both x and y are numbers."""
+    return np.flatnonzero(np.isfinite(x) & np.isfinite(y))
@@ -1,116 +1,195 @@
-from flask import Flask, jsonify, request, abort
-from mongoDB import upload_MONGO, query, mongo_OK
-import pandas as pd
+from flask import Flask, Response, jsonify, request, abort, stream_with_context
+from mongoDB import upload_MONGO, query, stream, series, grid, explain, ensure_indexes_in_background, current_generation, get_stats, stats_pushdown, outliers_pushdown, pushdown_unsupported, numeric_fields, document_fields
+from apiCommon import ROUTES, STATS_MODE, observation_params, export_params, observations_body, outlier_params, outliers_body, pandas_outliers, pandas_stats, downsample_params, downsample_body, grid_params, grid_body
+from gridEngine import GRID_FIELDS
+from ingest import read_documents
+from pymongo.errors import OperationFailure
+from metrics import CONTENT_TYPE, phase, phase_timings, record_pool, render, start_request, finish_request
+from mongoConnection import health, pool_monitor
+from responseCache import cached
+from serializer import FastJSONProvider, compress_response, dumps
+import time
 
 app = Flask(__name__)
+# orjson-backed jsonify, and gzip/zstd for large responses
+app.json = FastJSONProvider(app)
+# request counts and durations for /api/metrics; after_request hooks run in
+# reverse order, so the timing includes the compression below
+app.before_request(start_request)
+app.after_request(finish_request)
+app.after_request(compress_response)
+ensure_indexes_in_background()
+# read endpoints are served from memory until the next upload changes the data
+cache_response = cached(current_generation)
+
+def timed(response, start):
+    # lets the pandas and pushdown paths be compared from the client side, phase by phase
+    timings = [f"compute;dur={(time.perf_counter() - start) * 1000:.1f}"]
+    timings += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phase_timings().items()]
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+def fallback(response, mode):
+    # the pushdown pipeline needs a newer server, the response came from `mode`
+    response.headers["X-Pushdown-Fallback"] = mode
+    return response
 
 @app.route('/')
 def index():
-    return jsonify({
-        "routes": {
-            "/api/health": "returns API status",
-            "/api/observations": 
-            {
-                "return documents with optional query parameters":
-                [
-                    "start/end (ISO timestamps)",
-                    "min_temp, max_temp",
-                    "min_sal, max_sal",
-                    "min_odo, max_odo",
-                    "limit, (default 100, max 1000)",
-                    "skip (for pagination)"
-                ]
-            },
-            "/api/stats": "count, mean, min, max, and percentiles (25%, 50%, 75%)",
-            "/api/outliers" : "return a list of flagged records", 
-        }
-    })
+    return jsonify({"routes": ROUTES})
 
 @app.route('/api/health',methods=['GET'])
 def status():
-    status = {"status": "OK", "mongoDB": "ONLINE" if mongo_OK else "OFFLINE"}
-    return jsonify(status), 200
+    # a real ping, reused for a few seconds so frequent probes don't load the pool
+    mongo = health()
+    status = {"status": "OK" if mongo["ok"] else "DEGRADED", "mongoDB": "ONLINE" if mongo["ok"] else "OFFLINE", "details": mongo}
+    return jsonify(status), 200 if mongo["ok"] else 503
 
 # Will return error if accessed through a GET request, only allowed from streamlit
 @app.route('/api/upload', methods=['POST'])
 def upload():
-    if request.is_json:
-        results = upload_MONGO(request.get_json())
-        return jsonify(results), 200
-    else:
-        return jsonify('Error. Request must be JSON'), 400
+    # JSON array, NDJSON or CSV body, optionally sent with Content-Encoding: gzip
+    try:
+        documents = read_documents(request.stream, request.mimetype, request.content_encoding)
+        results = upload_MONGO(documents)
+    except (ValueError, OSError) as e:
+        return jsonify(f'Error. {e}'), 400
+    return jsonify(results), 200
+
+def request_params(parse):
+    try:
+        return parse(request.args)
+    except ValueError as e:
+        abort(400, str(e))
 
 @app.route('/api/observations',methods=['GET'])
+@cache_response
 def observations():
-    name_args = ["min_time", "max_time", "min_temp", "max_temp", "min_sal", "max_sal", "min_odo", "max_odo", "limit", "skip"]
-    params = {}
-    for i in range(len(name_args)):
-        flask_request = request.args.get(name_args[i])
-        if flask_request: params.update({name_args[i] : flask_request})
+    params = request_params(lambda args: observation_params(args, document_fields() if args.get("fields") else None))
 
-    if len(params) == 0 and len(request.args.keys()) > 0:
-        abort(400, "Arguments provided are not supported.")
-        
-    if not "limit" in params: 
-        params["limit"] = 100
-    else:
-        params["limit"] = int(params["limit"])
-        if params["limit"] > 1000: 
-            params["limit"] = 1000
-    if not "skip" in params: 
-        params["skip"] = 0
-    else: 
-        params["skip"] = int(params["skip"])
-
-    data = query(params)
-    count = data["count"]
-    if count != 0:
-        documents = data["items"]
-        for item in documents:
-            del item['_id']
-
-        return {"count": count, "items": documents}
-    else:
-        return {}
+    # exports: stream every matching document as it comes off the cursor, no limit cap
+    if request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        params = export_params(params)
+        def generate():
+            for doc in stream(params):
+                yield dumps(doc) + b"\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    layout = params.pop("layout", "records")
+    with phase("query"):
+        data = query(params)
+    with phase("serialize"):
+        return jsonify(observations_body(data, layout, params.get("fields")))
+
+# Chart-sized version of one field: the reduction runs here, only `points` points are sent
+@app.route('/api/observations/downsample',methods=['GET'])
+@cache_response
+def observations_downsample():
+    start = time.perf_counter()
+    filters, x, field, points, method, extra = request_params(downsample_params)
+    with phase("query"):
+        documents = list(series(filters, x, field, extra))
+    try:
+        with phase("pandas"):
+            result = downsample_body(documents, x, field, points, method, extra)
+    except ValueError as e:
+        abort(400, str(e))
+    with phase("serialize"):
+        response = jsonify(result)
+    return timed(response, start)
+
+# Heatmap cells: points are binned here, only a few hundred cells are sent
+@app.route('/api/grid',methods=['GET'])
+@cache_response
+def grid_cells():
+    start = time.perf_counter()
+    filters, shape, cell_m = request_params(grid_params)
+    with phase("query"):
+        documents = list(grid(filters, GRID_FIELDS))
+    with phase("pandas"):
+        result = grid_body(documents, shape, cell_m)
+    with phase("serialize"):
+        response = jsonify(result)
+    return timed(response, start)
+
+# Query plan of the /api/observations call with the same arguments, to catch COLLSCAN regressions
+@app.route('/api/debug/explain',methods=['GET'])
+def debug_explain():
+    # plans can contain ObjectIds (cursor bounds), the serializer stringifies them
+    params = request_params(observation_params)
+    params.pop("layout", None)
+    return jsonify(explain(params))
 
 @app.route('/api/stats',methods=['GET'])
+@cache_response
 def stats():
-    documents = (query({})).get("items")
-    df = pd.DataFrame(documents)
-    return jsonify((df.describe()).to_dict(orient='dict'))
+    start = time.perf_counter()
+    mode = request.args.get("mode", STATS_MODE)
+    used = mode
+    if mode == "incremental":
+        with phase("query"):
+            result = get_stats()
+    elif mode == "pushdown":
+        try:
+            with phase("query"):
+                result = stats_pushdown()
+        except OperationFailure as e:
+            if not pushdown_unsupported(e):
+                raise
+            print(f"Stats pushdown not supported by the server, using the incremental stats: {e}")
+            used = "incremental"
+            with phase("query"):
+                result = get_stats()
+    elif mode == "pandas":
+        with phase("query"):
+            items = query({}).get("items")
+        with phase("pandas"):
+            result = pandas_stats(items)
+    else:
+        abort(400, "Arguments provided are not supported.")
+    with phase("serialize"):
+        response = jsonify(result)
+    if used != mode:
+        fallback(response, used)
+    return timed(response, start)
 
 @app.route('/api/outliers',methods=['GET'])
+@cache_response
 def outliers():
-    name_args = ["field", "method", "k"]
-    params = {}
-    for i in range(len(name_args)):
-        flask_request = request.args.get(name_args[i])
-        if flask_request: params.update({name_args[i] : flask_request})
-    
-    if (name_args == list(params.keys())) and (params["method"] == "z-score" or params["method"] == "iqr"): 
-        documents = (query({})).get("items")
-        df = pd.DataFrame(documents).select_dtypes(include=['number'])
-
-        if params["method"] == "z-score":
-            df_zscore = (df - df.mean()) / df.std(ddof=0)
-            outliers = df[(df_zscore.abs() > float(params["k"])).any(axis=1)]
-            return {"count": str(len(outliers)), "items": outliers.to_dict(orient="records")}
-
-        elif params["method"] == "iqr":
-            df_IQR = pd.DataFrame()
-            for column in df.columns:
-                Q1 = df[column].quantile(0.25)
-                Q3 = df[column].quantile(0.75)
-                IQR = Q3 - Q1
-                lower_bound = Q1 - float(params["k"]) * IQR
-                upper_bound = Q3 + float(params["k"]) * IQR
-                outliers_columns = df[(df[column].abs() < lower_bound) | (df[column].abs() > upper_bound)]
-                # avoid duplicates if an entire row is an outlier among several columns
-                df_IQR = pd.concat([df_IQR, outliers_columns]).drop_duplicates()
-
-            return {"count": str(len(df_IQR)), "items": df_IQR.to_dict(orient="records")}
-    else:
-        abort(400, "Arguments provided are not supported.")
+    start = time.perf_counter()
+    # unknown fields are a 400 in pandas and pushdown mode alike
+    method, k, field, mode, layout = request_params(lambda args: outlier_params(args, numeric_fields()))
+
+    if mode == "pushdown":
+        try:
+            with phase("query"):
+                result = outliers_pushdown(method, k, field)
+            with phase("serialize"):
+                response = jsonify(outliers_body(result["items"], layout))
+            return timed(response, start)
+        except OperationFailure as e:
+            if not pushdown_unsupported(e):
+                raise
+            print(f"Outliers pushdown not supported by the server, using pandas: {e}")
+
+    with phase("query"):
+        items = query({}).get("items")
+    try:
+        with phase("pandas"):
+            result = pandas_outliers(items, method, k, field, layout)
+    except ValueError as e:
+        abort(400, str(e))
+    with phase("serialize"):
+        response = jsonify(result)
+    if mode == "pushdown":
+        fallback(response, "pandas")
+    return timed(response, start)
+
+# Prometheus scrape target: request, phase and MongoDB command metrics of this worker
+@app.route('/api/metrics',methods=['GET'])
+def prometheus_metrics():
+    record_pool(pool_monitor.report())
+    return Response(render(), content_type=CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5050)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+# Spatial binning behind /api/grid: observations are grouped into square or
+# hexagonal cells about cell_m meters across, and every cell gets the count,
+# mean, min and max of the GRID_FIELDS. Positions are projected to meters
+# around a reference latitude (the whole degree nearest the data), so the
+# cells are the same for every query over the same part of the bay.
+
+SHAPES = ["square", "hex"]
+GRID_FIELDS = ["Temperature (c)", "pH", "ODO mg/L"]
+LATITUDE = "Latitude"
+LONGITUDE = "Longitude"
+METERS_PER_DEGREE = 111320.0
+
+
+def reference_latitude(lat):
+    return float(np.round(np.mean(lat))) if len(lat) else 0.0
+
+
+def to_meters(lat, lon, ref_lat):
+    return lon * METERS_PER_DEGREE * np.cos(np.radians(ref_lat)), lat * METERS_PER_DEGREE
+
+
+def to_degrees(x, y, ref_lat):
+    """(lat, lon) of projected points."""
+    return y / METERS_PER_DEGREE, x / (METERS_PER_DEGREE * np.cos(np.radians(ref_lat)))
+
+
+def square_cells(x, y, size):
+    return np.stack([np.floor(x / size), np.floor(y / size)], axis=1).astype(np.int64)
+
+
+def square_centers(cells, size):
+    return (cells[:, 0] + 0.5) * size, (cells[:, 1] + 0.5) * size
+
+
+def hex_cells(x, y, size):
+    # pointy-top hexagons size meters apart, in axial coordinates; the point is
+    # rounded to the nearest hexagon in cube coordinates (q + r + s = 0)
+    radius = size / np.sqrt(3)
+    q = (np.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return np.stack([rq, rr], axis=1).astype(np.int64)
+
+
+def hex_centers(cells, size):
+    radius = size / np.sqrt(3)
+    q, r = cells[:, 0], cells[:, 1]
+    return radius * np.sqrt(3) * (q + r / 2), radius * 1.5 * r
+
+
+def cell_corners(shape, size):
+    """Corner offsets of a cell from its center, in meters, as an (n, 2) array."""
+    if shape == "hex":
+        angles = np.radians(30 + 60 * np.arange(6))
+        return np.stack([np.cos(angles), np.sin(angles)], axis=1) * size / np.sqrt(3)
+    half = size / 2
+    return np.array([[-half, -half], [half, -half], [half, half], [-half, half]])
+
+
+def cell_polygons(shape, size, ref_lat, lat, lon):
+    """Closed [lon, lat] rings of the cells centered on lat/lon, for GeoJSON."""
+    x, y = to_meters(np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64"), ref_lat)
+    corners = cell_corners(shape, size)
+    rings = []
+    for cx, cy in zip(x, y):
+        ring_lat, ring_lon = to_degrees(cx + corners[:, 0], cy + corners[:, 1], ref_lat)
+        ring = np.stack([ring_lon, ring_lat], axis=1).tolist()
+        rings.append(ring + ring[:1])
+    return rings
+
+
+def reduce_cells(values, order, starts):
+    """count, mean, min and max per cell of one column; NaN where a cell has no value."""
+    values = values[order]
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid, starts)
+    total = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    low = np.minimum.reduceat(np.where(valid, values, np.inf), starts)
+    high = np.maximum.reduceat(np.where(valid, values, -np.inf), starts)
+    empty = count == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(empty, np.nan, total / count)
+    return {"count": count, "mean": mean, "min": np.where(empty, np.nan, low), "max": np.where(empty, np.nan, high)}
+
+
+def bin_points(lat, lon, columns, shape="square", size=25.0):
+    """Cells holding at least one point: their center, number of points and the stats of every column."""
+    rows = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    lat, lon = lat[rows], lon[rows]
+    ref_lat = reference_latitude(lat)
+    x, y = to_meters(lat, lon, ref_lat)
+    cells = hex_cells(x, y, size) if shape == "hex" else square_cells(x, y, size)
+
+    ids, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # points sorted by cell, so every cell is one slice for the ufunc reduceat calls
+    order = np.argsort(inverse, kind="stable")
+    counts = np.bincount(inverse, minlength=len(ids))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+    cx, cy = hex_centers(ids, size) if shape == "hex" else square_centers(ids, size)
+    center_lat, center_lon = to_degrees(cx, cy, ref_lat)
+    if len(ids):
+        stats = {name: reduce_cells(values[rows], order, starts) for name, values in columns.items()}
+    else:
+        # reduceat needs at least one slice
+        stats = {name: {k: np.array([]) for k in ["count", "mean", "min", "max"]} for name in columns}
+    return {"ref_lat": ref_lat, "points": len(rows), "lat": center_lat, "lon": center_lon,
+            "count": counts, "stats": stats}
+
+
+def grid_arrays(documents, fields=GRID_FIELDS):
+    """(lat, lon, {field: values}) float arrays of the documents, NaN where missing."""
+    frame = pd.DataFrame(list(documents), columns=[LATITUDE, LONGITUDE, *fields])
+    numbers = frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    return numbers[:, 0], numbers[:, 1], {field: numbers[:, i + 2] for i, field in enumerate(fields)}
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, GEOSPHERE
+
+# Indexes the API relies on. Every managed index has the "wq_" prefix, so
+# ensure_indexes() can tell them apart from ones created by hand and drop
+# the managed ones that are no longer declared here.
+
+PREFIX = "wq_"
+INDEXES = [
+    # natural key looked up in bulk and used as the upsert filter by upload_MONGO;
+    # partial so documents stored before keys existed don't collide on null
+    {"name": "wq_key", "keys": [("_key", ASCENDING)], "unique": True,
+     "partialFilterExpression": {"_key": {"$exists": True}}},
+    # sort order of /api/observations pages and the start/end range
+    {"name": "wq_timestamp_id", "keys": [("timestamp", ASCENDING), ("_id", ASCENDING)]},
+    # survey= pages, in page order
+    {"name": "wq_survey_timestamp", "keys": [("meta.survey", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]},
+    # bbox and near/radius_m, alone or with a time range
+    {"name": "wq_location_timestamp", "keys": [("location", GEOSPHERE), ("timestamp", ASCENDING)]},
+    # single range filters
+    {"name": "wq_time", "keys": [("Time hh:mm:ss", ASCENDING)]},
+    {"name": "wq_temperature", "keys": [("Temperature (c)", ASCENDING)]},
+    {"name": "wq_ph", "keys": [("pH", ASCENDING)]},
+    {"name": "wq_odo", "keys": [("ODO mg/L", ASCENDING)]},
+    # combined filters walk this one in page order and check every range on the keys, without fetching
+    {"name": "wq_timestamp_readings", "keys": [("timestamp", ASCENDING), ("Temperature (c)", ASCENDING),
+                                               ("pH", ASCENDING), ("ODO mg/L", ASCENDING)]},
+]
+# time-series collections don't support unique indexes: the key stays a plain
+# lookup index there, and upload_MONGO reinserts a changed row before deleting the old one
+TIMESERIES_INDEXES = [{"name": "wq_key", "keys": [("_key", ASCENDING)]}] + [
+    index for index in INDEXES if index["name"] != "wq_key"]
+
+
+def same_index(existing, declared):
+    options = {k: v for k, v in declared.items() if k not in ["name", "keys"]}
+    if [tuple(k) for k in existing["key"]] != [tuple(k) for k in declared["keys"]]:
+        return False
+    return all(existing.get(k) == v for k, v in options.items())
+
+
+def ensure_indexes(collection, indexes=INDEXES):
+    """Create missing indexes, rebuild changed ones and drop stale managed ones."""
+    report = {"created": [], "rebuilt": [], "dropped": [], "kept": []}
+    existing = collection.index_information()
+    declared = {index["name"]: index for index in indexes}
+
+    for name in existing:
+        if name.startswith(PREFIX) and name not in declared:
+            collection.drop_index(name)
+            report["dropped"].append(name)
+
+    for name, index in declared.items():
+        options = {k: v for k, v in index.items() if k != "keys"}
+        if name in existing:
+            if same_index(existing[name], index):
+                report["kept"].append(name)
+                continue
+            collection.drop_index(name)
+            report["rebuilt"].append(name)
+        else:
+            report["created"].append(name)
+        collection.create_index(index["keys"], **options)
+    return report
+
+
+def plan_stages(plan):
+    """Stage names of a winning plan, outermost first (e.g. ['LIMIT', 'FETCH', 'IXSCAN'])."""
+    stages = []
+    while plan:
+        # slot-based plans nest the classic tree under "queryPlan"
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            plan = plan["inputStages"][0]
+        else:
+            plan = plan.get("queryPlan")
+    return stages
+
+
+def find_index_names(plan):
+    if isinstance(plan, dict):
+        if "indexName" in plan:
+            yield plan["indexName"]
+        for value in plan.values():
+            yield from find_index_names(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from find_index_names(value)
+
+
+def summarize_explain(explain):
+    # aggregations that aren't fully pushed into the query layer report the plan under their first stage
+    if "stages" in explain:
+        explain = explain["stages"][0].get("$cursor", {})
+    planner = explain.get("queryPlanner", {})
+    execution = explain.get("executionStats", {})
+    winning_plan = planner.get("winningPlan", {})
+    stages = plan_stages(winning_plan)
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "indexes": sorted(set(find_index_names(winning_plan))),
+        "keysExamined": execution.get("totalKeysExamined"),
+        "docsExamined": execution.get("totalDocsExamined"),
+        "nReturned": execution.get("nReturned"),
+        "executionTimeMillis": execution.get("executionTimeMillis"),
+        "winningPlan": winning_plan,
+    }
+
+
+if __name__ == '__main__':
+    from mongoDB import get_collection, declared_indexes
+    print(ensure_indexes(get_collection(), declared_indexes()))
@@ -0,0 +1,279 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pymongo import UpdateOne
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+
+# Ingestion pipeline behind /api/upload: request bodies are parsed lazily
+# (JSON, NDJSON or CSV, optionally gzip-compressed), cut into bounded batches
+# and written by a small worker pool. At most MAX_PENDING batches are in
+# flight, so a huge upload never sits in memory all at once.
+
+BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", 1000))
+MAX_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+MAX_PENDING = MAX_WORKERS * 2
+# characters of a JSON body read at a time
+JSON_CHUNK = 1 << 16
+CONTENT_TYPES = ["application/json", "application/x-ndjson", "text/csv"]
+# survey date + sonde timestamp; the GPS "Time" (mm:ss.f) tells apart the
+# several rows logged within the same second
+KEY_FIELDS = ["Date m/d/y   ", "Time hh:mm:ss", "Time"]
+# the survey date and sonde time of a row, combined into a real datetime
+# (stored as a BSON date) so date ranges are index range scans. It is the
+# sonde's local wall-clock time, kept as it was logged: the logs carry no zone
+DATE_FIELD = "Date m/d/y   "
+TIME_FIELD = "Time hh:mm:ss"
+TIMESTAMP_FIELD = "timestamp"
+TIMESTAMP_FORMAT = "%m/%d/%y %H:%M:%S"
+# which survey a row belongs to: the vehicle that logged it and the survey day,
+# the metaField of the time-series storage (see mongoDB.py)
+META_FIELD = "meta"
+VEHICLE = os.getenv("VEHICLE", "asv_1")
+# GeoJSON point of the GPS fix, behind the 2dsphere index of bbox/near queries
+LATITUDE_FIELD = "Latitude"
+LONGITUDE_FIELD = "Longitude"
+LOCATION_FIELD = "location"
+# computed from the other fields, so left out of the content hash
+DERIVED_FIELDS = [TIMESTAMP_FIELD, META_FIELD, LOCATION_FIELD]
+
+
+def parse_value(value):
+    # CSV cells come in as text, give them the types pandas would have sent as JSON
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def read_documents(stream, content_type, content_encoding=None):
+    """Iterate over the documents of a request body without decoding it all up front."""
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"Request must be one of {CONTENT_TYPES}")
+    if content_encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream)
+    elif content_encoding not in [None, "", "identity"]:
+        raise ValueError(f"Unsupported Content-Encoding {content_encoding}")
+
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if content_type == "application/json":
+        return json_documents(text)
+    if content_type == "application/x-ndjson":
+        return (document(json.loads(line)) for line in text if line.strip())
+    return csv_documents(text)
+
+
+def document(value):
+    if not isinstance(value, dict):
+        raise ValueError(f"Documents must be JSON objects, got {type(value).__name__}")
+    return value
+
+
+def json_documents(text, chunk_size=JSON_CHUNK):
+    """Objects of a JSON body (one object or an array of them), decoded one at a time as the body is read."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+
+    def peek():
+        # next non-blank character, reading on as needed; "" at the end of the body
+        nonlocal buffer, pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            buffer, pos = text.read(chunk_size), 0
+            if not buffer:
+                return ""
+
+    def next_object():
+        nonlocal buffer, pos
+        if peek() != "{":
+            raise ValueError("Documents must be JSON objects")
+        while True:
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+                return value
+            except json.JSONDecodeError:
+                # the object goes on in the next chunk, unless the body ended
+                chunk = text.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+
+    start = peek()
+    if start == "{":
+        yield next_object()
+    elif start == "[":
+        pos += 1
+        if peek() == "]":
+            pos += 1
+        else:
+            while True:
+                yield next_object()
+                separator = peek()
+                pos += 1
+                if separator == "]":
+                    break
+                if separator != ",":
+                    raise ValueError("Malformed JSON array: expected ',' or ']'")
+    else:
+        raise ValueError("JSON body must be an object or an array of objects")
+    if peek():
+        raise ValueError("Unexpected data after the JSON body")
+
+
+def csv_documents(text):
+    reader = csv.DictReader(text)
+    try:
+        for row in reader:
+            # DictReader puts the cells past the header in a list under None
+            if None in row:
+                raise ValueError(f"CSV line {reader.line_num} has more cells than the header")
+            yield {key: parse_value(value) for key, value in row.items()}
+    except csv.Error as e:
+        raise ValueError(f"Malformed CSV at line {reader.line_num}: {e}")
+
+
+def natural_key(doc):
+    return "|".join(str(doc.get(field)).strip() for field in KEY_FIELDS)
+
+
+def content_hash(doc):
+    """Stable hash of the row's values; ints and floats hash alike so CSV and JSON uploads match."""
+    values = {key: float(value) if isinstance(value, int) and not isinstance(value, bool) else value
+              for key, value in doc.items() if not key.startswith("_") and key not in DERIVED_FIELDS}
+    canonical = json.dumps(values, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def timestamp(doc):
+    """datetime of the row's date and time columns, None if either is missing or malformed."""
+    try:
+        return datetime.strptime(f"{str(doc[DATE_FIELD]).strip()} {str(doc[TIME_FIELD]).strip()}", TIMESTAMP_FORMAT)
+    except (KeyError, ValueError):
+        return None
+
+
+def location(doc):
+    """GeoJSON point of the row's coordinates, None without a valid fix."""
+    try:
+        lat = float(doc[LATITUDE_FIELD])
+        lon = float(doc[LONGITUDE_FIELD])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def derived_fields(doc):
+    fields = {}
+    value = timestamp(doc)
+    if value is not None:
+        fields[TIMESTAMP_FIELD] = value
+        fields[META_FIELD] = {"vehicle": VEHICLE, "survey": value.date().isoformat()}
+    point = location(doc)
+    if point is not None:
+        fields[LOCATION_FIELD] = point
+    return fields
+
+
+def derived_names(doc):
+    # which derived fields a row has; a stored row missing one the upload has is rewritten
+    return tuple(field for field in DERIVED_FIELDS if field in doc)
+
+
+def with_key(doc):
+    doc["_key"] = natural_key(doc)
+    doc["_hash"] = content_hash(doc)
+    doc.update(derived_fields(doc))
+    return doc
+
+
+def batches(documents, size=BATCH_SIZE):
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def lane_batches(documents, size=BATCH_SIZE, lanes=1, key=None):
+    """(lane, batch) pairs; with key, documents are spread on the lanes by key(doc), so one key stays in one lane."""
+    if key is None:
+        for batch in batches(documents, size):
+            yield None, batch
+        return
+    filling = [[] for _ in range(lanes)]
+    for doc in documents:
+        lane = hash(key(doc)) % lanes
+        filling[lane].append(doc)
+        if len(filling[lane]) == size:
+            yield lane, filling[lane]
+            filling[lane] = []
+    for lane, batch in enumerate(filling):
+        if batch:
+            yield lane, batch
+
+
+def run_batches(documents, write_batch, size=BATCH_SIZE, workers=MAX_WORKERS, key=None):
+    """Call write_batch(index, batch) on a worker pool and return its results in batch order.
+    With key, a lane of documents runs one batch at a time, so batches in flight never share a key."""
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        running = {}
+        for index, (lane, batch) in enumerate(lane_batches(documents, size, workers, key)):
+            if running.get(lane) in pending:
+                pending.remove(running[lane])
+                results.append(running[lane].result())
+            # backpressure: stop reading the body until a slot frees up
+            if len(pending) >= MAX_PENDING:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            future = pool.submit(write_batch, index, batch)
+            pending.add(future)
+            if lane is not None:
+                running[lane] = future
+        results.extend(future.result() for future in wait(pending).done)
+    return sorted(results, key=lambda result: result["batch"])
+
+
+def backfill(collection):
+    """Add _key/_hash and the derived fields to documents stored before they existed."""
+    operations = []
+    updated = 0
+    missing = {"$or": [{field: {"$exists": False}} for field in ["_key", *DERIVED_FIELDS]]}
+    for doc in collection.find(missing):
+        fields = {"_key": natural_key(doc), "_hash": content_hash(doc), **derived_fields(doc)}
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(operations) == BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+if __name__ == '__main__':
+    # python ingest.py backfill
+    if len(sys.argv) != 2 or sys.argv[1] != "backfill":
+        print("Usage: python ingest.py backfill")
+        sys.exit(1)
+    from mongoDB import get_collection
+    print(f"Added keys and derived fields to {backfill(get_collection())} documents")
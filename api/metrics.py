@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from pymongo import monitoring
+import bisect
+import threading
+import time
+
+# Request and MongoDB instrumentation of the Flask API, served in the Prometheus
+# text format on /api/metrics. Every request is timed from before_request to
+# after_request, route handlers wrap their query / pandas / serialize steps in
+# phase(), and CommandMonitor (registered on the MongoClient by
+# mongoConnection.py) records the duration and document count of every command
+# the driver sends. Values live in the worker process: with several gunicorn
+# workers, each scrape sees the worker that answered it.
+#
+#   http_requests_total{method, route, status}
+#   http_request_duration_seconds{method, route}        until the response is built, compression included
+#   http_phase_duration_seconds{route, phase}           query, pandas, serialize
+#   mongodb_commands_total{command, outcome}            succeeded, failed
+#   mongodb_command_duration_seconds{command}           round trip reported by the driver
+#   mongodb_command_documents{command}                  documents returned (find, aggregate, getMore) or written
+#   mongodb_pool_connections{state}                     open, in_use
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+DOCUMENT_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000, 1000000]
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def sample(name, labels, value):
+    text = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+    return f"{name}{{{text}}} {number(value)}" if text else f"{name} {number(value)}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield sample(self.name, zip(self.labels, labels), value)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # per label values: counts of each bucket (not cumulative, the last is +Inf), then sum
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        for labels, counts in values:
+            labels = list(zip(self.labels, labels))
+            total = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                total += count
+                yield sample(self.name + "_bucket", labels + [("le", number(bound))], total)
+            yield sample(self.name + "_sum", labels, counts[-1])
+            yield sample(self.name + "_count", labels, total)
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests answered.", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to build the response.", ["method", "route"])
+PHASE_SECONDS = Histogram("http_phase_duration_seconds", "Time spent in one phase of a request.", ["route", "phase"])
+COMMANDS = Counter("mongodb_commands_total", "MongoDB commands sent.", ["command", "outcome"])
+COMMAND_SECONDS = Histogram("mongodb_command_duration_seconds", "MongoDB command round trip.", ["command"])
+COMMAND_DOCUMENTS = Histogram("mongodb_command_documents", "Documents returned or written by a MongoDB command.",
+                              ["command"], DOCUMENT_BUCKETS)
+POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Connections of the MongoDB pool.", ["state"])
+REGISTRY = [REQUESTS, REQUEST_SECONDS, PHASE_SECONDS, COMMANDS, COMMAND_SECONDS, COMMAND_DOCUMENTS, POOL_CONNECTIONS]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def record_pool(report):
+    POOL_CONNECTIONS.set(("open",), report["open"])
+    POOL_CONNECTIONS.set(("in_use",), report["inUse"])
+
+
+def route_label():
+    # the rule, not the path, so /api/observations?limit=5 and ?limit=6 are one series
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def start_request():
+    """before_request hook."""
+    g.request_start = time.perf_counter()
+    g.phases = {}
+
+
+def finish_request(response):
+    """after_request hook, registered first so it runs after the others (compression included)."""
+    start = g.get("request_start")
+    if start is not None:
+        route = route_label()
+        REQUESTS.inc((request.method, route, str(response.status_code)))
+        REQUEST_SECONDS.observe((request.method, route), time.perf_counter() - start)
+    return response
+
+
+@contextmanager
+def phase(name):
+    """Times the block as phase `name` of the current request; nothing is recorded outside a request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if has_request_context():
+            PHASE_SECONDS.observe((route_label(), name), elapsed)
+            phases = g.setdefault("phases", {})
+            phases[name] = phases.get(name, 0.0) + elapsed
+
+
+def phase_timings():
+    """{phase: seconds} of the current request so far."""
+    return dict(g.get("phases", {})) if has_request_context() else {}
+
+
+def reply_documents(reply):
+    # find, aggregate and getMore return a batch; insert, update and delete report n
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "n" in reply:
+        return reply["n"]
+    return None
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Duration, outcome and document count of every command, per command name."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        COMMANDS.inc((event.command_name, "succeeded"))
+        COMMAND_SECONDS.observe((event.command_name,), event.duration_micros / 1e6)
+        documents = reply_documents(event.reply)
+        if documents is not None:
+            COMMAND_DOCUMENTS.observe((event.command_name,), documents)
+
+    def failed(self, event):
+        COMMANDS.inc((event.command_name, "failed"))
+        COMMAND_SECONDS.observe((event.command_name,), event.duration_micros / 1e6)
+
+
+command_monitor = CommandMonitor()
@@ -0,0 +1,218 @@
+from collections import deque
+from pymongo import AsyncMongoClient, monitoring
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+from metrics import command_monitor
+import asyncio
+import os
+import threading
+import time
+
+# Connection manager for MongoDB. The client is only built on first use, so
+# importing the API doesn't pay for DNS (mongodb+srv) and the connection pool,
+# and one client is shared by every thread of the worker.
+#
+#   MONGO_MAX_POOL_SIZE            connections per server (default 50)
+#   MONGO_MIN_POOL_SIZE            connections kept open when idle (default 0)
+#   MONGO_MAX_IDLE_MS              close pooled connections idle this long (default 60000)
+#   MONGO_CONNECT_TIMEOUT_MS       opening a connection (default 5000)
+#   MONGO_SERVER_SELECTION_MS      waiting for a usable server (default 5000)
+#   MONGO_SOCKET_TIMEOUT_MS        a single operation, unset = no limit
+#   MONGO_WAIT_QUEUE_TIMEOUT_MS    waiting for a free pooled connection, unset = no limit
+#   MONGO_READ_PREFERENCE          primary (default), primaryPreferred, secondary, ...
+#   HEALTH_PING_INTERVAL           seconds a ping result is reused by /api/health (default 5)
+#   MONGO_URI                      full connection string instead of the MONGO_USR/MONGO_PSS/MONGO_DOMAIN
+#                                  Atlas one, e.g. mongodb://localhost:27017 for a local mongod
+#   MONGO_DATABASE                 database name (default water_quality_data)
+
+load_dotenv()
+DATABASE = os.getenv("MONGO_DATABASE", "water_quality_data")
+HEALTH_PING_INTERVAL = float(os.getenv("HEALTH_PING_INTERVAL", 5))
+CHECKOUT_SAMPLES = 500
+
+
+def optional_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def client_options():
+    options = {
+        "maxPoolSize": optional_int("MONGO_MAX_POOL_SIZE", 50),
+        "minPoolSize": optional_int("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": optional_int("MONGO_MAX_IDLE_MS", 60000),
+        "connectTimeoutMS": optional_int("MONGO_CONNECT_TIMEOUT_MS", 5000),
+        "serverSelectionTimeoutMS": optional_int("MONGO_SERVER_SELECTION_MS", 5000),
+        "socketTimeoutMS": optional_int("MONGO_SOCKET_TIMEOUT_MS"),
+        "waitQueueTimeoutMS": optional_int("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+    }
+    return {k: v for k, v in options.items() if v is not None}
+
+
+def mongo_uri():
+    if os.getenv("MONGO_URI"):
+        return os.getenv("MONGO_URI")
+    USERNAME = os.getenv('MONGO_USR')
+    PASSWORD = os.getenv('MONGO_PSS')
+    DOMAIN = os.getenv('MONGO_DOMAIN')
+    if not (USERNAME and PASSWORD and DOMAIN):
+        raise RuntimeError("MONGO_URI or MONGO_USR, MONGO_PSS and MONGO_DOMAIN must be set")
+    return "mongodb+srv://" + USERNAME + ":" + PASSWORD + DOMAIN + "/?retryWrites=true&w=majority&appName=bbp"
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Keeps the recent checkout times and the number of open / checked out connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = deque(maxlen=CHECKOUT_SAMPLES)
+        self.open = 0
+        self.in_use = 0
+        self.failed_checkouts = 0
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.in_use += 1
+            if event.duration is not None:
+                self.checkouts.append(event.duration * 1000)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.failed_checkouts += 1
+
+    # events the pool also publishes, nothing to keep from them
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+
+    def report(self):
+        with self.lock:
+            samples = sorted(self.checkouts)
+            report = {"open": self.open, "inUse": self.in_use, "failedCheckouts": self.failed_checkouts}
+        if samples:
+            report["checkoutMs"] = {"last": round(self.checkouts[-1], 3),
+                                    "mean": round(sum(samples) / len(samples), 3),
+                                    "p95": round(samples[int(0.95 * (len(samples) - 1))], 3),
+                                    "max": round(samples[-1], 3),
+                                    "samples": len(samples)}
+        return report
+
+
+pool_monitor = PoolMonitor()
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    """The shared MongoClient, created on first call."""
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                client = MongoClient(mongo_uri(), server_api=ServerApi('1'),
+                                     event_listeners=[pool_monitor, command_monitor], **client_options())
+    return client
+
+
+def get_db():
+    return get_client()[DATABASE]
+
+
+# asyncWebApp.py uses an AsyncMongoClient with the same settings; it is bound to
+# the event loop that first uses it, so there is one per worker process
+async_client = None
+
+
+def get_async_client():
+    global async_client
+    if async_client is None:
+        async_client = AsyncMongoClient(mongo_uri(), server_api=ServerApi('1'),
+                                        event_listeners=[pool_monitor, command_monitor], **client_options())
+    return async_client
+
+
+def get_async_db():
+    return get_async_client()[DATABASE]
+
+
+last_ping = None
+ping_lock = threading.Lock()
+
+
+def ping():
+    """Result of the latest ping, sent again at most every HEALTH_PING_INTERVAL seconds."""
+    global last_ping
+    if last_ping is not None and time.monotonic() - last_ping["at"] < HEALTH_PING_INTERVAL:
+        return last_ping
+    # one thread pings, the others keep answering with the previous result meanwhile
+    if not ping_lock.acquire(blocking=last_ping is None):
+        return last_ping
+    try:
+        if last_ping is not None and time.monotonic() - last_ping["at"] < HEALTH_PING_INTERVAL:
+            return last_ping
+        start = time.perf_counter()
+        try:
+            get_db().command("ping")
+            result = {"ok": True, "latencyMs": round((time.perf_counter() - start) * 1000, 3)}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        result["at"] = time.monotonic()
+        last_ping = result
+        return result
+    finally:
+        ping_lock.release()
+
+
+async_ping_lock = None
+
+
+async def ping_async():
+    """ping() for the event loop: concurrent probes share the one in flight."""
+    global last_ping, async_ping_lock
+    if last_ping is not None and time.monotonic() - last_ping["at"] < HEALTH_PING_INTERVAL:
+        return last_ping
+    if async_ping_lock is None:
+        async_ping_lock = asyncio.Lock()
+    if async_ping_lock.locked() and last_ping is not None:
+        return last_ping
+    async with async_ping_lock:
+        if last_ping is not None and time.monotonic() - last_ping["at"] < HEALTH_PING_INTERVAL:
+            return last_ping
+        start = time.perf_counter()
+        try:
+            await get_async_db().command("ping")
+            result = {"ok": True, "latencyMs": round((time.perf_counter() - start) * 1000, 3)}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        result["at"] = time.monotonic()
+        last_ping = result
+        return result
+
+
+def health(result=None):
+    """Ping result plus the state of the connection pool, for /api/health."""
+    result = result or ping()
+    report = {"ok": result["ok"], "checkedSecondsAgo": round(time.monotonic() - result["at"], 3)}
+    if result["ok"]:
+        report["pingMs"] = result["latencyMs"]
+    else:
+        report["error"] = result["error"]
+    report["pool"] = pool_monitor.report()
+    return report
@@ -1,39 +1,215 @@
-from pymongo import ASCENDING, ReplaceOne
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from datetime import datetime
+import base64
+import json
+import math
 import os
+import sys
+import threading
 import time
+import indexManager
+import ingest
+import mongoConnection
+import statsEngine
 
-load_dotenv()
-try:
-    USERNAME = os.getenv('MONGO_USR')
-    PASSWORD = os.getenv('MONGO_PSS')
-    DOMAIN = os.getenv('MONGO_DOMAIN')
-    uri = "mongodb+srv://" + USERNAME + ":" + PASSWORD + DOMAIN + "/?retryWrites=true&w=majority&appName=bbp"
-    client = MongoClient(uri, server_api=ServerApi('1'))
-    db = client['water_quality_data']
-    collection = db['asv_1']
-    mongo_OK = True
-except Exception:
-    mongo_OK = False
-    print(f"Error connecting to Mongo: {Exception}")
-
-# Create a new client and connect to the server
-def upload_MONGO(documents):
-    # waits 1 seconds in case more than one user uploads data at the same time
-    time.sleep(1)
+# Storage of the observations, chosen with MONGO_STORAGE:
+#   "collection" every survey in the plain asv_1 collection (default)
+#   "timeseries" asv_1_ts, a MongoDB time-series collection bucketed by survey
+#                (meta: vehicle and survey day) on the real timestamp, so data
+#                is stored compressed and time ranges only open the matching
+#                buckets. Fill it from asv_1 with `python mongoDB.py migrate`.
+STORAGE = os.getenv("MONGO_STORAGE", "collection")
+COLLECTIONS = {"collection": "asv_1", "timeseries": "asv_1_ts"}
+TIMESERIES_OPTIONS = {"timeField": ingest.TIMESTAMP_FIELD, "metaField": ingest.META_FIELD, "granularity": "seconds"}
+
+def collection_name(storage=None):
+    return COLLECTIONS[storage or STORAGE]
+
+# Collections are looked up through the lazily created client of mongoConnection,
+# so nothing connects until the first query
+def get_db():
+    return mongoConnection.get_db()
+
+def get_collection():
+    return get_db()[collection_name()]
+
+def get_stats_collection():
+    # the running stats describe the collection being served
+    return get_db()[collection_name() + '_stats']
+
+META_COLLECTION = 'asv_1_meta'
+
+def get_meta_collection():
+    return get_db()[META_COLLECTION]
+
+def declared_indexes():
+    return indexManager.TIMESERIES_INDEXES if STORAGE == "timeseries" else indexManager.INDEXES
+
+def ensure_indexes():
+    try:
+        print(f"Indexes: {indexManager.ensure_indexes(get_collection(), declared_indexes())}")
+        if STORAGE == "timeseries" and not timeseries_supported(get_db()):
+            print(f"Warning: uploads that change rows of {collection_name()} need MongoDB "
+                  f"{'.'.join(map(str, TIMESERIES_MIN_VERSION))} or later")
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
+def ensure_indexes_in_background():
+    # at startup of both web apps; in the background, so a cold worker answers
+    # before MongoDB has been reached
+    threading.Thread(target=ensure_indexes, daemon=True).start()
+
+# Data generation: bumped after every upload that wrote something, read by the
+# response cache to know which cached responses are still valid. It is kept in
+# memory for GENERATION_TTL seconds, so cache hits and 304s don't wait on
+# MongoDB; an upload updates this worker's copy at once, other workers see it
+# within GENERATION_TTL (0 reads it on every request, for exact invalidation).
+GENERATION_TTL = float(os.getenv("GENERATION_TTL", 2))
+generation = {"at": None, "value": 0}
+
+def remember_generation(value):
+    # generations only grow: a read that raced with a bump here must not undo it
+    generation.update(at = time.monotonic(), value = max(value, generation["value"]))
+    return generation["value"]
+
+def cached_generation():
+    # None once the copy is older than GENERATION_TTL
+    if generation["at"] is not None and time.monotonic() - generation["at"] < GENERATION_TTL:
+        return generation["value"]
+    return None
 
-    # essentially tells it to override OLD duplicates with new duplicates
-    # if there's no duplicates, then just insert
+def current_generation():
+    value = cached_generation()
+    if value is not None:
+        return value
+    doc = get_meta_collection().find_one({"_id": "generation"})
+    return remember_generation(doc["value"] if doc else 0)
+
+def bump_generation():
+    doc = get_meta_collection().find_one_and_update({"_id": "generation"}, {"$inc": {"value": 1}}, upsert = True,
+                                                    return_document = ReturnDocument.AFTER)
+    remember_generation(doc["value"])
+
+def upload_batch(index, documents):
+    # one $in lookup tells which rows are new, changed or already stored as-is;
+    # only the first two are written (a repeated key in the batch keeps its last row)
+    batch = {}
+    for doc in documents:
+        doc = ingest.with_key(doc)
+        batch[doc["_key"]] = doc
+    # a stored row without the derived fields is rewritten too, so re-uploading
+    # fills them in, and so is a key stored twice (see write_timeseries)
+    stored = {}
+    for row in get_collection().find({"_key": {"$in": list(batch)}},
+                                     {"_key": 1, "_hash": 1, **{f: 1 for f in ingest.DERIVED_FIELDS}}):
+        stored.setdefault(row["_key"], []).append((row["_id"], row["_hash"], ingest.derived_names(row)))
+    changed = [doc for key, doc in batch.items()
+               if [version[1:] for version in stored.get(key, [])] != [(doc["_hash"], ingest.derived_names(doc))]]
+    skipped = len(documents) - len(changed)
+    if not changed:
+        return {"batch": index, "documents": len(documents), "skipped": skipped, "inserted": 0,
+                "replaced": 0, "errors": [], "stats": {}}
+
+    write = write_timeseries if STORAGE == "timeseries" else write_upserts
+    inserted, replaced, errors = write(changed, stored)
+    return {"batch": index, "documents": len(documents), "skipped": skipped, "inserted": len(inserted),
+            "replaced": replaced, "errors": errors, "stats": statsEngine.summarize_documents(inserted)}
+
+def write_upserts(changed, stored):
+    """(inserted documents, number replaced, error messages) of upserting changed rows on their key."""
     # upsert = update if possible, insert if not 
     operations = [
-        ReplaceOne(filter = {"Time":doc["Time"]}, replacement = doc, upsert = True)
-        for doc in documents
+        ReplaceOne(filter = {"_key": doc["_key"]}, replacement = doc, upsert = True)
+        for doc in changed
     ]
-    
-    result = collection.bulk_write(operations)
-    return f"Number of documents upserted: {result.upserted_count}, Number of documents modified: {result.modified_count}"
+    # unordered, so one bad row doesn't stop the rest of the batch
+    try:
+        result = get_collection().bulk_write(operations, ordered = False)
+        details = result.bulk_api_result
+        errors = []
+    except BulkWriteError as e:
+        details = e.details
+        errors = [error["errmsg"] for error in details["writeErrors"]]
+
+    inserted = [changed[item["index"]] for item in details["upserted"]]
+    return inserted, details["nModified"], errors
+
+def write_timeseries(changed, stored):
+    # time-series collections can't upsert: a changed row is inserted again and
+    # its stored versions are deleted by _id once the new one is written, so a
+    # rejected or interrupted write leaves the old row (at worst twice) instead of none
+    timed = [doc for doc in changed if ingest.TIMESTAMP_FIELD in doc]
+    errors = [f"Row {doc['_key']} has no valid date and time" for doc in changed if ingest.TIMESTAMP_FIELD not in doc]
+    failed = set()
+    if timed:
+        try:
+            get_collection().insert_many(timed, ordered = False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            errors += [error["errmsg"] for error in e.details["writeErrors"]]
+
+    written = [doc for i, doc in enumerate(timed) if i not in failed]
+    old_ids = [version[0] for doc in written for version in stored.get(doc["_key"], [])]
+    if old_ids:
+        get_collection().delete_many({"_id": {"$in": old_ids}})
+    inserted = [doc for doc in written if doc["_key"] not in stored]
+    return inserted, len(written) - len(inserted), errors
+
+def checked_upload_batch(index, documents):
+    # a batch that fails is reported in its own errors instead of aborting the
+    # upload; it may have written part of its rows before failing
+    try:
+        return upload_batch(index, documents)
+    except Exception as e:
+        print(f"Upload batch {index} failed: {e}")
+        return {"batch": index, "documents": len(documents), "skipped": 0, "inserted": 0, "replaced": 0,
+                "errors": [str(e)], "stats": {}, "failed": True}
+
+def finish_upload(results, rebuilds=None):
+    """Bring the running stats and the data generation up to date with the finished batches.
+    rebuilds is the stats rebuild count from before the batches were written."""
+    totals = {name: sum(result[name] for result in results) for name in ["skipped", "inserted", "replaced"]}
+    failed = any(result.get("failed") for result in results)
+    try:
+        # fold newly inserted rows into the running stats; a real replacement
+        # can't be subtracted from min/max/quantiles and a failed batch wrote
+        # an unknown part of its rows, so both fall back to a rebuild. So does a
+        # rebuild that ran since the upload started, which may have counted its rows
+        summary = {}
+        for result in results:
+            statsEngine.merge_summaries(summary, result["stats"])
+        if totals["replaced"] > 0 or failed or not statsEngine.apply_summary(get_stats_collection(), summary,
+                                                                             since = rebuilds):
+            statsEngine.rebuild(get_collection(), get_stats_collection())
+    finally:
+        if totals["inserted"] > 0 or totals["replaced"] > 0 or failed:
+            bump_generation()
+    return totals
+
+def upload_MONGO(documents):
+    results = []
+    def write(index, batch):
+        result = checked_upload_batch(index, batch)
+        results.append(result)
+        return result
+    rebuilds = statsEngine.rebuild_count(get_stats_collection())
+    # batches that finished are accounted for even if reading the rest of the body fails;
+    # batches are cut per key lane, so two batches written at once never hold the same key
+    try:
+        ingest.run_batches(documents, write, key = ingest.natural_key)
+    finally:
+        results.sort(key = lambda result: result["batch"])
+        totals = finish_upload(results, rebuilds)
+
+    failed = sum(1 for result in results if result.pop("failed", False))
+    for result in results:
+        del result["stats"]
+    message = f"Number of documents inserted: {totals['inserted']}, replaced: {totals['replaced']}, unchanged: {totals['skipped']}"
+    if failed:
+        message += f", failed batches: {failed}"
+    return {"message": message, **totals, "batches": results}
 
 
 def helper(field, value):
@@ -55,34 +231,456 @@ def helper(field, value):
             
     return {field_name: {selector: value}}
 
+def parse_iso(value):
+    """datetime of an ISO 8601 string without an offset: timestamps are the sonde's local wall-clock time,
+    which has no offset to convert from, so a value with one is rejected rather than shifted."""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(value.strip())
+        except (AttributeError, ValueError):
+            raise ValueError(f"Invalid ISO 8601 timestamp: {value}")
+    if parsed.tzinfo is not None:
+        raise ValueError(f"Timestamps are local survey time, without a UTC offset: {value}")
+    return parsed
+
+# start/end bound the real timestamp (local survey time), inclusive
+RANGE_ARGS = {"start": "$gte", "end": "$lte"}
+
+# bbox and near/radius_m select on the GeoJSON location with $geoWithin, which
+# the 2dsphere index serves inside the $match of a page; $nearSphere/$geoNear
+# would reorder the results by distance and can't be counted in the same query
+GEO_ARGS = ["bbox", "near", "radius_m"]
+EARTH_RADIUS_M = 6378100
+
+def parse_numbers(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except (AttributeError, ValueError):
+        numbers = []
+    if len(numbers) != count or not all(math.isfinite(number) for number in numbers):
+        raise ValueError(f"{name} must be {count} comma-separated numbers")
+    return numbers
+
+def bbox_filter(value):
+    """Rows inside a "min_lon,min_lat,max_lon,max_lat" box (the GeoJSON bbox order)."""
+    west, south, east, north = parse_numbers(value, 4, "bbox")
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    return {ingest.LOCATION_FIELD: {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+def near_filter(value, radius):
+    """Rows within radius meters of a "lat,lon" point."""
+    if value is None or radius is None:
+        raise ValueError("near and radius_m go together")
+    lat, lon = parse_numbers(value, 2, "near")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("near must be lat,lon")
+    radius = parse_numbers(radius, 1, "radius_m")[0]
+    if radius <= 0:
+        raise ValueError("radius_m must be positive")
+    return {ingest.LOCATION_FIELD: {"$geoWithin": {"$centerSphere": [[lon, lat], radius / EARTH_RADIUS_M]}}}
+
+def geo_filters(params):
+    """Filters of the bbox and near/radius_m arguments; ValueError if they are malformed."""
+    filters = []
+    if "bbox" in params:
+        filters.append(bbox_filter(params["bbox"]))
+    if "near" in params or "radius_m" in params:
+        filters.append(near_filter(params.get("near"), params.get("radius_m")))
+    return filters
+
+def build_filter(params):
+    temp = []
+    for key, val in params.items():
+        if key in GEO_ARGS:
+            continue
+        if key in RANGE_ARGS:
+            temp.append({ingest.TIMESTAMP_FIELD: {RANGE_ARGS[key]: parse_iso(val)}})
+            continue
+        if key == "survey":
+            temp.append({ingest.META_FIELD + ".survey": val})
+            continue
+        if not "time" in key:
+            val = float(val)
+        temp.append(helper(key, val))
+
+    temp.extend(geo_filters(params))
+
+    if len(temp) == 1:
+        return temp[0]
+    elif len(temp) > 1:
+        return {"$and": temp}
+    return {}
+
+
+# Keyset pagination: pages are ordered by (SORT_KEY, _id) and the continuation
+# token remembers the last pair, so every page is an index seek instead of a skip.
+SORT_KEY = ingest.TIMESTAMP_FIELD
+SORT_ORDER = [(SORT_KEY, ASCENDING), ("_id", ASCENDING)]
+
+def encode_cursor(doc):
+    value = doc.get(SORT_KEY)
+    # datetimes are tagged so they decode back to dates, not strings
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    position = json.dumps([value, str(doc["_id"])])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_cursor(token):
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, ObjectId(last_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def cursor_position(token):
+    value, last_id = decode_cursor(token)
+    if value is None:
+        # rows without a timestamp (null or missing) sort first; $gt null matches
+        # nothing, so the rest of them and then every timed row follow
+        return {"$or": [{SORT_KEY: None, "_id": {"$gt": last_id}}, {SORT_KEY: {"$ne": None}}]}
+    return {"$or": [{SORT_KEY: {"$gt": value}}, {SORT_KEY: value, "_id": {"$gt": last_id}}]}
+
+def after_cursor(filter_query, token):
+    position = cursor_position(token)
+    if not filter_query:
+        return position
+    return {"$and": [filter_query, position]}
+
+# count modes for /api/observations:
+#   "exact"     total number of matches, computed in the same round trip as the page
+#               (first pages only: pages requested with a cursor get no count)
+#   "estimated" collection metadata, only for unfiltered requests (filtered ones fall back to exact)
+#   "none"      no count at all
+COUNT_MODES = ["exact", "estimated", "none"]
+# bookkeeping of the ingest layer, never returned to clients
+HIDDEN_FIELDS = {"_key": 0, "_hash": 0}
+
+def projection(fields=None, prefix=""):
+    # only the requested fields (or everything but the bookkeeping ones) leave the server
+    if fields:
+        return {prefix + field: 1 for field in fields}
+    return {prefix + field: 0 for field in ["_id", *HIDDEN_FIELDS]}
+
+# field names seen in the collection, to reject unknown `fields` without a query per request
+FIELDS_TTL = 60
+known_fields = {"at": None, "fields": None}
+
+def cached_fields():
+    if known_fields["fields"] and time.monotonic() - known_fields["at"] < FIELDS_TTL:
+        return known_fields["fields"]
+    return None
+
+def remember_fields(sample):
+    # the derived fields count as known even if the sampled row lacks one (no GPS fix)
+    fields = set(sample) | set(ingest.DERIVED_FIELDS) if sample else set()
+    known_fields.update(at = time.monotonic(), fields = fields)
+    return known_fields["fields"]
+
+def document_fields():
+    """Names of the fields of a stored document (without the bookkeeping ones), cached for FIELDS_TTL seconds."""
+    return cached_fields() or remember_fields(get_collection().find_one({}, {"_id": 0, **HIDDEN_FIELDS}))
+
+def page_pipeline(filter_query, token, s, l, with_count=True, fields=None):
+    page = []
+    if token:
+        # the token already points past the previous page
+        page.append({"$match": cursor_position(token)})
+    elif s:
+        page.append({"$skip": s})
+    page.append({"$limit": l})
+    # the page comes back as one document (16 MB at most): its rows and the sort
+    # position of the last one, which becomes the next cursor. Rows are cut down
+    # to the requested fields before they are gathered, keeping the sort key and
+    # _id for the cursor; those are dropped from the rows afterwards
+    if fields:
+        page.append({"$project": {SORT_KEY: 1, **projection(fields)}})
+    else:
+        page.append({"$project": HIDDEN_FIELDS})
+    page.append({"$group": {"_id": None, "items": {"$push": "$$ROOT"},
+                            "last_value": {"$last": "$" + SORT_KEY}, "last_id": {"$last": "$_id"}}})
+    shape = {"_id": 0, "items._id": 0}
+    if fields and SORT_KEY not in fields:
+        shape["items." + SORT_KEY] = 0
+    page.append({"$project": shape})
+
+    pipeline = [{"$match": filter_query}, {"$sort": dict(SORT_ORDER)}]
+    if not with_count:
+        return pipeline + page
+    # one $facet evaluates the filter once and returns both the page and the total
+    return pipeline + [{"$facet": {"page": page, "total": [{"$count": "count"}]}}]
+
+# page_request/page_response and stream_request build the queries without running
+# them, so the async app (asyncMongoDB.py) sends exactly the same ones
+def page_request(params):
+    """Aggregation pipeline of the requested page and how its count is obtained."""
+    s = params.pop("skip")
+    l = params.pop("limit")
+    token = params.pop("cursor", None)
+    count_mode = params.pop("count", "exact")
+    fields = params.pop("fields", None)
+    filter_query = build_filter(params)
+
+    # the exact count scans every match: it comes with the first page only, so
+    # cursor pages keep a cost independent of the number of matches
+    if token and count_mode == "exact":
+        count_mode = "none"
+    with_count = count_mode == "exact" or (count_mode == "estimated" and bool(filter_query))
+    return {"pipeline": page_pipeline(filter_query, token, s, l, with_count=with_count, fields=fields),
+            "limit": l, "with_count": with_count, "estimated": count_mode == "estimated" and not with_count}
+
+def page_response(page_query, result, estimated_count=None):
+    """{count, items, next} from the document the page pipeline returned (None if it returned nothing)."""
+    if page_query["with_count"]:
+        page = result["page"][0] if result["page"] else None
+        count = result["total"][0]["count"] if result["total"] else 0
+    else:
+        page = result
+        count = estimated_count
+
+    if page is None:
+        return ({"count": count, "items": [], "next": None})
+    items = page["items"]
+    last = {SORT_KEY: page.get("last_value"), "_id": page["last_id"]}
+    next_cursor = encode_cursor(last) if len(items) == page_query["limit"] else None
+    return ({"count": count, "items": items, "next": next_cursor})
+
 def query(params):
-    cursor = None
-    filter_query = {}
-    count = 0
-    
     if len(params) == 0:
-        
-        count = collection.count_documents(filter = filter_query)
-        cursor = collection.find(filter = filter_query)
+        items = get_collection().find().to_list()
+        return ({"count": len(items), "items": items})
+
+    page_query = page_request(params)
+    result = next(get_collection().aggregate(page_query["pipeline"]), None)
+    count = get_collection().estimated_document_count() if page_query["estimated"] else None
+    return page_response(page_query, result, count)
+
+
+def explain(params):
+    """Winning plan and keys/docs examined for the page query() would run."""
+    pipeline = page_request(params)["pipeline"]
+    result = get_db().command({"explain": {"aggregate": get_collection().name, "pipeline": pipeline, "cursor": {}},
+                              "verbosity": "executionStats"})
+    return indexManager.summarize_explain(result)
+
+
+def stream_request(params):
+    token = params.pop("cursor", None)
+    fields = params.pop("fields", None)
+    filter_query = build_filter(params)
+    if token:
+        filter_query = after_cursor(filter_query, token)
+    return {"filter": filter_query, "projection": {"_id": 0, **projection(fields)}, "sort": SORT_ORDER, "batch_size": 1000}
+
+def stream(params):
+    """Unbounded cursor over the matching documents, for NDJSON exports."""
+    return get_collection().find(**stream_request(params))
+
+
+def series_request(params, x, y, extra=()):
+    # only the plotted fields leave the server
+    projection = {"_id": 0, x: 1, y: 1, **{name: 1 for name in extra}}
+    return {"filter": build_filter(params), "projection": projection, "sort": SORT_ORDER, "batch_size": 10000}
+
+def series(params, x, y, extra=()):
+    """(x, y) and the extra fields of every matching document, for /api/observations/downsample."""
+    return get_collection().find(**series_request(params, x, y, extra))
+
+def grid_request(params, fields):
+    # coordinates and the binned fields only, in no particular order
+    projection = {"_id": 0, "Latitude": 1, "Longitude": 1, **{field: 1 for field in fields}}
+    return {"filter": build_filter(params), "projection": projection, "batch_size": 10000}
+
+def grid(params, fields):
+    """Coordinates and fields of every matching document, for /api/grid."""
+    return get_collection().find(**grid_request(params, fields))
+
+
+def get_stats():
+    stats = statsEngine.describe(get_stats_collection())
+    if stats is None:
+        # first request after deploying on an existing collection
+        statsEngine.rebuild(get_collection(), get_stats_collection())
+        stats = statsEngine.describe(get_stats_collection())
+    return stats
+
+
+# Server-side ("pushdown") versions of /api/stats and /api/outliers: only the
+# summary row or the flagged documents travel over the network.
+# $percentile needs MongoDB 7.0+; older servers reject it as an unknown
+# operator, and the routes then answer from the incremental / pandas path.
+UNSUPPORTED_OPERATOR_CODES = {15952, 168}
+
+def pushdown_unsupported(error):
+    """True if an OperationFailure means the server lacks an operator of the pushdown pipelines."""
+    return error.code in UNSUPPORTED_OPERATOR_CODES or "$percentile" in str(error)
+
+def numeric_fields():
+    fields = statsEngine.field_names(get_stats_collection())
+    if not fields:
+        fields = sample_numeric_fields(get_collection().find_one({}, {"_id": 0}))
+    return fields
+
+
+def sample_numeric_fields(sample):
+    return [key for key, value in (sample or {}).items() if statsEngine.is_number(value)]
+
+
+def numeric_only(path):
+    # $min/$max compare across BSON types, so strings have to be masked out
+    return {"$cond": [{"$isNumber": path}, path, None]}
+
+
+def summary_pipeline(fields, accumulators):
+    # output names can't contain spaces/dots safely, so fields are aliased f0, f1, ...
+    group = {"_id": None}
+    for i, field in enumerate(fields):
+        for name, make in accumulators.items():
+            group[f"{name}{i}"] = make("$" + field)
+    return [{"$group": group}]
+
+
+def stats_pushdown():
+    fields = numeric_fields()
+    if not fields:
+        return {}
+    row = next(get_collection().aggregate(stats_pipeline(fields)), None)
+    return stats_from_row(fields, row)
+
+
+def stats_pipeline(fields):
+    accumulators = {
+        "count": lambda path: {"$sum": {"$cond": [{"$isNumber": path}, 1, 0]}},
+        "mean": lambda path: {"$avg": path},
+        "std": lambda path: {"$stdDevSamp": path},
+        "min": lambda path: {"$min": numeric_only(path)},
+        "max": lambda path: {"$max": numeric_only(path)},
+        "pct": lambda path: {"$percentile": {"input": path, "p": [0.25, 0.5, 0.75], "method": "approximate"}},
+    }
+    return summary_pipeline(fields, accumulators)
+
+
+def stats_from_row(fields, row):
+    if row is None:
+        return {}
+
+    result = {}
+    for i, field in enumerate(fields):
+        if row[f"count{i}"] == 0:
+            continue
+        q1, q2, q3 = row[f"pct{i}"]
+        result[field] = {"count": row[f"count{i}"], "mean": row[f"mean{i}"], "std": row[f"std{i}"],
+                         "min": row[f"min{i}"], "25%": q1, "50%": q2, "75%": q3, "max": row[f"max{i}"]}
+    return result
+
+
+def outliers_pushdown(method, k, checked=None):
+    # every numeric field is returned, but only the `checked` ones decide if a row is flagged
+    fields = numeric_fields()
+    checked = checked or fields
+    row = next(get_collection().aggregate(bounds_pipeline(method, checked)), None)
+    pipeline = outliers_pipeline(method, k, fields, checked, row)
+    if pipeline is None:
+        return {"count": 0, "items": []}
+    items = list(get_collection().aggregate(pipeline))
+    return {"count": len(items), "items": items}
+
+
+def bounds_pipeline(method, checked):
+    if method == "z-score":
+        accumulators = {
+            "mean": lambda path: {"$avg": path},
+            "std": lambda path: {"$stdDevPop": path},
+        }
     else:
-        s = params.pop("skip")
-        l = params.pop("limit")
-        if len(params) == 1:
-            (key, val) = params.popitem()
-            if not "time" in key:
-                val = float(val)
-            filter_query = helper(key, val)
-        elif len(params) > 1:
-            temp = []
-            filter_query = {"$and": temp}
-            for key, val in params.items():
-                if not "time" in key:
-                    val = float(val)
-                temp.append(helper(key, val))
-
-        count = collection.count_documents(filter = filter_query, skip = s, limit = l)
-        cursor = collection.find(filter = filter_query, skip = s, limit = l)
-
-    return ({"count": count, "items": cursor.to_list()})
-    
+        accumulators = {
+            "pct": lambda path: {"$percentile": {"input": path, "p": [0.25, 0.75], "method": "approximate"}},
+        }
+    return summary_pipeline(checked, accumulators)
+
+
+def outliers_pipeline(method, k, fields, checked, row):
+    """Pipeline returning the rows outside the bounds in row, None if no field has usable bounds."""
+    if row is None:
+        return None
+
+    conditions = []
+    for i, field in enumerate(checked):
+        path = "$" + field
+        if method == "z-score":
+            if row[f"mean{i}"] is None or row[f"std{i}"] is None:
+                continue
+            # |x - mean| > k * std, which is |z| > k without dividing by zero
+            conditions.append({"$and": [{"$isNumber": path}, {"$gt": [
+                {"$abs": {"$subtract": [path, row[f"mean{i}"]]}}, k * row[f"std{i}"]]}]})
+        else:
+            if row[f"pct{i}"] is None or row[f"pct{i}"][0] is None:
+                continue
+            q1, q3 = row[f"pct{i}"]
+            lower_bound = q1 - k * (q3 - q1)
+            upper_bound = q3 + k * (q3 - q1)
+            conditions.append({"$and": [{"$isNumber": path}, {"$or": [
+                {"$lt": [path, lower_bound]}, {"$gt": [path, upper_bound]}]}]})
+    if not conditions:
+        return None
+
+    projection = {"_id": 0}
+    projection.update({field: 1 for field in fields})
+    return [{"$match": {"$expr": {"$or": conditions}}}, {"$project": projection}]
+
+
+# Time-series storage: the collection is created with TIMESERIES_OPTIONS and
+# filled from asv_1, which is left untouched
+# replacing a row deletes its old version by _id, and time-series collections
+# only take deletes on other fields than the metaField from MongoDB 7.0
+TIMESERIES_MIN_VERSION = (7, 0)
+
+def timeseries_supported(db):
+    return tuple(db.client.server_info()["versionArray"][:2]) >= TIMESERIES_MIN_VERSION
+
+def create_timeseries(db, name):
+    if name not in db.list_collection_names():
+        db.create_collection(name, timeseries = TIMESERIES_OPTIONS)
+    return db[name]
+
+def migrate(source, target):
+    """Copy the documents of source into the time-series collection target, keeping their _id.
+    Rows already in target are skipped, so an interrupted migration can be run again."""
+    totals = {"copied": 0, "present": 0, "untimed": 0}
+    for batch in ingest.batches(source.find({}, batch_size = ingest.BATCH_SIZE)):
+        # keys and derived fields are recomputed, so rows stored before they existed move too
+        documents = [ingest.with_key(doc) for doc in batch]
+        timed = [doc for doc in documents if ingest.TIMESTAMP_FIELD in doc]
+        present = {doc["_key"] for doc in
+                   target.find({"_key": {"$in": [doc["_key"] for doc in timed]}}, {"_id": 0, "_key": 1})}
+        new = [doc for doc in timed if doc["_key"] not in present]
+        if new:
+            target.insert_many(new, ordered = False)
+        totals["copied"] += len(new)
+        totals["present"] += len(timed) - len(new)
+        totals["untimed"] += len(documents) - len(timed)
+    return totals
 
+if __name__ == '__main__':
+    # python mongoDB.py migrate
+    if len(sys.argv) != 2 or sys.argv[1] != "migrate":
+        print("Usage: python mongoDB.py migrate")
+        sys.exit(1)
+    if not timeseries_supported(get_db()):
+        print(f"The time-series storage needs MongoDB {'.'.join(map(str, TIMESERIES_MIN_VERSION))} or later")
+        sys.exit(1)
+    source = get_db()[collection_name("collection")]
+    target = create_timeseries(get_db(), collection_name("timeseries"))
+    totals = migrate(source, target)
+    print(f"Copied {totals['copied']} documents, {totals['present']} already there, "
+          f"{totals['untimed']} left out without a timestamp")
+    print(f"Indexes: {indexManager.ensure_indexes(target, indexManager.TIMESERIES_INDEXES)}")
+    fields = statsEngine.rebuild(target, get_db()[collection_name("timeseries") + '_stats'])
+    print(f"Rebuilt aggregates for {fields} fields")
+    bump_generation()
+    print("Set MONGO_STORAGE=timeseries to serve it")
@@ -0,0 +1,64 @@
+import warnings
+import numpy as np
+
+# Vectorized outlier detection shared by /api/outliers and the Streamlit clean() step.
+# Quantiles / means are computed for every selected column in one NumPy call and
+# compared against the whole block at once, giving a single boolean row mask.
+
+ALL_FIELDS = [None, "", "All Columns", "all"]
+METHODS = ["z-score", "iqr"]
+
+
+def select_fields(df, field=None):
+    """Numeric columns to check: every one of them, a single name, or a list of names."""
+    numeric = df.select_dtypes(include="number").columns.tolist()
+    if field in ALL_FIELDS:
+        return numeric
+    fields = [field] if isinstance(field, str) else list(field)
+    missing = [f for f in fields if f not in numeric]
+    if missing:
+        raise ValueError(f"Not numeric columns of the dataset: {missing}")
+    return fields
+
+
+def outlier_mask(df, method, k, field=None):
+    """Boolean array, True for every row that is an outlier in at least one selected column."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {METHODS}")
+    fields = select_fields(df, field)
+    if not fields or len(df) == 0:
+        return np.zeros(len(df), dtype=bool)
+
+    values = df[fields].to_numpy(dtype="float64", na_value=np.nan)
+    # all-NaN columns and zero spread are expected here, NaN comparisons are simply False
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if method == "z-score":
+            return zscore_mask(values, np.nanmean(values, axis=0), np.nanstd(values, axis=0), k)
+
+        Q1, Q3 = np.nanquantile(values, [0.25, 0.75], axis=0)
+        IQR = Q3 - Q1
+        lower_bound = Q1 - k * IQR
+        upper_bound = Q3 + k * IQR
+        return ((values < lower_bound) | (values > upper_bound)).any(axis=1)
+
+
+def zscore_mask(values, mean, std, k):
+    """Rows of the 2-D float array with |z| > k in any column, given per-column mean and (population) std."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscore = (values - mean) / std
+        return (np.abs(zscore) > k).any(axis=1)
+
+
+def find_outliers(df, method, k, field=None, as_records=True):
+    """Flagged rows as index labels, or as records over the numeric columns."""
+    mask = outlier_mask(df, method, k, field)
+    if not as_records:
+        return df.index[mask]
+    return df.loc[mask, select_fields(df)].to_dict(orient="records")
+
+
+def outlier_columns(df, method, k, field=None):
+    """Flagged rows over the numeric columns as {column: NumPy array}, without building row dicts."""
+    mask = outlier_mask(df, method, k, field)
+    return {name: df[name].to_numpy()[mask] for name in select_fields(df)}
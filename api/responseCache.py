@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from flask import Response, make_response, request
+import asyncio
+import functools
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import quart
+    from quart.wrappers.response import DataBody
+except ImportError:
+    quart = None
+
+# Response cache for the read endpoints. Entries are keyed by path, sorted query
+# arguments and Accept header, and tagged with the data generation, a counter
+# that upload_MONGO bumps after every write: a response cached under an older
+# generation is never served and TTL only bounds memory. Each worker reads the
+# generation at most every GENERATION_TTL seconds (mongoDB.py), so a worker
+# other than the one that took an upload may serve pre-upload responses for
+# that long; GENERATION_TTL=0 makes invalidation exact at one read per request.
+# The ETag is derived from the same key and generation, so If-None-Match can be
+# answered with a 304 before anything is computed; weak comparison, since
+# compressed copies of a response carry the same tag marked weak.
+#
+# REDIS_URL adds a shared second level for multi-worker deployments (needs the
+# redis package); without it every worker keeps its own in-process LRU.
+# cached() wraps Flask views, cached_async() the coroutine views of the Quart app.
+
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+MAX_ITEM_BYTES = 8 * 1024 * 1024
+
+
+class LRUCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class RedisCache:
+    def __init__(self, url, ttl=TTL):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get("wq:" + key)
+        if value is None:
+            return None
+        mimetype, body = value.split(b"\n", 1)
+        return mimetype.decode(), body
+
+    def set(self, key, value):
+        mimetype, body = value
+        self.client.set("wq:" + key, mimetype.encode() + b"\n" + body, ex=int(self.ttl))
+
+
+local_cache = LRUCache()
+shared_cache = RedisCache(os.getenv("REDIS_URL")) if redis and os.getenv("REDIS_URL") else None
+
+
+def cache_key(generation, req=request):
+    args = "&".join(f"{k}={v}" for k, v in sorted(req.args.items(multi=True)))
+    raw = f"{req.path}?{args}|{req.headers.get('Accept', '')}"
+    return f"{generation}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def lookup(key):
+    value = local_cache.get(key)
+    if value is None and shared_cache is not None:
+        value = shared_cache.get(key)
+        if value is not None:
+            local_cache.set(key, value)
+    return value
+
+
+def store(key, value):
+    local_cache.set(key, value)
+    if shared_cache is not None:
+        shared_cache.set(key, value)
+
+
+def cached(get_generation):
+    """Decorator for GET views whose output only depends on the arguments and the stored data."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                generation = get_generation()
+            except Exception as e:
+                print(f"Response cache disabled, no data generation: {e}")
+                return view(*args, **kwargs)
+
+            key = cache_key(generation)
+            etag = key.replace(":", "-")
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            value = lookup(key)
+            if value is not None:
+                mimetype, body = value
+                response = Response(body, mimetype=mimetype)
+                response.headers["X-Cache"] = "HIT"
+            else:
+                response = make_response(view(*args, **kwargs))
+                response.headers["X-Cache"] = "MISS"
+                # streamed exports and errors aren't kept
+                if response.status_code == 200 and not response.is_streamed:
+                    body = response.get_data()
+                    if len(body) <= MAX_ITEM_BYTES:
+                        store(key, (response.mimetype, body))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            response.vary.add("Accept")
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_async(get_generation):
+    """cached() for the Quart app: get_generation and the view are coroutine functions."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            try:
+                generation = await get_generation()
+            except Exception as e:
+                print(f"Response cache disabled, no data generation: {e}")
+                return await view(*args, **kwargs)
+
+            key = cache_key(generation, quart.request)
+            etag = key.replace(":", "-")
+            if quart.request.if_none_match.contains_weak(etag):
+                response = quart.Response(b"", status=304)
+                response.set_etag(etag)
+                return response
+
+            # the Redis level is a blocking client, kept off the event loop
+            value = lookup(key) if shared_cache is None else await asyncio.to_thread(lookup, key)
+            if value is not None:
+                mimetype, body = value
+                response = quart.Response(body, mimetype=mimetype)
+                response.headers["X-Cache"] = "HIT"
+            else:
+                response = await quart.make_response(await view(*args, **kwargs))
+                response.headers["X-Cache"] = "MISS"
+                # streamed exports and errors aren't kept
+                if response.status_code == 200 and isinstance(response.response, DataBody):
+                    body = await response.get_data()
+                    if len(body) <= MAX_ITEM_BYTES:
+                        if shared_cache is None:
+                            store(key, (response.mimetype, body))
+                        else:
+                            await asyncio.to_thread(store, key, (response.mimetype, body))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            response.vary.add("Accept")
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+from flask import request
+from flask.json.provider import JSONProvider
+import datetime
+import gzip
+import json
+import math
+import os
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import quart
+    from quart.wrappers.response import DataBody
+except ImportError:
+    quart = None
+
+# JSON encoding and response compression for the Flask app.
+# FastJSONProvider replaces Flask's json provider, so jsonify() and views that
+# return dicts go through dumps(): orjson when it is installed, which writes
+# NumPy arrays and scalars, datetimes and NaN (as null) without converting them
+# to Python objects first; the standard library otherwise. JSON_ENCODER=json
+# forces the standard library encoder.
+# compress_response() is an after_request hook that gzip/zstd-encodes large
+# bodies when the client accepts it (zstd needs the zstandard package), and
+# compress_response_async() the same hook for the Quart app.
+
+ENCODER = "orjson" if orjson is not None and os.getenv("JSON_ENCODER", "orjson") == "orjson" else "json"
+MIN_COMPRESS_BYTES = int(os.getenv("MIN_COMPRESS_BYTES", 1024))
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+ENCODINGS = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def default(value):
+    # anything the encoder doesn't know: NumPy, dates, ObjectIds in explain output
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def sanitize(value):
+    # the standard library writes NaN as a bare NaN token, which isn't JSON
+    if isinstance(value, float):
+        return None if math.isnan(value) or math.isinf(value) else value
+    if isinstance(value, dict):
+        return {k: sanitize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(v) for v in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return sanitize(default(value))
+    return value
+
+
+def dumps(obj):
+    """Encode obj as JSON bytes."""
+    if ENCODER == "orjson":
+        return orjson.dumps(obj, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(sanitize(obj), default=default, separators=(",", ":")).encode()
+
+
+def loads(s):
+    return orjson.loads(s) if ENCODER == "orjson" else json.loads(s)
+
+
+class FastJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype="application/json")
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    """after_request hook: encode large buffered bodies with the best encoding the client accepts."""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+
+    response.set_data(compress(body, encoding))
+    return compressed(response, encoding)
+
+
+async def compress_response_async(response):
+    """compress_response() for the Quart app."""
+    if (response.status_code != 200 or not isinstance(response.response, DataBody)
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = quart.request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    body = await response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+
+    response.set_data(compress(body, encoding))
+    return compressed(response, encoding)
+
+
+def compressed(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    # same content, different bytes: keep the tag for revalidation but mark it weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
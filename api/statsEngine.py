@@ -0,0 +1,217 @@
+import math
+import sys
+
+# Running aggregates for /api/stats, one entry per numeric field:
+# count, mean and M2 (Welford / Chan et al. for merging batches), min, max
+# and a small merging quantile sketch for the 25/50/75% percentiles.
+# Everything is mergeable, so uploads only fold their own rows in.
+
+STATS_ID = "asv_1"
+SKETCH_SIZE = 200
+PERCENTILES = {"25%": 0.25, "50%": 0.5, "75%": 0.75}
+REBUILD_BATCH = 5000
+MAX_RETRIES = 10
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def new_field(name):
+    return {"name": name, "count": 0, "mean": 0.0, "m2": 0.0, "min": None, "max": None, "sketch": []}
+
+
+def compress_sketch(centroids, size=SKETCH_SIZE):
+    """Sort [mean, weight] centroids and merge neighbours until roughly `size` remain."""
+    # identical values are merged first, which is lossless for the many
+    # sensor columns that only take a handful of distinct readings
+    weights = {}
+    for mean, weight in centroids:
+        weights[mean] = weights.get(mean, 0) + weight
+    centroids = sorted([mean, weight] for mean, weight in weights.items())
+    if len(centroids) <= size:
+        return centroids
+    limit = math.ceil(sum(c[1] for c in centroids) / size)
+    merged = [list(centroids[0])]
+    for mean, weight in centroids[1:]:
+        last = merged[-1]
+        if last[1] + weight <= limit:
+            total = last[1] + weight
+            last[0] = last[0] + (mean - last[0]) * weight / total
+            last[1] = total
+        else:
+            merged.append([mean, weight])
+    return merged
+
+
+def sketch_quantile(centroids, q):
+    """Linear-interpolated quantile, same rule as pandas; exact while no distinct values were merged."""
+    if not centroids:
+        return None
+    n = sum(c[1] for c in centroids)
+    target = q * (n - 1)
+    prev_rank = prev_mean = None
+    seen = 0
+    for mean, weight in centroids:
+        # a centroid covers ranks seen .. seen + weight - 1
+        if target <= seen + weight - 1:
+            if target >= seen or prev_rank is None:
+                return mean
+            return prev_mean + (mean - prev_mean) * (target - prev_rank) / (seen - prev_rank)
+        seen += weight
+        prev_rank, prev_mean = seen - 1, mean
+    return centroids[-1][0]
+
+
+def merge_field(agg, other):
+    """Fold the aggregate `other` into `agg` (Chan et al. parallel variance)."""
+    if other["count"] == 0:
+        return agg
+    if agg["count"] == 0:
+        agg.update({k: v for k, v in other.items() if k != "name"})
+        return agg
+    n_a, n_b = agg["count"], other["count"]
+    n = n_a + n_b
+    delta = other["mean"] - agg["mean"]
+    agg["mean"] += delta * n_b / n
+    agg["m2"] += other["m2"] + delta * delta * n_a * n_b / n
+    agg["count"] = n
+    agg["min"] = min(agg["min"], other["min"])
+    agg["max"] = max(agg["max"], other["max"])
+    agg["sketch"] = compress_sketch(agg["sketch"] + other["sketch"])
+    return agg
+
+
+def summarize(name, values):
+    """Aggregate of a plain list of numbers, built with Welford's update."""
+    agg = new_field(name)
+    count, mean, m2 = 0, 0.0, 0.0
+    for x in values:
+        count += 1
+        delta = x - mean
+        mean += delta / count
+        m2 += delta * (x - mean)
+    if count:
+        agg.update({"count": count, "mean": mean, "m2": m2, "min": min(values), "max": max(values),
+                    "sketch": compress_sketch([[x, 1] for x in values])})
+    return agg
+
+
+def summarize_documents(documents):
+    columns = {}
+    for doc in documents:
+        for key, value in doc.items():
+            if is_number(value):
+                columns.setdefault(key, []).append(value)
+    return {name: summarize(name, values) for name, values in columns.items()}
+
+
+def merge_state(fields, batch):
+    by_name = {f["name"]: f for f in fields}
+    for name, agg in batch.items():
+        merge_field(by_name.setdefault(name, new_field(name)), agg)
+    return list(by_name.values())
+
+
+def merge_summaries(summary, other):
+    for name, agg in other.items():
+        merge_field(summary.setdefault(name, new_field(name)), agg)
+    return summary
+
+
+def apply_documents(stats_collection, documents):
+    apply_summary(stats_collection, summarize_documents(documents))
+
+
+def rebuild_count(stats_collection):
+    state = stats_collection.find_one({"_id": STATS_ID}, {"rebuilds": 1})
+    return state.get("rebuilds", 0) if state else 0
+
+
+def apply_summary(stats_collection, batch, since=None):
+    """Merge a summary of freshly written documents into the stored aggregates (optimistic concurrency on `version`).
+    With since (rebuild_count() before the documents were written), returns False without merging if a rebuild
+    ran meanwhile: it may already have counted some of them."""
+    if not batch:
+        return True
+    for _ in range(MAX_RETRIES):
+        state = stats_collection.find_one({"_id": STATS_ID})
+        if state is None:
+            stats_collection.update_one(
+                {"_id": STATS_ID}, {"$setOnInsert": {"version": 0, "fields": []}}, upsert=True)
+            continue
+        rebuilds = state.get("rebuilds", 0)
+        if since is not None and rebuilds != since:
+            return False
+        fields = merge_state(state["fields"], batch)
+        result = stats_collection.replace_one(
+            {"_id": STATS_ID, "version": state["version"]},
+            {"version": state["version"] + 1, "rebuilds": rebuilds, "fields": fields})
+        if result.modified_count == 1:
+            return True
+    raise RuntimeError("Could not update stats aggregates, too many concurrent writers.")
+
+
+def rebuild(collection, stats_collection):
+    """Recompute every aggregate from scratch by streaming the observations collection.
+    The result only replaces the version read before the scan: if an upload merged its rows
+    meanwhile, the scan may have missed them and starts over."""
+    stats_collection.update_one({"_id": STATS_ID}, {"$setOnInsert": {"version": 0, "fields": []}}, upsert=True)
+    for _ in range(MAX_RETRIES):
+        state = stats_collection.find_one({"_id": STATS_ID}, {"version": 1, "rebuilds": 1})
+        fields = []
+        buffer = []
+        for doc in collection.find({}, batch_size=REBUILD_BATCH):
+            buffer.append(doc)
+            if len(buffer) >= REBUILD_BATCH:
+                fields = merge_state(fields, summarize_documents(buffer))
+                buffer = []
+        fields = merge_state(fields, summarize_documents(buffer))
+
+        result = stats_collection.replace_one(
+            {"_id": STATS_ID, "version": state["version"]},
+            {"version": state["version"] + 1, "rebuilds": state.get("rebuilds", 0) + 1, "fields": fields})
+        if result.modified_count == 1:
+            return len(fields)
+    raise RuntimeError("Could not rebuild stats aggregates, too many concurrent writers.")
+
+
+def field_names(stats_collection):
+    return state_field_names(stats_collection.find_one({"_id": STATS_ID}, {"fields.name": 1}))
+
+
+def state_field_names(state):
+    return [f["name"] for f in state["fields"]] if state else []
+
+
+def describe(stats_collection):
+    """Same shape as DataFrame.describe().to_dict(orient='dict'), or None if nothing is stored yet."""
+    return describe_state(stats_collection.find_one({"_id": STATS_ID}))
+
+
+def describe_state(state):
+    if state is None:
+        return None
+    result = {}
+    for agg in state["fields"]:
+        count = agg["count"]
+        if count == 0:
+            continue
+        row = {"count": count, "mean": agg["mean"],
+               "std": math.sqrt(agg["m2"] / (count - 1)) if count > 1 else None,
+               "min": agg["min"]}
+        for label, q in PERCENTILES.items():
+            row[label] = sketch_quantile(agg["sketch"], q)
+        row["max"] = agg["max"]
+        result[agg["name"]] = row
+    return result
+
+
+if __name__ == '__main__':
+    # python statsEngine.py rebuild
+    if len(sys.argv) != 2 or sys.argv[1] != "rebuild":
+        print("Usage: python statsEngine.py rebuild")
+        sys.exit(1)
+    from mongoDB import get_collection, get_stats_collection, bump_generation
+    print(f"Rebuilt aggregates for {rebuild(get_collection(), get_stats_collection())} fields")
+    bump_generation()
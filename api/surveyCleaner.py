@@ -0,0 +1,239 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import gzip
+import json
+import os
+import time
+import urllib.request
+import numpy as np
+import pandas as pd
+import ingest
+from outlierEngine import outlier_mask, zscore_mask
+
+# Batch cleaning of raw survey CSVs: rows with |z| > 3 in any numeric column
+# are dropped, the result is written next to the source as cleaned_<name>.csv
+# and uploaded to the API. Files are cleaned in a process pool; each cleaned
+# file is uploaded as it becomes ready, in gzip-compressed CSV chunks with at
+# most a few requests in flight.
+#
+#   python surveyCleaner.py "../database/*.csv" --upload https://biscaynebayproject.onrender.com
+#   python surveyCleaner.py ../database --out-dir /tmp/cleaned --workers 8
+#   python surveyCleaner.py big-logs/ --stream-rows 100000
+#
+# --stream-rows cleans out of core in two passes over chunks of that many rows:
+# the first gets every column's mean/std (Welford/Chan merges of the chunk
+# moments) and the dtype a full read would infer, the second filters and
+# appends each chunk. Memory is bounded by the chunk size and the output is
+# the same file the in-memory path writes.
+
+PREFIX = "cleaned_"
+TIMESTAMP_COL = "Time hh:mm:ss"
+Z_LIMIT = 3
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", 5000))
+UPLOAD_WORKERS = 3
+UPLOAD_TIMEOUT = 120
+
+
+def cleaned_path(path, out_dir=None):
+    folder = out_dir or os.path.dirname(path)
+    return os.path.join(folder, PREFIX + os.path.basename(path))
+
+
+def raw_files(targets):
+    """CSV files named by the targets (files, directories or globs), skipping cleaned outputs."""
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            target = os.path.join(target, "*.csv")
+        paths.extend(sorted(glob.glob(target)))
+    return [path for path in dict.fromkeys(paths) if not os.path.basename(path).startswith(PREFIX)]
+
+
+def clean_frame(df):
+    """(cleaned frame with the timestamp first, number of rows removed)."""
+    outliers = outlier_mask(df, "z-score", Z_LIMIT)
+    cleaned = df[~outliers]
+    if TIMESTAMP_COL in cleaned.columns:
+        cleaned = cleaned[[TIMESTAMP_COL] + [c for c in cleaned.columns if c != TIMESTAMP_COL]]
+    return cleaned, int(outliers.sum())
+
+
+# pass 1 of the streaming mode: a column is numeric only if every chunk parsed it
+# as a number, and float as soon as one chunk had a decimal or an empty cell
+def merge_kind(kind, dtype):
+    if pd.api.types.is_bool_dtype(dtype) or not pd.api.types.is_numeric_dtype(dtype):
+        new = "bool" if pd.api.types.is_bool_dtype(dtype) else "object"
+    else:
+        new = "int" if pd.api.types.is_integer_dtype(dtype) else "float"
+    if kind is None or kind == new:
+        return new
+    if {kind, new} == {"int", "float"}:
+        return "float"
+    return "object"
+
+
+def chunk_moments(values):
+    """Per-column (count, mean, M2) of a 2-D float array, NaN cells skipped."""
+    count = np.sum(~np.isnan(values), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+    m2 = np.nansum((values - mean) ** 2, axis=0)
+    return count, mean, m2
+
+
+def merge_moments(a, b):
+    # Chan et al.'s pairwise update of Welford's running mean and M2
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n_b == 0:
+        return a
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n
+
+
+def scan(path, chunk_rows):
+    """Pass 1: {column: kind} in file order and {numeric column: (mean, population std)}."""
+    kinds = {}
+    moments = {}
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        for name in chunk.columns:
+            kinds[name] = merge_kind(kinds.get(name), chunk[name].dtype)
+        numeric = chunk.select_dtypes(include="number").columns
+        count, mean, m2 = chunk_moments(chunk[numeric].to_numpy(dtype="float64", na_value=np.nan))
+        for i, name in enumerate(numeric):
+            moments[name] = merge_moments(moments.get(name, (0, 0.0, 0.0)), (int(count[i]), mean[i], m2[i]))
+
+    stats = {}
+    for name, kind in kinds.items():
+        if kind in ["int", "float"]:
+            n, mean, m2 = moments.get(name, (0, 0.0, 0.0))
+            stats[name] = (mean, np.sqrt(m2 / n)) if n > 0 else (np.nan, np.nan)
+    return kinds, stats
+
+
+DTYPES = {"int": "int64", "float": "float64", "object": object}
+
+
+def clean_file_streaming(path, output, chunk_rows):
+    """Pass 2: filter every chunk with the file-wide mean/std and append it to output."""
+    start = time.perf_counter()
+    kinds, stats = scan(path, chunk_rows)
+    scan_done = time.perf_counter()
+
+    fields = list(stats)
+    mean = np.array([stats[f][0] for f in fields], dtype="float64")
+    std = np.array([stats[f][1] for f in fields], dtype="float64")
+    columns = list(kinds)
+    if TIMESTAMP_COL in kinds:
+        columns = [TIMESTAMP_COL] + [c for c in columns if c != TIMESTAMP_COL]
+
+    # every chunk is parsed with the dtypes of a full read, so values print the same
+    dtype = {name: DTYPES[kind] for name, kind in kinds.items() if kind in DTYPES}
+    rows = removed = 0
+    tmp = f"{output}.tmp-{os.getpid()}"
+    with open(tmp, "w", newline="") as f:
+        for i, chunk in enumerate(pd.read_csv(path, chunksize=chunk_rows, dtype=dtype)):
+            outliers = zscore_mask(chunk[fields].to_numpy(dtype="float64", na_value=np.nan), mean, std, Z_LIMIT)
+            chunk[~outliers][columns].to_csv(f, index=False, header=i == 0)
+            rows += len(chunk)
+            removed += int(outliers.sum())
+        if rows == 0:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+    os.replace(tmp, output)
+    done = time.perf_counter()
+    return {"source": path, "output": output, "rows": rows, "removed": removed, "remaining": rows - removed,
+            "scan_s": scan_done - start, "filter_s": done - scan_done}
+
+
+def clean_file(path, out_dir=None, stream_rows=None):
+    """Clean one survey and write it; returns its row counts and timings. Runs in the worker processes.
+    With stream_rows the file is processed in chunks of that many rows (see clean_file_streaming)."""
+    output = cleaned_path(path, out_dir)
+    if stream_rows:
+        return clean_file_streaming(path, output, stream_rows)
+    start = time.perf_counter()
+    df = pd.read_csv(path)
+    read_done = time.perf_counter()
+    cleaned, removed = clean_frame(df)
+    clean_done = time.perf_counter()
+    cleaned.to_csv(output, index=False)
+    write_done = time.perf_counter()
+    return {"source": path, "output": output, "rows": len(df), "removed": removed, "remaining": len(cleaned),
+            "read_s": read_done - start, "clean_s": clean_done - read_done, "write_s": write_done - clean_done}
+
+
+def post_chunk(base_url, header, index, lines):
+    body = gzip.compress((header + "".join(lines)).encode())
+    upload_request = urllib.request.Request(base_url.rstrip("/") + "/api/upload", data=body, method="POST",
+                                            headers={"Content-Type": "text/csv", "Content-Encoding": "gzip"})
+    with urllib.request.urlopen(upload_request, timeout=UPLOAD_TIMEOUT) as response:
+        result = json.load(response)
+    return {"batch": index, "rows": len(lines), **{k: result.get(k, 0) for k in ["inserted", "replaced", "skipped"]}}
+
+
+def upload_file(path, base_url, chunk_rows=UPLOAD_CHUNK_ROWS, workers=UPLOAD_WORKERS):
+    """POST a CSV to /api/upload in chunks of chunk_rows rows, at most `workers` at a time."""
+    start = time.perf_counter()
+    with open(path, encoding="utf-8", newline="") as f:
+        header = f.readline()
+        results = ingest.run_batches(f, lambda index, lines: post_chunk(base_url, header, index, lines),
+                                     size=chunk_rows, workers=workers)
+    totals = {k: sum(r[k] for r in results) for k in ["inserted", "replaced", "skipped"]}
+    return {"chunks": len(results), **totals, "upload_s": time.perf_counter() - start}
+
+
+def report(result):
+    line = (f"{result['source']}: {result['rows']} rows, removed {result['removed']} outliers, "
+            f"{result['remaining']} remaining -> {result['output']} ")
+    if "scan_s" in result:
+        line += f"(scan {result['scan_s']:.2f}s, filter and write {result['filter_s']:.2f}s"
+    else:
+        line += f"(read {result['read_s']:.2f}s, clean {result['clean_s']:.2f}s, write {result['write_s']:.2f}s"
+    if "upload_s" in result:
+        line += (f", upload {result['upload_s']:.2f}s in {result['chunks']} chunks: {result['inserted']} inserted, "
+                 f"{result['replaced']} replaced, {result['skipped']} unchanged")
+    return line + ")"
+
+
+def run(paths, out_dir=None, base_url=None, workers=None, chunk_rows=UPLOAD_CHUNK_ROWS, upload_workers=UPLOAD_WORKERS,
+        stream_rows=None):
+    """Clean every path in a process pool, uploading each output as soon as it is written."""
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(clean_file, path, out_dir, stream_rows) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            if base_url:
+                try:
+                    result.update(upload_file(result["output"], base_url, chunk_rows, upload_workers))
+                except OSError as e:
+                    result["error"] = str(e)
+                    print(f"Upload of {result['output']} failed: {e}")
+            print(report(result))
+            results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Clean raw survey CSVs and optionally upload them.")
+    parser.add_argument("targets", nargs="+", help="CSV files, directories or globs")
+    parser.add_argument("--out-dir", help="where cleaned_<name>.csv files go (default: next to each source)")
+    parser.add_argument("--upload", metavar="BASE_URL", help="API to POST the cleaned files to")
+    parser.add_argument("--workers", type=int, help="cleaning processes (default: one per CPU)")
+    parser.add_argument("--chunk-rows", type=int, default=UPLOAD_CHUNK_ROWS, help="rows per upload request")
+    parser.add_argument("--stream-rows", type=int, help="clean out of core, this many rows at a time")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="upload requests in flight per file")
+    args = parser.parse_args()
+
+    paths = raw_files(args.targets)
+    if not paths:
+        parser.error("no raw survey CSVs found")
+    start = time.perf_counter()
+    results = run(paths, args.out_dir, args.upload, args.workers, args.chunk_rows, args.upload_workers,
+                  args.stream_rows)
+    rows = sum(r["rows"] for r in results)
+    print(f"Cleaned {len(results)} files, {rows} rows in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,360 @@
+import argparse
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+# Benchmark of the API and the cleaning pipeline on synthetic surveys
+# (synthData.py). A survey of --rows rows is generated, uploaded through
+# /api/upload, then every scenario below is requested --repeat times; the
+# latency percentiles, throughput and response sizes of each one, and the
+# timings of the cleaning step, are written as JSON so runs can be compared.
+#
+# Targets:
+#   (default)         the Flask app in this process, on an in-memory mongomock
+#                     database (pip install mongomock)
+#   --mongo-uri URI   the Flask app in this process, on a real mongod, e.g. a
+#                     local one: --mongo-uri mongodb://localhost:27017
+#   --url URL         an API already running elsewhere, over HTTP
+#
+# In-process runs use their own database (--database, dropped first) and turn
+# the response cache off unless --cache is given, so every request is
+# computed. Start a --url server with RESPONSE_CACHE_SIZE=0 for the same.
+# mongomock is slow and lacks a few operators ($geoWithin, $stdDevSamp), so the
+# scenarios using them report errors there: it checks the harness and catches
+# gross regressions, timings worth comparing come from a real mongod.
+#
+#   python bench/benchmark.py --rows 20000 --out bench-memory.json
+#   python bench/benchmark.py --mongo-uri mongodb://localhost:27017 --rows 1000000 --out bench-1M.json
+#   python bench/benchmark.py --compare bench-before.json bench-after.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+sys.path.append(os.path.join(HERE, "..", "api"))
+import ingest
+import synthData
+
+UPLOAD_CHUNK_ROWS = 5000
+PAGE_DEPTHS = [0, 1000, 10000, 100000]
+PERCENTILES = [50, 90, 99]
+
+
+class AppTarget:
+    """Requests served by the Flask app of this process."""
+
+    def __init__(self):
+        import flaskWebApp
+        self.app = flaskWebApp.app
+
+    def request(self, method, path, params=None, data=None, headers=None):
+        with self.app.test_client() as client:
+            response = client.open(path, method=method, query_string=params, data=data, headers=headers)
+            return response.status_code, response.get_data(), response.headers
+
+
+class HttpTarget:
+    """Requests sent to a running API."""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, params=None, data=None, headers=None):
+        response = self.session.request(method, self.url + path, params=params, data=data, headers=headers,
+                                        timeout=600)
+        return response.status_code, response.content, response.headers
+
+
+def memory_client():
+    try:
+        import mongomock
+        import mongomock.collection
+    except ImportError:
+        sys.exit("The in-memory target needs mongomock (pip install mongomock); or pass --mongo-uri or --url")
+    # mongomock predates two pymongo 4 APIs the API calls: Cursor.to_list and
+    # the sort option pymongo passes with bulk replacements
+    mongomock.collection.Cursor.to_list = lambda self, length=None: list(self)
+    for name in ["add_replace", "add_update", "add_delete"]:
+        original = getattr(mongomock.collection.BulkOperationBuilder, name)
+        def without_sort(self, *args, original=original, **kwargs):
+            kwargs.pop("sort", None)
+            return original(self, *args, **kwargs)
+        setattr(mongomock.collection.BulkOperationBuilder, name, without_sort)
+    return mongomock.MongoClient()
+
+
+def in_process_target(args):
+    # set before the API modules are imported, they read them at import
+    os.environ["MONGO_DATABASE"] = args.database
+    if not args.cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    import mongoConnection
+    if not args.mongo_uri:
+        mongoConnection.client = memory_client()
+    mongoConnection.get_client().drop_database(args.database)
+    target = AppTarget()
+    import mongoDB
+    mongoDB.ensure_indexes()
+    return target
+
+
+def server_ms(headers):
+    # compute time reported by the API itself, without transport
+    timing = headers.get("Server-Timing", "")
+    if "dur=" in timing:
+        return float(timing.split("dur=")[1].split(",")[0])
+    return None
+
+
+def summarize(latencies, wall, sizes, statuses, server):
+    latencies = np.array(latencies) * 1000
+    result = {"requests": len(latencies), "errors": sum(1 for s in statuses if s >= 400),
+              "status": {str(s): statuses.count(s) for s in sorted(set(statuses))}}
+    if len(latencies):
+        result.update({f"p{p}_ms": round(float(np.percentile(latencies, p)), 3) for p in PERCENTILES})
+        result.update({"mean_ms": round(float(latencies.mean()), 3), "min_ms": round(float(latencies.min()), 3),
+                       "max_ms": round(float(latencies.max()), 3),
+                       "throughput_rps": round(len(latencies) / wall, 3) if wall > 0 else None,
+                       "bytes_mean": int(np.mean(sizes))})
+    server = [s for s in server if s is not None]
+    if server:
+        result["server_p50_ms"] = round(float(np.percentile(server, 50)), 3)
+    return result
+
+
+def run_scenario(target, path, params, repeat, warmup, concurrency=1, headers=None):
+    for _ in range(warmup):
+        target.request("GET", path, params, headers=headers)
+
+    def timed_request(_):
+        start = time.perf_counter()
+        status, body, response_headers = target.request("GET", path, params, headers=headers)
+        return time.perf_counter() - start, len(body), status, server_ms(response_headers)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed_request, range(repeat)))
+    wall = time.perf_counter() - start
+    result = summarize([s[0] for s in samples], wall, [s[1] for s in samples], [s[2] for s in samples],
+                       [s[3] for s in samples])
+    result.update({"path": path, "params": params or {}})
+    return result
+
+
+def upload(target, csv_path, chunk_rows):
+    """POST the CSV in gzip-compressed chunks, like surveyCleaner.py does."""
+    latencies, sizes, statuses, written = [], [], [], 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype=str, keep_default_na=False):
+        body = gzip.compress(chunk.to_csv(index=False).encode())
+        chunk_start = time.perf_counter()
+        status, response, _ = target.request("POST", "/api/upload", data=body,
+                                             headers={"Content-Type": "text/csv", "Content-Encoding": "gzip"})
+        latencies.append(time.perf_counter() - chunk_start)
+        sizes.append(len(body))
+        statuses.append(status)
+        if status == 200:
+            written += json.loads(response).get("inserted", 0)
+    # time spent in the requests only, not in preparing the chunks
+    busy = sum(latencies)
+    result = summarize(latencies, busy, sizes, statuses, [])
+    result.update({"path": "/api/upload", "chunk_rows": chunk_rows, "inserted": written,
+                   "rows_per_s": round(written / busy, 1) if busy > 0 else None})
+    return result
+
+
+def dataset_facts(csv_path):
+    """Filter values that select a realistic share of the generated rows."""
+    columns = [ingest.DATE_FIELD, ingest.TIME_FIELD, "Latitude", "Longitude", "Temperature (c)", "pH", "ODO mg/L"]
+    df = pd.read_csv(csv_path, usecols=columns, dtype={ingest.DATE_FIELD: str, ingest.TIME_FIELD: str})
+    first = ingest.timestamp(df.iloc[0].to_dict())
+    lat, lon = df["Latitude"].median(), df["Longitude"].median()
+    spread_lat, spread_lon = df["Latitude"].std(), df["Longitude"].std()
+    quantiles = df[["Temperature (c)", "pH", "ODO mg/L"]].quantile([0.25, 0.75])
+    return {"rows": len(df), "survey": first.date().isoformat(),
+            "start": (first + timedelta(hours=1)).isoformat(), "end": (first + timedelta(hours=2)).isoformat(),
+            "bbox": f"{lon - spread_lon},{lat - spread_lat},{lon + spread_lon},{lat + spread_lat}",
+            "near": f"{lat},{lon}",
+            "temp": quantiles["Temperature (c)"].tolist(), "ph": quantiles["pH"].tolist(),
+            "odo": quantiles["ODO mg/L"].tolist()}
+
+
+def cursor_at(target, depth, page=1000):
+    """Continuation token of the page starting at `depth`, found by walking the pages before it."""
+    cursor = None
+    for _ in range(depth // page):
+        params = {"limit": page, "count": "none", "fields": "timestamp"}
+        if cursor:
+            params["cursor"] = cursor
+        status, body, _ = target.request("GET", "/api/observations", params)
+        cursor = json.loads(body).get("next") if status == 200 and body else None
+        if cursor is None:
+            return None
+    return cursor
+
+
+def scenarios(facts, target, repeat):
+    """(name, path, params, repeat) of every request timed."""
+    heavy = max(3, repeat // 5)
+    temp = {"min_temp": facts["temp"][0], "max_temp": facts["temp"][1]}
+    outliers = {"field": "All Columns", "method": "z-score", "k": 3}
+    cases = [
+        ("observations_default", "/api/observations", {"limit": 100}, repeat),
+        ("observations_count_none", "/api/observations", {"limit": 100, "count": "none"}, repeat),
+        ("observations_temp_range", "/api/observations", temp, repeat),
+        ("observations_combined", "/api/observations",
+         {**temp, "min_sal": facts["ph"][0], "max_sal": facts["ph"][1], "min_odo": facts["odo"][0]}, repeat),
+        ("observations_survey", "/api/observations", {"survey": facts["survey"]}, repeat),
+        ("observations_time_range", "/api/observations", {"start": facts["start"], "end": facts["end"]}, repeat),
+        ("observations_bbox", "/api/observations", {"bbox": facts["bbox"]}, repeat),
+        ("observations_near", "/api/observations", {"near": facts["near"], "radius_m": 50}, repeat),
+        ("observations_columnar", "/api/observations",
+         {"limit": 1000, "layout": "columnar", "fields": "timestamp,Temperature (c),pH,ODO mg/L"}, repeat),
+    ]
+    for depth in PAGE_DEPTHS:
+        if depth >= facts["rows"]:
+            break
+        cases.append((f"observations_skip_{depth}", "/api/observations", {"skip": depth, "limit": 100}, repeat))
+        cursor = cursor_at(target, depth) if depth else None
+        if depth and cursor:
+            cases.append((f"observations_cursor_{depth}", "/api/observations",
+                          {"cursor": cursor, "limit": 100}, repeat))
+    cases += [
+        ("downsample_ph", "/api/observations/downsample", {"field": "pH", "survey": facts["survey"]}, repeat),
+        ("grid_survey", "/api/grid", {"survey": facts["survey"], "cell_m": 25}, repeat),
+        ("stats_incremental", "/api/stats", {"mode": "incremental"}, repeat),
+        ("stats_pushdown", "/api/stats", {"mode": "pushdown"}, heavy),
+        ("stats_pandas", "/api/stats", {"mode": "pandas"}, heavy),
+        ("outliers_pushdown", "/api/outliers", {**outliers, "mode": "pushdown"}, heavy),
+        ("outliers_pandas", "/api/outliers", {**outliers, "mode": "pandas"}, heavy),
+        ("outliers_pandas_columnar", "/api/outliers", {**outliers, "mode": "pandas", "layout": "columnar"}, heavy),
+        ("outliers_pushdown_ph_iqr", "/api/outliers", {"field": "pH", "method": "iqr", "k": 1.5, "mode": "pushdown"},
+         heavy),
+    ]
+    return cases
+
+
+def time_cleaning(csv_path, stream_rows):
+    """surveyCleaner timings on the generated survey, in memory and streamed."""
+    import surveyCleaner
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, rows in [("clean_in_memory", None), ("clean_streaming", stream_rows)]:
+            start = time.perf_counter()
+            result = surveyCleaner.clean_file(csv_path, out_dir, rows)
+            seconds = time.perf_counter() - start
+            phases = {k: round(v, 4) for k, v in result.items() if k.endswith("_s")}
+            results[name] = {"seconds": round(seconds, 4), "rows": result["rows"], "removed": result["removed"],
+                             "rows_per_s": round(result["rows"] / seconds, 1), "phases": phases,
+                             "stream_rows": rows}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    """Print the p50/p99 of every scenario of two runs side by side."""
+    with open(before_path) as f:
+        before = json.load(f)["results"]
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+    print(f"{'scenario':34} {'p50 before':>11} {'p50 after':>11} {'ratio':>7} {'p99 before':>11} {'p99 after':>11}")
+    for name in [n for n in before if n in after]:
+        a, b = before[name], after[name]
+        if "p50_ms" in a and "p50_ms" in b:
+            ratio = b["p50_ms"] / a["p50_ms"] if a["p50_ms"] else float("nan")
+            print(f"{name:34} {a['p50_ms']:11.2f} {b['p50_ms']:11.2f} {ratio:7.2f} "
+                  f"{a['p99_ms']:11.2f} {b['p99_ms']:11.2f}")
+        elif "seconds" in a and "seconds" in b:
+            print(f"{name:34} {a['seconds'] * 1000:11.2f} {b['seconds'] * 1000:11.2f} "
+                  f"{b['seconds'] / a['seconds']:7.2f}")
+
+
+def run(args):
+    csv_path = args.csv
+    generated = None
+    if not csv_path:
+        generated = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        generated.close()
+        csv_path = generated.name
+        start = time.perf_counter()
+        rows = synthData.write_csv(synthData.generate(synthData.template_profile(args.template), args.rows,
+                                                      args.survey_rows, seed=args.seed), csv_path)
+        print(f"Generated {rows} rows in {time.perf_counter() - start:.2f}s")
+
+    try:
+        target = HttpTarget(args.url) if args.url else in_process_target(args)
+        facts = dataset_facts(csv_path)
+        results = {}
+        if not args.skip_upload:
+            results["upload"] = upload(target, csv_path, args.chunk_rows)
+            print(f"upload: {results['upload'].get('rows_per_s')} rows/s")
+        for name, path, params, repeat in scenarios(facts, target, args.repeat):
+            results[name] = run_scenario(target, path, params, repeat, args.warmup, args.concurrency)
+            print(f"{name}: p50 {results[name].get('p50_ms')} ms, p99 {results[name].get('p99_ms')} ms, "
+                  f"errors {results[name]['errors']}")
+        if not args.skip_clean:
+            results.update(time_cleaning(csv_path, args.stream_rows))
+            for name in ["clean_in_memory", "clean_streaming"]:
+                print(f"{name}: {results[name]['seconds']}s, {results[name]['rows_per_s']} rows/s")
+    finally:
+        if generated:
+            os.unlink(csv_path)
+
+    target_name = args.url or (f"in-process on {args.mongo_uri}" if args.mongo_uri else "in-process on mongomock")
+    return {"run": {"at": datetime.now(timezone.utc).isoformat(), "commit": git_commit(), "target": target_name,
+                    "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                    "rows": facts["rows"], "repeat": args.repeat, "warmup": args.warmup,
+                    "concurrency": args.concurrency, "cache": bool(args.url) or args.cache},
+            "dataset": facts, "results": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the API and the cleaning pipeline on synthetic surveys.")
+    parser.add_argument("--rows", type=int, default=20000, help="rows to generate")
+    parser.add_argument("--csv", help="benchmark this survey CSV instead of generating one")
+    parser.add_argument("--template", default=synthData.TEMPLATE, help="schema template of the generated survey")
+    parser.add_argument("--survey-rows", type=int, default=synthData.SURVEY_ROWS, help="rows per generated survey day")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="benchmark a running API instead of this process")
+    parser.add_argument("--mongo-uri", help="mongod for the in-process API (default: in-memory mongomock)")
+    parser.add_argument("--database", default="wq_bench", help="database of in-process runs, dropped first")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache of in-process runs on")
+    parser.add_argument("--repeat", type=int, default=20, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before each scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight per scenario")
+    parser.add_argument("--chunk-rows", type=int, default=UPLOAD_CHUNK_ROWS, help="rows per upload request")
+    parser.add_argument("--stream-rows", type=int, default=100000, help="chunk size of the streamed cleaning run")
+    parser.add_argument("--skip-upload", action="store_true", help="the target already holds the survey")
+    parser.add_argument("--skip-clean", action="store_true")
+    parser.add_argument("--out", help="JSON file for the results (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.out}")
+    else:
+        print(text)
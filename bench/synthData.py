@@ -0,0 +1,129 @@
+import argparse
+import math
+import os
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# Synthetic ASV surveys with the schema of the CSVs in database/: same columns
+# in the same order, same types, and values drawn around each column's mean and
+# spread in a template survey. Readings drift smoothly (moving averages of
+# noise) like a sonde's, a few rows get spikes for the cleaning step to remove,
+# and rows are logged once a second, one survey day after another, so the
+# natural keys and timestamps stay unique at any size.
+#
+#   python bench/synthData.py --rows 1000000 --out /tmp/asv_1M.csv
+#   python bench/synthData.py --rows 50000 --out /tmp/asv.csv --template database/2021-oct21.csv --seed 7
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database", "2022-oct7.csv")
+DATE_FIELDS = ["Date", "Date m/d/y   "]
+TIME_FIELD = "Time hh:mm:ss"
+GPS_TIME_FIELD = "Time"
+SURVEY_ROWS = 8 * 3600
+SURVEY_START = datetime(2023, 1, 5, 9, 0, 0)
+SURVEY_EVERY_DAYS = 7
+SMOOTHING = 60
+SPIKE_STD = 8
+# readings that get the occasional spike
+SPIKE_FIELDS = ["Temperature (c)", "pH", "ODO mg/L", "Sal ppt", "Chl ug/L", "Turbid+ NTU", "SpCond mS/cm"]
+
+
+def decimals(text):
+    # digits after the decimal point of a printed value, to write values at the template's precision
+    return len(text.split(".", 1)[1]) if "." in text and "e" not in text.lower() else 0
+
+
+def template_profile(path=TEMPLATE):
+    """Columns of the template survey in order, each with its kind and the statistics values are drawn from."""
+    df = pd.read_csv(path)
+    text = pd.read_csv(path, dtype=str)
+    profile = []
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            values = column.dropna()
+            profile.append({"name": name, "kind": "int" if pd.api.types.is_integer_dtype(column) else "float",
+                            "mean": float(values.mean()), "std": float(values.std(ddof=0)),
+                            "min": float(values.min()), "max": float(values.max()),
+                            "decimals": min(max((decimals(v) for v in text[name].dropna()), default=0), 8)})
+        else:
+            profile.append({"name": name, "kind": "text", "values": column.dropna().astype(str).unique().tolist()})
+    return profile
+
+
+def smooth_noise(rng, rows, columns, window=SMOOTHING):
+    """Unit-variance noise that drifts over about `window` rows: a moving sum of white noise."""
+    noise = rng.standard_normal((rows + window, columns))
+    totals = np.cumsum(noise, axis=0)
+    return (totals[window:] - totals[:-window]) / math.sqrt(window)
+
+
+def survey_frame(profile, rng, rows, start, outlier_rate):
+    seconds = np.arange(rows)
+    numeric = [column for column in profile if column["kind"] != "text"]
+    drift = smooth_noise(rng, rows, len(numeric))
+    data = {}
+    for i, column in enumerate(numeric):
+        values = column["mean"] + column["std"] * drift[:, i]
+        if column["std"] > 0:
+            values = np.clip(values, column["min"] - column["std"], column["max"] + column["std"])
+        if column["name"] in SPIKE_FIELDS and outlier_rate > 0:
+            spikes = rng.random(rows) < outlier_rate
+            values[spikes] += rng.choice([-1, 1], spikes.sum()) * SPIKE_STD * max(column["std"], 1e-3)
+        if column["kind"] == "int":
+            data[column["name"]] = np.round(values).astype(np.int64)
+        else:
+            data[column["name"]] = np.round(values, column["decimals"])
+
+    stamps = pd.to_datetime(start) + pd.to_timedelta(seconds, unit="s")
+    date = f"{start.month}/{start.day}/{start.year % 100:02d}"
+    # the GPS clock runs a few seconds ahead of the sonde and prints mm:ss.f
+    gps = stamps + pd.Timedelta(seconds=rng.integers(5, 60))
+    texts = {TIME_FIELD: stamps.strftime("%H:%M:%S"),
+             GPS_TIME_FIELD: gps.strftime("%M:%S") + "." + str(rng.integers(0, 10))}
+    for column in profile:
+        name = column["name"]
+        if column["kind"] != "text":
+            continue
+        if name in DATE_FIELDS:
+            data[name] = date
+        elif name in texts:
+            data[name] = texts[name]
+        else:
+            data[name] = rng.choice(column["values"], rows) if column["values"] else ""
+    return pd.DataFrame({column["name"]: data[column["name"]] for column in profile})
+
+
+def generate(profile, rows, survey_rows=SURVEY_ROWS, outlier_rate=0.001, seed=0):
+    """DataFrames of one survey day each, `rows` rows in total."""
+    rng = np.random.default_rng(seed)
+    for survey in range(math.ceil(rows / survey_rows)):
+        start = SURVEY_START + timedelta(days=survey * SURVEY_EVERY_DAYS)
+        yield survey_frame(profile, rng, min(survey_rows, rows - survey * survey_rows), start, outlier_rate)
+
+
+def write_csv(frames, path):
+    """Write the frames one after another to path; returns the number of rows."""
+    rows = 0
+    with open(path, "w", newline="") as f:
+        for i, frame in enumerate(frames):
+            frame.to_csv(f, index=False, header=i == 0)
+            rows += len(frame)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic ASV survey CSV.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--out", required=True, help="CSV file to write")
+    parser.add_argument("--template", default=TEMPLATE, help="survey whose schema and value ranges are copied")
+    parser.add_argument("--survey-rows", type=int, default=SURVEY_ROWS, help="rows per survey day (one per second)")
+    parser.add_argument("--outliers", type=float, default=0.001, help="share of rows with a spiked reading")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    profile = template_profile(args.template)
+    rows = write_csv(generate(profile, args.rows, args.survey_rows, args.outliers, args.seed), args.out)
+    print(f"Wrote {rows} rows x {len(profile)} columns to {args.out} in {time.perf_counter() - start:.2f}s")
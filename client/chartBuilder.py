@@ -0,0 +1,204 @@
+import os
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import requests
+import streamlit as st
+from datasetCache import load_survey
+from downsample import downsample, finite_rows, time_seconds
+from gridEngine import cell_polygons
+
+# Figures of the Plotly tab. Built figures are cached per survey (path and
+# modification time) and option set, and the reduced rows they are drawn from
+# are cached separately, so changing only the colour or size reuses them.
+# Long Scatter/Line series are reduced by /api/observations/downsample for the
+# survey day (the API sends the picked rows, with the colour and size columns);
+# the same reduction runs locally if the API can't be reached or doesn't have
+# the survey. Charts with many points switch to WebGL; map points are thinned
+# to about one per MAP_CELL_PIXELS screen pixels at the chosen zoom.
+# The grid mode of the map draws the cells of /api/grid instead of points.
+# Figures are shared between sessions: don't modify the returned objects.
+
+CHART_POINTS = 2000
+WEBGL_THRESHOLD = 1000
+MAP_CELL_PIXELS = 2
+MAX_FIGURES = 64
+GRID_TTL = 300
+# size of the map figures (Plotly's default height, about the width of the tab)
+MAP_WIDTH_PX = 700
+MAP_HEIGHT_PX = 450
+MAX_ZOOM = 18
+SERIES_TTL = 300
+
+
+def axes(df, x_col, y_col):
+    """(x, y) float arrays of the chart, None if the x axis is neither numbers nor times."""
+    ys = pd.to_numeric(df[y_col], errors="coerce").to_numpy(dtype="float64")
+    if pd.api.types.is_numeric_dtype(df[x_col]):
+        return df[x_col].to_numpy(dtype="float64", na_value=np.nan), ys
+    xs = time_seconds(df[x_col].to_numpy())
+    return None if np.isnan(xs).all() else (xs, ys)
+
+
+def reduce_rows(df, x_col, y_col, method, points=CHART_POINTS):
+    """Rows of df picked by the /api/observations/downsample algorithms, or df unchanged if it is small
+    or the axes aren't numbers or times."""
+    if len(df) <= points or axes(df, x_col, y_col) is None:
+        return df
+    xs, ys = axes(df, x_col, y_col)
+    rows = finite_rows(xs, ys)
+    rows = rows[np.argsort(xs[rows], kind="stable")]
+    _, _, picked = downsample(xs[rows], ys[rows], points, method)
+    return df.iloc[rows[picked]]
+
+
+def thin_map_rows(df, lat_col, lon_col, zoom, cell_pixels=MAP_CELL_PIXELS):
+    """First row of every map cell of cell_pixels screen pixels at zoom; rows without coordinates are dropped."""
+    lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype="float64")
+    lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype="float64")
+    rows = finite_rows(lon, lat)
+    if len(rows) == 0:
+        return df.iloc[rows]
+    # a 256 px tile spans 360 / 2**zoom degrees of longitude; latitude degrees
+    # are longer on screen by 1 / cos(latitude) in Web Mercator
+    cell = cell_pixels * 360 / (256 * 2 ** zoom)
+    lat_cell = cell * np.cos(np.radians(np.nanmean(lat[rows])))
+    cells = np.stack([np.floor(lon[rows] / cell), np.floor(lat[rows] / lat_cell)], axis=1)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    return df.iloc[rows[np.sort(first)]]
+
+
+def fit_zoom(lat, lon, width=MAP_WIDTH_PX, height=MAP_HEIGHT_PX):
+    """Largest whole zoom at which every point fits a width x height map centred on their mean, as the maps are."""
+    lat = pd.to_numeric(pd.Series(lat), errors="coerce").to_numpy(dtype="float64")
+    lon = pd.to_numeric(pd.Series(lon), errors="coerce").to_numpy(dtype="float64")
+    rows = finite_rows(lon, lat)
+    if len(rows) == 0:
+        return MAX_ZOOM
+    # Web Mercator: x is the longitude, y grows like log(tan) of the latitude, both in degrees of x
+    x = lon[rows]
+    y = np.degrees(np.log(np.tan(np.pi / 4 + np.radians(np.clip(lat[rows], -85, 85)) / 2)))
+    # twice the farthest distance from the centre on each axis
+    x_span = 2 * max(x.max() - x.mean(), x.mean() - x.min())
+    y_span = 2 * max(y.max() - y.mean(), y.mean() - y.min())
+    # a 256 px tile spans 360 / 2**zoom degrees
+    with np.errstate(divide="ignore"):
+        zoom = min(np.log2(width * 360 / (256 * x_span)), np.log2(height * 360 / (256 * y_span)))
+    return int(np.clip(np.floor(zoom), 1, MAX_ZOOM))
+
+
+def style_kwargs(color, size):
+    kwargs = {}
+    if color:
+        kwargs["color"] = color
+    if size:
+        kwargs["size"] = size
+    return kwargs
+
+
+@st.cache_data(ttl=SERIES_TTL, show_spinner=False)
+def fetch_series(base_url, survey, x_col, y_col, method, extra, points):
+    """/api/observations/downsample response for one survey day, with the extra columns of the picked rows."""
+    params = {"survey": survey, "x": x_col, "field": y_col, "points": points, "method": method}
+    if extra:
+        params["extra"] = ",".join(extra)
+    r = requests.get(f"{base_url}/api/observations/downsample", params=params, timeout=30)
+    r.raise_for_status()
+    return r.json()
+
+
+def served_rows(base_url, survey, df, x_col, y_col, method, extra):
+    """Rows the API picked for the chart, None if it can't be reached or has no rows of the survey."""
+    try:
+        series = fetch_series(base_url, survey, x_col, y_col, method, extra, CHART_POINTS)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Downsampling locally, {base_url}/api/observations/downsample failed: {e}")
+        return None
+    if not series.get("count"):
+        return None
+    # same column order and dtypes as the survey, so the figure doesn't depend on where rows came from
+    rows = pd.DataFrame(series["columns"], columns=series["fields"])
+    return rows.astype({c: df[c].dtype for c in rows.columns if c in df.columns}, errors="ignore")
+
+
+@st.cache_resource(max_entries=MAX_FIGURES, ttl=SERIES_TTL, show_spinner=False)
+def _xy_rows(path, mtime, time_col, x_col, y_col, method, extra, show_all, base_url, survey):
+    df = load_survey(path, time_col)
+    if show_all or len(df) <= CHART_POINTS or axes(df, x_col, y_col) is None:
+        return df
+    rows = served_rows(base_url, survey, df, x_col, y_col, method, extra) if base_url and survey else None
+    return rows if rows is not None else reduce_rows(df, x_col, y_col, method)
+
+
+@st.cache_resource(max_entries=MAX_FIGURES, show_spinner=False)
+def _map_rows(path, mtime, time_col, lat_col, lon_col, zoom, show_all):
+    df = load_survey(path, time_col)
+    return df if show_all else thin_map_rows(df, lat_col, lon_col, zoom)
+
+
+@st.cache_resource(max_entries=MAX_FIGURES, ttl=SERIES_TTL, show_spinner=False)
+def _xy_figure(path, mtime, time_col, kind, x_col, y_col, color, size, show_all, base_url, survey):
+    # long surveys: LTTB keeps the shape of a line, min/max keeps the spread of a scatter
+    extra = tuple(dict.fromkeys(c for c in [color, size] if c and c not in [x_col, y_col]))
+    df = _xy_rows(path, mtime, time_col, x_col, y_col, "minmax" if kind == "Scatter" else "lttb", extra, show_all,
+                  base_url, survey)
+    render_mode = "webgl" if len(df) > WEBGL_THRESHOLD else "auto"
+    make = px.scatter if kind == "Scatter" else px.line
+    return make(df, x=x_col, y=y_col, render_mode=render_mode, **style_kwargs(color, size)), len(df)
+
+
+@st.cache_resource(max_entries=MAX_FIGURES, show_spinner=False)
+def _map_figure(path, mtime, time_col, lat_col, lon_col, zoom, hover_cols, color, size, show_all):
+    # MapLibre draws with WebGL already, only the number of points matters
+    df = _map_rows(path, mtime, time_col, lat_col, lon_col, zoom, show_all)
+    fig = px.scatter_map(df, lat=lat_col, lon=lon_col, hover_data=list(hover_cols), zoom=zoom,
+                         **style_kwargs(color, size))
+    fig.update_layout(map_style="open-street-map", margin=dict(l=0, r=0, t=0, b=0), height=MAP_HEIGHT_PX)
+    return fig, len(df)
+
+
+def xy_chart(path, time_col, kind, x_col, y_col, color=None, size=None, show_all=False, base_url=None, survey=None):
+    """("Scatter" or "Line" figure of the survey at path, number of points drawn). Long series are reduced
+    by the API at base_url for the survey day, or locally without one."""
+    return _xy_figure(path, os.path.getmtime(path), time_col, kind, x_col, y_col, color, size, show_all,
+                      base_url, survey)
+
+
+def map_chart(path, time_col, lat_col, lon_col, zoom, hover_cols=(), color=None, size=None, show_all=False):
+    """(scatter map of the survey at path, number of points drawn)."""
+    return _map_figure(path, os.path.getmtime(path), time_col, lat_col, lon_col, zoom, tuple(hover_cols),
+                       color, size, show_all)
+
+
+@st.cache_data(ttl=GRID_TTL, show_spinner=False)
+def fetch_grid(base_url, survey, cell_m, shape):
+    """/api/grid response for one survey (all of them if survey is None)."""
+    params = {"cell_m": cell_m, "shape": shape}
+    if survey:
+        params["survey"] = survey
+    r = requests.get(f"{base_url}/api/grid", params=params, timeout=30)
+    r.raise_for_status()
+    return r.json()
+
+
+# expires with the response it draws, so an upload shows up after GRID_TTL like the data does
+@st.cache_resource(max_entries=MAX_FIGURES, ttl=GRID_TTL, show_spinner=False)
+def _grid_figure(base_url, survey, cell_m, shape, field, zoom):
+    grid = fetch_grid(base_url, survey, cell_m, shape)
+    stats = grid["stats"][field]
+    df = pd.DataFrame({"cell": np.arange(grid["cells"]), "points": grid["count"], "mean": stats["mean"],
+                       "min": stats["min"], "max": stats["max"]})
+    rings = cell_polygons(shape, cell_m, grid["ref_lat"], grid["lat"], grid["lon"])
+    geojson = {"type": "FeatureCollection",
+               "features": [{"type": "Feature", "id": i, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+                            for i, ring in enumerate(rings)]}
+    center = {"lat": float(np.mean(grid["lat"])), "lon": float(np.mean(grid["lon"]))} if grid["cells"] else None
+    fig = px.choropleth_map(df, geojson=geojson, locations="cell", color="mean", hover_data=["points", "min", "max"],
+                            labels={"mean": f"mean {field}"}, opacity=0.6, zoom=zoom, center=center)
+    fig.update_layout(map_style="open-street-map", margin=dict(l=0, r=0, t=0, b=0), height=MAP_HEIGHT_PX)
+    return fig, grid["cells"], grid["points"]
+
+
+def grid_chart(base_url, survey, cell_m, shape, field, zoom):
+    """(map of the /api/grid cells coloured by the mean of field, number of cells, number of points binned)."""
+    return _grid_figure(base_url, survey, cell_m, shape, field, zoom)
@@ -0,0 +1,69 @@
+import os
+import pandas as pd
+import streamlit as st
+from columnarStore import ensure_store, load_frame
+
+# Survey files are parsed once per (path, modification time) and shared by
+# every session and rerun, together with the min/max of each column used by
+# the sidebar sliders. Editing or regenerating a file changes its mtime, which
+# is enough to load it again. Files are read through their columnar store
+# (api/columnarStore.py), so only the requested columns are touched.
+# The cached frames are shared: copy them before modifying anything.
+
+MAX_ENTRIES = 32
+
+
+@st.cache_resource(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load(path, mtime, time_col, columns):
+    df = load_frame(path, list(columns) if columns else None)
+    if time_col and time_col in df.columns:
+        df[time_col] = pd.to_datetime(df[time_col], format="%H:%M:%S").dt.time
+    return df
+
+
+@st.cache_resource(max_entries=MAX_ENTRIES, show_spinner=False)
+def _ranges(path, mtime, time_col):
+    meta = ensure_store(path)
+    if meta is None:
+        return _scan_ranges(_load(path, mtime, time_col, None), time_col)
+
+    # numeric min/max were computed when the store was written, only the time column is read
+    ranges = {c["name"]: (c["min"], c["max"]) for c in meta["columns"] if "min" in c}
+    if time_col in [c["name"] for c in meta["columns"]]:
+        s = _load(path, mtime, time_col, (time_col,))[time_col].dropna()
+        if not s.empty:
+            ranges[time_col] = (s.min(), s.max())
+    return ranges
+
+
+def _scan_ranges(df, time_col):
+    ranges = {}
+    for col in df.columns:
+        if col == time_col:
+            s = df[col].dropna()
+            if not s.empty:
+                ranges[col] = (s.min(), s.max())
+            continue
+        s = pd.to_numeric(df[col], errors="coerce").dropna()
+        if not s.empty:
+            ranges[col] = (float(s.min()), float(s.max()))
+    return ranges
+
+
+def load_survey(path, time_col=None, columns=None):
+    """Return the parsed survey at path (only columns, if given), with time_col converted to datetime.time."""
+    return _load(path, os.path.getmtime(path), time_col, tuple(columns) if columns else None)
+
+
+def column_ranges(path, time_col=None):
+    """Return {column: (min, max)} for every numeric column (and time_col) of the survey."""
+    return _ranges(path, os.path.getmtime(path), time_col)
+
+
+def global_min_max(paths, col, time_col=None):
+    """Return (min, max) of col across the surveys at paths, skipping files without it."""
+    found = [column_ranges(path, time_col).get(col) for path in paths]
+    found = [r for r in found if r is not None]
+    if not found:
+        return None, None
+    return min(r[0] for r in found), max(r[1] for r in found)
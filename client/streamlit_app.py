@@ -1,11 +1,17 @@
 import streamlit as st
 import requests
 import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
-import numpy as np
 import os
-import datetime
+import sys
+from urllib.parse import quote
+
+# shared helpers that live with the API
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from surveyCleaner import clean_file, upload_file, report
+from datasetCache import load_survey, global_min_max
+from chartBuilder import xy_chart, map_chart, grid_chart, fit_zoom, CHART_POINTS, MAX_ZOOM
+from ingest import timestamp
 
 # configuration
 load_dotenv()
@@ -71,12 +77,19 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Load data
-df1 = pd.read_csv("./database/2022-oct7.csv")
-df2 = pd.read_csv("./database/2021-oct21.csv")
-df3 = pd.read_csv("./database/2022-nov16.csv")
-df4 = pd.read_csv("./database/2021-dec16.csv")
-all_dfs = [df1, df2, df3, df4]
+# Load data (parsed once and shared between sessions and reruns, see datasetCache.py)
+RAW_FILES = {
+    "Oct 7, 2022": "./database/2022-oct7.csv",
+    "Oct 21, 2021": "./database/2021-oct21.csv",
+    "Nov 16, 2022": "./database/2022-nov16.csv",
+    "Dec 16, 2021": "./database/2021-dec16.csv",
+}
+CLEAN_FILES = {
+    "Oct 7, 2022": "./database/cleaned_2022-oct7.csv",
+    "Oct 21, 2021": "./database/cleaned_2021-oct21.csv",
+    "Nov 16, 2022": "./database/cleaned_2022-nov16.csv",
+    "Dec 16, 2021": "./database/cleaned_2021-dec16.csv",
+}
 
 query_parameters = {
     "min_time": None, 
@@ -92,12 +105,8 @@ query_parameters = {
 }
 
 ##datasets for drop down
-datasets = {
-    "Oct 7, 2022": df1,
-    "Oct 21, 2021": df2,
-    "Nov 16, 2022": df3,
-    "Dec 16, 2021": df4,
-}
+datasets = {name: load_survey(path) for name, path in RAW_FILES.items()}
+all_dfs = list(datasets.values())
 
 clean_datasets = {
     "Oct 7, 2022": None,
@@ -106,13 +115,6 @@ clean_datasets = {
     "Dec 16, 2021": None,
 }
 
-def check_exceptions(filepath):
-    try:
-        df = pd.read_csv(filepath)
-    except FileNotFoundError:
-        df = pd.DataFrame()
-    return df
-
 # Helpers: resolve column names & numeric ranges safely
 def find_existing_col(dfs, aliases):
     """Return the first alias that exists in ANY dataframe; else None."""
@@ -122,72 +124,6 @@ def find_existing_col(dfs, aliases):
                 return name
     return None
 
-def numeric_series(df, col):
-    """Return numeric series (coerced) for df[col], or empty Series if not present."""
-    if col not in df.columns:
-        return pd.Series(dtype="float64")
-    return pd.to_numeric(df[col], errors="coerce")
-
-def global_min_max(dfs, col):
-    """Return (min, max) across dfs[col], skipping NaNs and missing columns."""
-    vals = []
-    for d in dfs:
-        if col in d.columns:
-            s = numeric_series(d, col).dropna()
-            if not s.empty:
-                vals.extend(s.tolist())
-    if not vals:
-        return None, None
-    return float(pd.Series(vals).min()), float(pd.Series(vals).max())
-
-def global_min_max_time(dfs):
-    """Return (min, max) across dfs[col], skipping NaNs and missing columns."""
-    mins = []
-    maxs = []
-    for d in dfs:
-        if TIMESTAMP_COL in d.columns:
-            mins.append(d[TIMESTAMP_COL].min())
-            maxs.append(d[TIMESTAMP_COL].max())
-    if not mins or not maxs:
-        return None, None
-    return min(mins), max(maxs)
-
-def convert_to_time(string):
-    return datetime.datetime.strptime(string, "%H:%M:%S").time()
-
-def clean(df, filepath):
-    # ZScore Formula
-    # zscore = ((X - mean) / standard deviation))
-
-    # Specifying columns with only numeric values
-    new_df = df.select_dtypes(include='number')
-
-    # Using Formula
-    df_zscore = (new_df - new_df.mean()) / new_df.std(ddof=0)
-
-    # Outliers that have |z| > 3
-    outliers = (df_zscore.abs() > 3).any(axis=1)
-
-    totalrows = len(df)  # number of rows in data
-    removedrows = outliers.sum()  # number of rows removed
-    remainingrows = totalrows - removedrows  # remaininggrows
-
-    # Removing outliers
-    cleaned_dataset = df[~outliers]
-
-    # Moving "timestamp" column to be the first one
-    moved_column = cleaned_dataset.pop("Time hh:mm:ss")
-    cleaned_dataset.insert(0, "Time hh:mm:ss", moved_column)
-
-    # Generating csv, printing report, and sending request to flask with json data, to upload to MongoDB
-    cleaned_dataset.to_csv(filepath, index = False)
-    report = f"{filepath}: Removed {totalrows - removedrows} outliers (from total of {totalrows} rows to remaining rows of {remainingrows})"
-    print(report)
-
-    response = requests.post(BASE_URL + "/api/upload", json=(cleaned_dataset.replace({np.nan: None})).to_dict(orient="records"))
-    print(f"Status code of uploading to MongoDB: {response.status_code}")
-    return cleaned_dataset
-
 # Column aliases to handle inconsistent CSV headers
 TEMP_ALIASES = ['Temperature (C)', 'Temperature (°C)', 'Temperature', 'Temp (C)', 'Temperature (c)']
 ODO_ALIASES  = ['ODO (mg/L)', 'ODO mg/L', 'ODO', 'ODO_mg_L']
@@ -222,23 +158,24 @@ selected_dataset_name = st.sidebar.selectbox(
 selected_df = datasets[selected_dataset_name]
 
 st.sidebar.header("Filters")
-# Responsible for cleaning csv files if they're initially missing
-i = 0
-keysList = list(clean_datasets.keys())
-for str in ["./database/cleaned_2022-oct7.csv", "./database/cleaned_2021-oct21.csv", "./database/cleaned_2022-nov16.csv", "./database/cleaned_2021-dec16.csv"]:
-    df = check_exceptions(str)
-    if df.empty:
-        df = clean(datasets[keysList[i]], str)
-    df.loc[:, TIMESTAMP_COL] = df[TIMESTAMP_COL].map(convert_to_time)
-    clean_datasets.update({keysList[i]: df})
-    i += 1
+# Responsible for cleaning csv files if they're initially missing; new surveys are
+# normally cleaned and uploaded ahead of time with api/surveyCleaner.py
+for name, path in CLEAN_FILES.items():
+    if not os.path.exists(path):
+        result = clean_file(RAW_FILES[name])
+        try:
+            result.update(upload_file(result["output"], BASE_URL))
+        except OSError as e:
+            print(f"Upload of {result['output']} failed: {e}")
+        print(report(result))
+    clean_datasets.update({name: load_survey(path, TIMESTAMP_COL)})
 
 selected_clean = clean_datasets[selected_dataset_name]
-all_clean = list(clean_datasets.values())
+clean_paths = list(CLEAN_FILES.values())
 
 # 1) Timestamp Slider
 if TIMESTAMP_COL:
-    time_min_val, time_max_val = global_min_max_time(all_clean)
+    time_min_val, time_max_val = global_min_max(clean_paths, TIMESTAMP_COL, TIMESTAMP_COL)
     if time_min_val is not None:
         time_min, time_max = st.sidebar.slider(
             "Start/End Timestamps",
@@ -255,7 +192,7 @@ else:
 
 # 2) Temperature slider (only if column found and has data)
 if TEMP_COL:
-    temp_min_val, temp_max_val = global_min_max(all_clean, TEMP_COL)
+    temp_min_val, temp_max_val = global_min_max(clean_paths, TEMP_COL, TIMESTAMP_COL)
     if temp_min_val is not None:
         temp_min, temp_max = st.sidebar.slider(
             f"{TEMP_COL}",
@@ -272,7 +209,7 @@ else:
 
 # 3) Salinity (pH) slider
 if SAL_COL:
-    sal_min_val, sal_max_val = global_min_max(all_clean, SAL_COL)
+    sal_min_val, sal_max_val = global_min_max(clean_paths, SAL_COL, TIMESTAMP_COL)
     if sal_min_val is not None:
         sal_min, sal_max = st.sidebar.slider(
             f"{SAL_COL}",
@@ -289,7 +226,7 @@ else:
 
 # 4) ODO slider
 if ODO_COL:
-    odo_min_val, odo_max_val = global_min_max(all_clean, ODO_COL)
+    odo_min_val, odo_max_val = global_min_max(clean_paths, ODO_COL, TIMESTAMP_COL)
     if odo_min_val is not None:
         odo_min, odo_max = st.sidebar.slider(
             f"{ODO_COL}",
@@ -315,7 +252,7 @@ query_parameters.update({"limit": limit})
 
 # 6) Skip Text-Box (for pagination)
 skip = st.sidebar.number_input("Skip", value = 0, min_value=0)
-if skip > 500: st.sidebar.warning("A large skip value may exceed the maximum size of the collection.")
+if skip > 500: st.sidebar.warning("Large skip values are slow, use the Next page button in the Filtered Dataset tab instead.")
 
 query_parameters.update({"skip": skip})
 
@@ -346,26 +283,53 @@ with tab2:
     st.markdown(
         f'<h2 style="color: black;">Dataset with Query Parameters</h2>',
         unsafe_allow_html=True)
-    if st.button("Load", key="filters_button"):
+    # only the selected columns are fetched, and they come back as one array per column
+    st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Columns</p>", unsafe_allow_html=True)
+    default_fields = [c for c in [TIMESTAMP_COL, "Latitude", "Longitude", TEMP_COL, SAL_COL, ODO_COL] if c in selected_clean.columns]
+    fields = st.multiselect(
+        label="Columns",
+        options=selected_clean.columns.tolist(),
+        default=default_fields,
+        key="filters_fields",
+        label_visibility="collapsed"
+    )
+    load_clicked = st.button("Load", key="filters_button")
+    # continuation token of the last page loaded, so the next one doesn't need skip;
+    # it only continues the query it came from, so changing a filter or the columns drops it
+    page_query = (tuple((key, str(value)) for key, value in query_parameters.items() if key != "skip"), tuple(fields))
+    if st.session_state.get("next_cursor_query") != page_query:
+        st.session_state["next_cursor"] = None
+    next_clicked = st.button("Next page", key="next_page_button", disabled=not st.session_state.get("next_cursor"))
+    if load_clicked or next_clicked:
         try:
             url = f"{BASE_URL}/api/observations?"
             for key, value in query_parameters.items():
-                if value is not None:
+                if value is not None and not (next_clicked and key == "skip"):
                     url += f"{key}={value}&"
+            if next_clicked:
+                url += f"cursor={st.session_state['next_cursor']}&"
+            if fields:
+                url += f"fields={quote(','.join(fields))}&"
+            url += "layout=columnar&"
             new_url = url[:-1]
 
             r = requests.get(new_url, timeout=8)
             r.raise_for_status()
             filters = r.json()
+            st.session_state["next_cursor"] = filters.get("next")
+            st.session_state["next_cursor_query"] = page_query
             if (len(filters) != 0):
-                count = filters["count"]
-                documents = filters["items"]
+                # cursor pages come without the count, it is the one of the first page
+                if filters["count"] is not None:
+                    st.session_state["page_count"] = filters["count"]
+                count = st.session_state.get("page_count")
                 st.markdown(
                 f'<p style="color: black;">{count} documents found.</p>',
                 unsafe_allow_html=True)
-                df = pd.DataFrame(documents)
-                moved_column = df.pop("Time hh:mm:ss")
-                df.insert(0, "Time hh:mm:ss", moved_column)
+                df = pd.DataFrame(filters["columns"], columns=filters["fields"])
+                if "Time hh:mm:ss" in df.columns:
+                    moved_column = df.pop("Time hh:mm:ss")
+                    df.insert(0, "Time hh:mm:ss", moved_column)
                 st.dataframe(df, width='stretch')
             else:
                 st.error("No documents were found in the collection.")
@@ -412,13 +376,14 @@ with tab3:
         label_visibility="collapsed"
     )
 
-    def _opt_kwargs():
-        kwargs = {}
-        if color_opt != "(none)":
-            kwargs["color"] = color_opt
-        if size_opt != "(none)":
-            kwargs["size"] = size_opt
-        return kwargs
+    # figures come from chartBuilder's cache, keyed by survey file and options
+    selected_path = CLEAN_FILES[selected_dataset_name]
+    color = None if color_opt == "(none)" else color_opt
+    size = None if size_opt == "(none)" else size_opt
+    show_all = st.checkbox(f"Plot every point (large surveys are reduced to about {CHART_POINTS} points)", value=False, key="chart_show_all")
+    # the survey day the API tagged the selected dataset's rows with at ingestion
+    first_timestamp = timestamp(df.iloc[0]) if len(df) else None
+    survey = first_timestamp.date().isoformat() if first_timestamp else None
 
     # Scatter or Line plot
     if chart_type != "Map":
@@ -437,10 +402,10 @@ with tab3:
             label_visibility="collapsed"
         )
 
-        if chart_type == "Scatter":
-            fig = px.scatter(df, x=x_col, y=y_col, **_opt_kwargs())
-        elif chart_type == "Line":
-            fig = px.line(df, x=x_col, y=y_col, **_opt_kwargs())
+        fig, shown = xy_chart(selected_path, TIMESTAMP_COL, chart_type, x_col, y_col, color, size, show_all,
+                              BASE_URL, survey)
+        if shown < len(df):
+            st.caption(f"Showing {shown} of {len(df)} points")
 
         st.plotly_chart(fig, use_container_width=True, config={"displaylogo": False, "responsive": True})
 
@@ -458,36 +423,69 @@ with tab3:
                 f"Tried latitude aliases: {LAT_ALIASES}; longitude aliases: {LON_ALIASES}."
             )
         else:
-            st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Hover data (optional)</p>", unsafe_allow_html=True)
-            hover_cols = st.multiselect(
-                label="Hover data (optional)",
-                options=["(none)"] + [c for c in all_cols if c not in {lat_col, lon_col}],
-                default=[],
+            # Points draws the survey's rows, Grid the per-cell aggregates of /api/grid
+            st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Map mode</p>", unsafe_allow_html=True)
+            map_mode = st.radio(
+                label="Map mode",
+                options=["Points", "Grid"],
+                horizontal=True,
+                key="map_mode",
                 label_visibility="collapsed"
             )
 
             st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Map zoom</p>", unsafe_allow_html=True)
+            # starts at the zoom that shows the whole survey
             zoom = st.slider(
                 label="Map zoom",
                 min_value=1,
-                max_value=18,
-                value=17,
+                max_value=MAX_ZOOM,
+                value=fit_zoom(df[lat_col], df[lon_col]),
                 label_visibility="collapsed"
             )
 
-            fig = px.scatter_map(
-                df,
-                lat=lat_col,
-                lon=lon_col,
-                hover_data=hover_cols,
-                **_opt_kwargs(),
-                zoom=zoom
-            )
-            fig.update_layout(
-                map_style="open-street-map",
-                margin=dict(l=0, r=0, t=0, b=0)
-            )
-            st.plotly_chart(fig, use_container_width=True, config={"displaylogo": False, "responsive": True})
+            if map_mode == "Grid":
+                st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Cell colour</p>", unsafe_allow_html=True)
+                grid_field = st.selectbox(
+                    label="Cell colour",
+                    options=[c for c in [TEMP_COL, SAL_COL, ODO_COL] if c],
+                    index=0,
+                    label_visibility="collapsed"
+                )
+                st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Cell shape</p>", unsafe_allow_html=True)
+                grid_shape = st.selectbox(
+                    label="Cell shape",
+                    options=["square", "hex"],
+                    index=0,
+                    label_visibility="collapsed"
+                )
+                st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Cell size (m)</p>", unsafe_allow_html=True)
+                cell_m = st.select_slider(
+                    label="Cell size (m)",
+                    options=[5, 10, 25, 50, 100, 250],
+                    value=10,
+                    label_visibility="collapsed"
+                )
+
+                try:
+                    fig, cells, points = grid_chart(BASE_URL, survey, cell_m, grid_shape, grid_field, zoom)
+                    st.caption(f"{cells} cells from {points} observations")
+                    st.plotly_chart(fig, use_container_width=True, config={"displaylogo": False, "responsive": True})
+                except requests.exceptions.RequestException as e:
+                    st.error(f"Could not reach grid API at {BASE_URL}/api/grid\n{e}")
+            else:
+                st.markdown("<p style='color:black; font-weight:600; margin-bottom:0;'>Hover data (optional)</p>", unsafe_allow_html=True)
+                hover_cols = st.multiselect(
+                    label="Hover data (optional)",
+                    options=["(none)"] + [c for c in all_cols if c not in {lat_col, lon_col}],
+                    default=[],
+                    label_visibility="collapsed"
+                )
+
+                hover_cols = [c for c in hover_cols if c != "(none)"]
+                fig, shown = map_chart(selected_path, TIMESTAMP_COL, lat_col, lon_col, zoom, hover_cols, color, size, show_all)
+                if shown < len(df):
+                    st.caption(f"Showing {shown} of {len(df)} points, one per map cell at this zoom")
+                st.plotly_chart(fig, use_container_width=True, config={"displaylogo": False, "responsive": True})
             
 with tab4:
     try:
@@ -553,6 +551,7 @@ with tab5:
                     "field": metric,
                     "method": method.lower(),
                     "k": k,
+                    "layout": "columnar",
                 }
                 url = f"{BASE_URL}/api/outliers?"
                 for key, value in params.items():
@@ -565,8 +564,7 @@ with tab5:
                 outliers = r.json()
                 count = outliers["count"]
                 if (count != 0):
-                    documents = outliers["items"]
-                    df = pd.DataFrame(documents)
+                    df = pd.DataFrame(outliers["columns"], columns=outliers["fields"])
                     st.markdown(
                     f'<p style="color: black;">{count} outliers found.</p>',
                     unsafe_allow_html=True)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the api, client and bench modules import each other by their flat names, as when run from their folders
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "client"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
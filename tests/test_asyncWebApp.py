@@ -0,0 +1,136 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta
+import pytest
+import mongoConnection
+import mongoDB
+import responseCache
+
+mongomock = pytest.importorskip("mongomock")
+asyncWebApp = pytest.importorskip("asyncWebApp")
+
+
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    async def __aiter__(self):
+        for doc in self.documents:
+            yield doc
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class AsyncCollection:
+    """The awaitable surface of pymongo's AsyncCollection that asyncMongoDB uses, over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return AsyncCursor(self.collection.aggregate(pipeline, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+    async def estimated_document_count(self):
+        return self.collection.estimated_document_count()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    mock = mongomock.MongoClient()
+    monkeypatch.setattr(mongoConnection, "client", mock)
+    monkeypatch.setattr(mongoConnection, "get_async_db",
+                        lambda: type("AsyncDatabase", (), {"__getitem__": lambda self, name:
+                                                           AsyncCollection(mock[mongoConnection.DATABASE][name])})())
+    # mongomock's bulk ReplaceOne lacks the sort argument pymongo 4.15 passes; the
+    # time-series write path uploads with insert_many instead
+    monkeypatch.setattr(mongoDB, "STORAGE", "timeseries")
+    monkeypatch.setattr(mongoDB, "generation", {"at": None, "value": 0})
+    monkeypatch.setattr(responseCache, "local_cache", responseCache.LRUCache())
+    start = datetime(2022, 10, 7, 10, 0, 0)
+    mongoDB.get_collection().insert_many([{"n": n, "pH": 7 + n / 100, mongoDB.SORT_KEY: start + timedelta(seconds=n)}
+                                          for n in range(30)])
+    return asyncWebApp.app.test_client()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def ndjson(rows):
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def test_observations(client):
+    async def scenario():
+        response = await client.get("/api/observations?limit=5")
+        body = await response.get_json()
+        assert response.status_code == 200
+        assert body["count"] == 30 and [doc["n"] for doc in body["items"]] == [0, 1, 2, 3, 4]
+        assert "_id" not in body["items"][0] and body["next"]
+
+        following = await (await client.get(f"/api/observations?limit=5&cursor={body['next']}")).get_json()
+        assert [doc["n"] for doc in following["items"]] == [5, 6, 7, 8, 9]
+        assert (await client.get("/api/observations?limit=0")).status_code == 400
+    run(scenario())
+
+
+def test_observations_are_cached_until_an_upload(client):
+    async def scenario():
+        first = await client.get("/api/observations?limit=5")
+        etag = first.headers["ETag"]
+        assert first.headers["X-Cache"] == "MISS"
+        second = await client.get("/api/observations?limit=5")
+        assert second.headers["X-Cache"] == "HIT" and await second.get_data() == await first.get_data()
+        assert (await client.get("/api/observations?limit=5", headers={"If-None-Match": etag})).status_code == 304
+
+        rows = [{"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": f"09:00:{s:02d}", "Time": float(s), "pH": 8.0}
+                for s in range(3)]
+        upload = await client.post("/api/upload", data=ndjson(rows), headers={"Content-Type": "application/x-ndjson"})
+        assert upload.status_code == 200
+        assert (await upload.get_json())["inserted"] == 3
+
+        # the upload bumped the generation: a new tag, and the response shows the new rows
+        after = await client.get("/api/observations?limit=5", headers={"If-None-Match": etag})
+        assert after.status_code == 200 and after.headers["X-Cache"] == "MISS" and after.headers["ETag"] != etag
+        assert (await after.get_json())["count"] == 33
+    run(scenario())
+
+
+def test_upload_rejects_malformed_bodies(client):
+    async def scenario():
+        response = await client.post("/api/upload", data='[1, "x"]', headers={"Content-Type": "application/json"})
+        assert response.status_code == 400
+        response = await client.post("/api/upload", data="a,b\n", headers={"Content-Type": "text/plain"})
+        assert response.status_code == 400
+    run(scenario())
+
+
+def test_large_responses_are_compressed(client):
+    async def scenario():
+        plain = await client.get("/api/observations?limit=30")
+        response = await client.get("/api/observations?limit=30", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert response.headers["ETag"].startswith("W/")
+        assert gzip.decompress(await response.get_data()) == await plain.get_data()
+    run(scenario())
+
+
+def test_exports_are_streamed_and_not_cached(client):
+    async def scenario():
+        for _ in range(2):
+            response = await client.get("/api/observations", headers={"Accept": "application/x-ndjson",
+                                                                      "Accept-Encoding": "gzip"})
+            assert response.status_code == 200 and response.headers["X-Cache"] == "MISS"
+            assert "Content-Encoding" not in response.headers
+            lines = (await response.get_data()).decode().splitlines()
+            assert [json.loads(line)["n"] for line in lines] == list(range(30))
+    run(scenario())
@@ -0,0 +1,62 @@
+import json
+import pandas as pd
+import pytest
+import benchmark
+import ingest
+import synthData
+
+
+@pytest.fixture(scope="module")
+def profile():
+    return synthData.template_profile()
+
+
+def test_synthetic_surveys_have_the_template_schema(profile, tmp_path):
+    path = tmp_path / "synthetic.csv"
+    assert synthData.write_csv(synthData.generate(profile, 250, survey_rows=100, outlier_rate=0.05), path) == 250
+    synthetic, template = pd.read_csv(path), pd.read_csv(synthData.TEMPLATE)
+    assert list(synthetic.columns) == list(template.columns) and len(synthetic) == 250
+    for name in template.columns:
+        if pd.api.types.is_numeric_dtype(template[name]):
+            assert pd.api.types.is_numeric_dtype(synthetic[name]), name
+
+
+def test_synthetic_rows_have_unique_keys_and_timestamps(profile):
+    frames = list(synthData.generate(profile, 250, survey_rows=100))
+    assert [len(frame) for frame in frames] == [100, 100, 50]
+    documents = [doc for frame in frames for doc in frame.to_dict("records")]
+    assert len({ingest.natural_key(doc) for doc in documents}) == 250
+    stamps = [ingest.timestamp(doc) for doc in documents]
+    assert None not in stamps and len(set(stamps)) == 250
+    # one survey day per week
+    assert len({stamp.date() for stamp in stamps}) == 3
+
+
+def test_generation_is_reproducible(profile):
+    first, second = (pd.concat(synthData.generate(profile, 50, seed=7)) for _ in range(2))
+    pd.testing.assert_frame_equal(first, second)
+    assert not first.equals(pd.concat(synthData.generate(profile, 50, seed=8)))
+
+
+def test_summarize_and_server_timing():
+    result = benchmark.summarize([0.001, 0.002, 0.003, 0.004], 2.0, [10, 30, 10, 30], [200, 200, 304, 500],
+                                 [1.5, None, 2.5, 3.5])
+    assert (result["requests"], result["errors"], result["status"]) == (4, 1, {"200": 2, "304": 1, "500": 1})
+    assert (result["min_ms"], result["max_ms"], result["mean_ms"], result["p50_ms"]) == (1.0, 4.0, 2.5, 2.5)
+    assert (result["throughput_rps"], result["bytes_mean"], result["server_p50_ms"]) == (2.0, 20, 2.5)
+    assert benchmark.summarize([], 0, [], [], [])["requests"] == 0
+
+    assert benchmark.server_ms({"Server-Timing": "compute;dur=12.5, query;dur=10.0"}) == 12.5
+    assert benchmark.server_ms({}) is None
+
+
+def test_compare_prints_the_common_scenarios(tmp_path, capsys):
+    before, after = tmp_path / "before.json", tmp_path / "after.json"
+    before.write_text(json.dumps({"results": {"page": {"p50_ms": 10.0, "p99_ms": 20.0}, "clean": {"seconds": 2.0},
+                                              "gone": {"p50_ms": 1.0, "p99_ms": 1.0}}}))
+    after.write_text(json.dumps({"results": {"page": {"p50_ms": 5.0, "p99_ms": 30.0}, "clean": {"seconds": 1.0}}}))
+    benchmark.compare(before, after)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and "gone" not in "".join(lines)
+    assert lines[1].split() == ["page", "10.00", "5.00", "0.50", "20.00", "30.00"]
+    assert lines[2].split() == ["clean", "2000.00", "1000.00", "0.50"]
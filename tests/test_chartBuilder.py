@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+chartBuilder = pytest.importorskip("chartBuilder")
+
+
+def visible_degrees(zoom, pixels):
+    return pixels * 360 / (256 * 2 ** zoom)
+
+
+@pytest.mark.parametrize("span", [0.001, 0.01, 0.1, 1.0])
+def test_fit_zoom_shows_the_whole_survey(span):
+    rng = np.random.default_rng(0)
+    lat = 25.9 + rng.uniform(0, span, 500)
+    lon = -80.1 + rng.uniform(0, span * 2, 500)
+    zoom = chartBuilder.fit_zoom(lat, lon)
+    # the map is centred on the mean point
+    half_width = visible_degrees(zoom, chartBuilder.MAP_WIDTH_PX) / 2
+    assert np.abs(lon - lon.mean()).max() <= half_width
+    # one zoom level closer would cut some points off (unless at the maximum)
+    if zoom < chartBuilder.MAX_ZOOM:
+        closer = visible_degrees(zoom + 1, chartBuilder.MAP_WIDTH_PX) / 2
+        y = np.degrees(np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)))
+        closer_y = visible_degrees(zoom + 1, chartBuilder.MAP_HEIGHT_PX) / 2
+        assert np.abs(lon - lon.mean()).max() > closer or np.abs(y - y.mean()).max() > closer_y
+
+
+def test_fit_zoom_gets_wider_with_the_survey():
+    zooms = [chartBuilder.fit_zoom([25.9, 25.9 + span], [-80.1, -80.1 + span]) for span in [0.001, 0.01, 0.1, 1.0]]
+    assert zooms == sorted(zooms, reverse=True) and zooms[0] > zooms[-1]
+
+
+def test_fit_zoom_without_coordinates():
+    assert chartBuilder.fit_zoom([], []) == chartBuilder.MAX_ZOOM
+    assert chartBuilder.fit_zoom([None, "x"], [None, 1.0]) == chartBuilder.MAX_ZOOM
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import columnarStore
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "survey.csv"
+    path.write_text("Time hh:mm:ss,pH,Temperature (c),Notes,Depth\n"
+                    "10:00:00,7.1,20.5,calm,\n"
+                    "10:00:01,7.3,,windy,\n"
+                    "10:00:02,,21.0,,\n")
+    return str(path)
+
+
+def test_round_trip_matches_the_csv(csv_path):
+    store = columnarStore.convert(csv_path)
+    assert store == csv_path[:-len(".csv")] + columnarStore.SUFFIX
+    pd.testing.assert_frame_equal(columnarStore.read_frame(store), pd.read_csv(csv_path))
+    meta = columnarStore.read_meta(store)
+    by_name = {c["name"]: c for c in meta["columns"]}
+    assert meta["rows"] == 3
+    assert (by_name["pH"]["min"], by_name["pH"]["max"]) == (7.1, 7.3)
+    # an all-empty column has no range, text columns never do
+    assert "min" not in by_name["Depth"] and by_name["Notes"]["kind"] == "str"
+
+
+def test_columns_are_memory_mapped_and_selected(csv_path):
+    store = columnarStore.convert(csv_path)
+    arrays = columnarStore.read_arrays(store, ["pH"])
+    assert list(arrays) == ["pH"] and isinstance(arrays["pH"], np.memmap)
+    assert list(columnarStore.read_frame(store, ["Notes", "pH"]).columns) == ["Notes", "pH"]
+    with pytest.raises(KeyError):
+        columnarStore.read_frame(store, ["pH", "Salinity"])
+
+
+def test_store_is_rebuilt_when_the_csv_changes(csv_path):
+    assert not columnarStore.is_fresh(csv_path)
+    columnarStore.ensure_store(csv_path)
+    assert columnarStore.is_fresh(csv_path)
+    with open(csv_path, "a") as f:
+        f.write("10:00:03,7.9,22.0,storm,1.5\n")
+    os.utime(csv_path, (0, os.path.getmtime(csv_path) + 10))
+    assert not columnarStore.is_fresh(csv_path)
+    assert columnarStore.ensure_store(csv_path)["rows"] == 4
+    assert columnarStore.load_frame(csv_path, ["pH"])["pH"].tolist()[-1] == 7.9
+    # only the store is left, no temporary copies
+    assert sorted(os.listdir(os.path.dirname(csv_path))) == ["survey.cols", "survey.csv"]
+
+
+def test_csv_is_read_when_the_store_cannot_be_written(csv_path, monkeypatch):
+    def read_only(path):
+        raise PermissionError("read-only file system")
+    monkeypatch.setattr(columnarStore, "convert", read_only)
+    assert columnarStore.ensure_store(csv_path) is None
+    frame = columnarStore.load_frame(csv_path, ["pH", "Notes"])
+    pd.testing.assert_frame_equal(frame, pd.read_csv(csv_path)[["pH", "Notes"]])
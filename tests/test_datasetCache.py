@@ -0,0 +1,46 @@
+import os
+import pytest
+
+pytest.importorskip("streamlit")
+import datasetCache
+
+TIME = "Time hh:mm:ss"
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "survey.csv"
+    path.write_text(f"{TIME},pH,Temperature (c),Notes\n"
+                    "10:00:05,7.1,20.5,calm\n"
+                    "10:00:01,7.3,,windy\n"
+                    "10:00:09,,21.0,\n")
+    return str(path)
+
+
+def test_ranges_from_the_store_match_a_scan(csv_path):
+    ranges = datasetCache.column_ranges(csv_path, TIME)
+    scanned = datasetCache._scan_ranges(datasetCache.load_survey(csv_path, TIME), TIME)
+    assert ranges == scanned
+    assert ranges["pH"] == (7.1, 7.3) and "Notes" not in ranges
+    assert [t.isoformat() for t in ranges[TIME]] == ["10:00:01", "10:00:09"]
+
+
+def test_survey_is_loaded_once_per_version(csv_path):
+    first = datasetCache.load_survey(csv_path, TIME, ["pH"])
+    assert datasetCache.load_survey(csv_path, TIME, ["pH"]) is first
+    assert list(first.columns) == ["pH"]
+
+    with open(csv_path, "a") as f:
+        f.write("10:00:10,8.2,22.0,storm\n")
+    os.utime(csv_path, (0, os.path.getmtime(csv_path) + 10))
+    reloaded = datasetCache.load_survey(csv_path, TIME, ["pH"])
+    assert reloaded is not first and reloaded["pH"].tolist()[-1] == 8.2
+    assert datasetCache.column_ranges(csv_path, TIME)["pH"] == (7.1, 8.2)
+
+
+def test_global_min_max_skips_files_without_the_column(csv_path, tmp_path):
+    other = tmp_path / "other.csv"
+    other.write_text("pH,Depth\n6.5,1\n7.0,2\n")
+    assert datasetCache.global_min_max([csv_path, str(other)], "pH", TIME) == (6.5, 7.3)
+    assert datasetCache.global_min_max([csv_path, str(other)], "Depth", TIME) == (1.0, 2.0)
+    assert datasetCache.global_min_max([csv_path], "Salinity", TIME) == (None, None)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import downsample
+
+
+def reference_lttb(x, y, threshold):
+    # Steinarsson's Largest-Triangle-Three-Buckets, point by point; bucket
+    # edges are floor(i * (n - 2) / (threshold - 2)) + 1 in exact integers
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    edge = lambda i: i * (n - 2) // (threshold - 2) + 1
+    picked = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = edge(i + 1)
+        avg_end = min(edge(i + 2), n)
+        avg_x = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+        best, best_area = None, -1.0
+        for j in range(edge(i), edge(i + 1)):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])) * 0.5
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+def series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(0.5, 1.5, n))
+    y = np.cumsum(rng.normal(0, 1, n)) + 5 * np.sin(x / 50)
+    return x, y
+
+
+@pytest.mark.parametrize("n,points", [(10, 3), (11, 5), (100, 12), (1000, 7), (1000, 333), (5000, 1000), (4321, 100)])
+def test_lttb_matches_reference(n, points):
+    x, y = series(n, seed=n + points)
+    assert downsample.lttb_indices(x, y, points).tolist() == reference_lttb(x.tolist(), y.tolist(), points)
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_picked_rows_are_actual_rows_in_order(method):
+    x, y = series(2000, seed=1)
+    dx, dy, picked = downsample.downsample(x, y, 50, method)
+    assert (np.diff(picked) > 0).all()
+    assert dx.tolist() == x[picked].tolist() and dy.tolist() == y[picked].tolist()
+
+
+def test_lttb_matches_reference_for_every_small_size():
+    # bucket edges land on exact integers for some sizes, where rounding could differ
+    for n in range(3, 60):
+        x, y = series(n, seed=n)
+        for points in range(3, n + 1):
+            assert downsample.lttb_indices(x, y, points).tolist() == reference_lttb(x.tolist(), y.tolist(), points)
+
+
+def test_lttb_keeps_first_and_last_row():
+    x, y = series(2000, seed=2)
+    picked = downsample.lttb_indices(x, y, 50)
+    assert picked[0] == 0 and picked[-1] == 1999
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[517] = 100.0
+    assert 517 in downsample.lttb_indices(x, y, 20)
+
+
+@pytest.mark.parametrize("method", downsample.METHODS)
+@pytest.mark.parametrize("points", [100, 101, 500])
+def test_points_at_least_n_returns_everything(method, points):
+    x, y = series(100, seed=3)
+    dx, dy, picked = downsample.downsample(x, y, points, method)
+    assert dx.tolist() == x.tolist() and dy.tolist() == y.tolist()
+    if picked is not None:
+        assert picked.tolist() == list(range(100))
+
+
+def test_minmax_keeps_each_bucket_extremes():
+    x, y = series(1000, seed=4)
+    picked = set(downsample.minmax_indices(x, y, 20).tolist())
+    buckets = downsample.bucket_ids(1000, 10)
+    for b in range(10):
+        rows = np.flatnonzero(buckets == b)
+        assert rows[np.argmin(y[rows])] in picked and rows[np.argmax(y[rows])] in picked
+
+
+def test_mean_buckets():
+    x = np.arange(10, dtype=float)
+    mx, my = downsample.mean_buckets(x, x * 2, 5)
+    assert mx.tolist() == [0.5, 2.5, 4.5, 6.5, 8.5] and my.tolist() == [1, 5, 9, 13, 17]
@@ -0,0 +1,57 @@
+import math
+import pytest
+import ingest
+import mongoConnection
+import mongoDB
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_bbox_is_a_polygon_in_geojson_order():
+    geometry = mongoDB.bbox_filter("-80.5,25.5,-80.1,25.9")[ingest.LOCATION_FIELD]["$geoWithin"]["$geometry"]
+    ring = geometry["coordinates"][0]
+    assert geometry["type"] == "Polygon" and ring[0] == ring[-1] == [-80.5, 25.5]
+    assert ring[2] == [-80.1, 25.9]
+
+
+def test_near_is_a_sphere_in_radians():
+    lon_lat, radians = mongoDB.near_filter("25.7,-80.2", "6378.1")[ingest.LOCATION_FIELD]["$geoWithin"]["$centerSphere"]
+    assert lon_lat == [-80.2, 25.7] and radians == pytest.approx(0.001)
+
+
+@pytest.mark.parametrize("value", ["", "1,2,3", "a,b,c,d", "nan,0,1,1", "-80.1,25.5,-80.5,25.9",
+                                   "-80.5,25.9,-80.1,25.5", "-181,0,0,1", "0,-91,1,0"])
+def test_malformed_bbox_is_rejected(value):
+    with pytest.raises(ValueError):
+        mongoDB.bbox_filter(value)
+
+
+@pytest.mark.parametrize("near, radius", [("25.7,-80.2", None), (None, "100"), ("25.7", "100"), ("91,0", "100"),
+                                          ("0,181", "100"), ("25.7,-80.2", "0"), ("25.7,-80.2", "-5"),
+                                          ("25.7,-80.2", "inf")])
+def test_malformed_near_is_rejected(near, radius):
+    with pytest.raises(ValueError):
+        mongoDB.near_filter(near, radius)
+
+
+def test_geo_filters_join_the_other_filters():
+    query = mongoDB.build_filter({"bbox": "-81,25,-80,26", "near": "25.7,-80.2", "radius_m": "500", "survey": "2022-10-07"})
+    assert query["$and"][0] == {ingest.META_FIELD + ".survey": "2022-10-07"}
+    assert [list(part[ingest.LOCATION_FIELD]["$geoWithin"]) for part in query["$and"][1:]] == [["$geometry"], ["$centerSphere"]]
+    assert mongoDB.geo_filters({}) == []
+
+
+@pytest.mark.parametrize("query", ["bbox=1,2,3", "near=25.7,-80.2", "radius_m=100", "near=25.7,-80.2&radius_m=0"])
+def test_malformed_geo_arguments_are_a_400(monkeypatch, query):
+    import flaskWebApp
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    client = flaskWebApp.app.test_client()
+    assert client.get(f"/api/observations?{query}").status_code == 400
+    assert client.get(f"/api/observations/downsample?field=pH&{query}").status_code == 400
+
+
+def test_location_needs_a_valid_fix():
+    assert ingest.location({"Latitude": "25.7", "Longitude": -80.2}) == {"type": "Point", "coordinates": [-80.2, 25.7]}
+    for doc in [{}, {"Latitude": 25.7}, {"Latitude": None, "Longitude": -80.2}, {"Latitude": "", "Longitude": -80.2},
+                {"Latitude": 95, "Longitude": -80.2}, {"Latitude": 25.7, "Longitude": 200}, {"Latitude": math.nan, "Longitude": 0}]:
+        assert ingest.location(doc) is None
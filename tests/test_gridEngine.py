@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import apiCommon
+import gridEngine
+
+
+def survey(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = 25.7 + rng.uniform(0, 0.002, n)
+    lon = -80.15 + rng.uniform(0, 0.002, n)
+    ph = rng.normal(8, 0.2, n)
+    ph[::9] = np.nan
+    lat[5] = np.nan
+    return lat, lon, {"pH": ph}
+
+
+def expected_cells(lat, lon, ph, shape, size):
+    # the same cells computed point by point, stats with a pandas groupby
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    x, y = gridEngine.to_meters(lat[valid], lon[valid], gridEngine.reference_latitude(lat[valid]))
+    cell_of = gridEngine.hex_cells if shape == "hex" else gridEngine.square_cells
+    cells = cell_of(x, y, size)
+    frame = pd.DataFrame({"a": cells[:, 0], "b": cells[:, 1], "pH": ph[valid]})
+    groups = frame.groupby(["a", "b"])["pH"]
+    return groups.size(), groups.agg(["count", "mean", "min", "max"])
+
+
+@pytest.mark.parametrize("shape", gridEngine.SHAPES)
+@pytest.mark.parametrize("size", [10.0, 25.0, 60.0])
+def test_bin_points_counts_and_stats(shape, size):
+    lat, lon, columns = survey()
+    grid = gridEngine.bin_points(lat, lon, columns, shape, size)
+    sizes, stats = expected_cells(lat, lon, columns["pH"], shape, size)
+
+    assert grid["points"] == len(lat) - 1
+    assert grid["count"].sum() == grid["points"]
+    # cells come out in the sorted order of their ids, as in the groupby
+    assert grid["count"].tolist() == sizes.tolist()
+    got = grid["stats"]["pH"]
+    assert got["count"].tolist() == stats["count"].tolist()
+    for name in ["mean", "min", "max"]:
+        np.testing.assert_allclose(got[name], stats[name].to_numpy(), equal_nan=True)
+
+
+@pytest.mark.parametrize("shape", gridEngine.SHAPES)
+def test_cell_centers_are_inside_their_cells(shape):
+    lat, lon, columns = survey()
+    size = 25.0
+    grid = gridEngine.bin_points(lat, lon, columns, shape, size)
+    x, y = gridEngine.to_meters(grid["lat"], grid["lon"], grid["ref_lat"])
+    cell_of = gridEngine.hex_cells if shape == "hex" else gridEngine.square_cells
+    # a center falls in its own cell, and every cell is distinct
+    assert len(np.unique(cell_of(x, y, size), axis=0)) == len(grid["count"])
+
+
+def test_cell_without_values_gets_nan():
+    lat = np.array([25.7, 25.7, 25.75])
+    lon = np.array([-80.15, -80.15, -80.15])
+    grid = gridEngine.bin_points(lat, lon, {"pH": np.array([7.5, 8.5, np.nan])}, "square", 25.0)
+    assert grid["count"].tolist() == [2, 1]
+    stats = grid["stats"]["pH"]
+    assert stats["count"].tolist() == [2, 0]
+    assert stats["mean"][0] == 8.0 and (stats["min"][0], stats["max"][0]) == (7.5, 8.5)
+    assert np.isnan([stats["mean"][1], stats["min"][1], stats["max"][1]]).all()
+
+
+@pytest.mark.parametrize("shape", gridEngine.SHAPES)
+@pytest.mark.parametrize("lat, lon", [([], []), ([np.nan, 25.7], [-80.15, np.nan])])
+def test_no_points(shape, lat, lon):
+    lat, lon = np.array(lat, dtype="float64"), np.array(lon, dtype="float64")
+    grid = gridEngine.bin_points(lat, lon, {"pH": np.full(len(lat), 7.0)}, shape, 25.0)
+    assert grid["points"] == 0 and len(grid["count"]) == 0
+    assert len(grid["lat"]) == len(grid["lon"]) == 0
+    assert all(len(values) == 0 for values in grid["stats"]["pH"].values())
+    body = apiCommon.grid_body([], shape, 25.0)
+    assert body["cells"] == 0 and body["points"] == 0
+
+
+@pytest.mark.parametrize("cell_m", ["nan", "inf", "-inf", "NaN"])
+def test_grid_params_rejects_non_finite_cell_size(cell_m):
+    with pytest.raises(ValueError, match="cell_m"):
+        apiCommon.grid_params({"cell_m": cell_m})
+
+
+def test_grid_params_clamps_cell_size():
+    assert apiCommon.grid_params({"cell_m": "0.1"})[2] == 1.0
+    assert apiCommon.grid_params({"cell_m": "1e9"})[2] == 100000.0
+    assert apiCommon.grid_params({})[2] == 25.0
@@ -0,0 +1,71 @@
+from pymongo import ASCENDING, DESCENDING
+import pytest
+import indexManager
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.observations
+
+
+# mongomock has no 2dsphere indexes
+PLAIN_INDEXES = [index for index in indexManager.INDEXES if index["name"] != "wq_location_timestamp"]
+
+
+def test_indexes_are_created_then_kept(collection):
+    report = indexManager.ensure_indexes(collection, PLAIN_INDEXES)
+    assert report["created"] == [index["name"] for index in PLAIN_INDEXES]
+    info = collection.index_information()
+    assert info["wq_key"]["unique"] and info["wq_key"]["partialFilterExpression"] == {"_key": {"$exists": True}}
+
+    again = indexManager.ensure_indexes(collection, PLAIN_INDEXES)
+    assert again["kept"] == report["created"] and not (again["created"] or again["rebuilt"] or again["dropped"])
+
+
+def test_changed_stale_and_hand_made_indexes(collection):
+    indexManager.ensure_indexes(collection, PLAIN_INDEXES)
+    collection.create_index([("notes", ASCENDING)], name="by_hand")
+    changed = [{**index, "keys": [("pH", DESCENDING)]} if index["name"] == "wq_ph" else index
+               for index in PLAIN_INDEXES if index["name"] != "wq_odo"]
+    report = indexManager.ensure_indexes(collection, changed)
+    assert report["rebuilt"] == ["wq_ph"] and report["dropped"] == ["wq_odo"]
+    info = collection.index_information()
+    assert info["wq_ph"]["key"] == [("pH", DESCENDING)]
+    # only managed (wq_) indexes are ever dropped
+    assert "by_hand" in info and "wq_odo" not in info
+
+
+def test_timeseries_indexes_have_no_unique_key():
+    names = [index["name"] for index in indexManager.TIMESERIES_INDEXES]
+    assert sorted(names) == sorted(index["name"] for index in indexManager.INDEXES)
+    assert not any(index.get("unique") for index in indexManager.TIMESERIES_INDEXES)
+
+
+CLASSIC_EXPLAIN = {
+    "queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {
+        "stage": "IXSCAN", "indexName": "wq_timestamp_id"}}}},
+    "executionStats": {"totalKeysExamined": 10, "totalDocsExamined": 10, "nReturned": 10, "executionTimeMillis": 1},
+}
+
+
+def test_explain_summary_of_a_find_plan():
+    summary = indexManager.summarize_explain(CLASSIC_EXPLAIN)
+    assert summary["stages"] == ["LIMIT", "FETCH", "IXSCAN"]
+    assert summary["indexes"] == ["wq_timestamp_id"] and not summary["collscan"]
+    assert (summary["keysExamined"], summary["docsExamined"], summary["nReturned"]) == (10, 10, 10)
+
+
+def test_explain_summary_of_an_aggregation_and_a_slot_based_plan():
+    # aggregations report the query layer under their first stage, slot-based plans nest it under queryPlan
+    explain = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"queryPlan": {
+        "stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}, "executionStats": {"totalDocsExamined": 25}}},
+        {"$group": {}}]}
+    summary = indexManager.summarize_explain(explain)
+    assert summary["stages"] == ["SORT", "COLLSCAN"] and summary["collscan"]
+    assert summary["indexes"] == [] and summary["docsExamined"] == 25
+    # an OR plan lists the indexes of every branch
+    plan = {"stage": "OR", "inputStages": [{"stage": "IXSCAN", "indexName": "wq_ph"},
+                                           {"stage": "IXSCAN", "indexName": "wq_odo"}]}
+    assert indexManager.summarize_explain({"queryPlanner": {"winningPlan": plan}})["indexes"] == ["wq_odo", "wq_ph"]
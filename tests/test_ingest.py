@@ -0,0 +1,77 @@
+import io
+import json
+import pytest
+import ingest
+
+HEADER = "Date m/d/y   ,Time hh:mm:ss,Time,pH\n"
+
+
+def read_csv(body):
+    return list(ingest.read_documents(io.BytesIO(body.encode()), "text/csv"))
+
+
+def test_csv_values_are_typed():
+    documents = read_csv(HEADER + "10/07/22,10:00:00,1.5,7\n10/07/22,10:00:01,,x\n")
+    assert documents[0] == {"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": "10:00:00", "Time": 1.5, "pH": 7}
+    assert documents[1]["Time"] is None and documents[1]["pH"] == "x"
+
+
+def test_csv_row_longer_than_header_is_rejected():
+    with pytest.raises(ValueError, match="line 3"):
+        read_csv(HEADER + "10/07/22,10:00:00,1.5,7\n10/07/22,10:00:01,2.5,7.1,99\n")
+
+
+def test_csv_row_shorter_than_header_gets_nulls():
+    assert read_csv(HEADER + "10/07/22,10:00:00\n")[0]["pH"] is None
+
+
+def test_run_batches_keeps_batch_order():
+    results = ingest.run_batches(range(10), lambda index, batch: {"batch": index, "rows": list(batch)}, size=3)
+    assert [r["rows"] for r in results] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def read_json(body, content_type="application/json", chunk_size=None):
+    if chunk_size:
+        text = io.TextIOWrapper(io.BytesIO(body.encode()), encoding="utf-8", newline="")
+        return list(ingest.json_documents(text, chunk_size))
+    return list(ingest.read_documents(io.BytesIO(body.encode()), content_type))
+
+
+DOCUMENTS = [{"pH": 7.5, "notes": "a, b ] {c}"}, {"nested": {"x": [1, 2]}, "Time": 1.5}, {}]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 3, 17])
+def test_json_array_is_read_incrementally(chunk_size):
+    body = " [\n" + ",\n ".join(json.dumps(doc) for doc in DOCUMENTS) + "\n] \n"
+    assert read_json(body, chunk_size=chunk_size) == DOCUMENTS
+    assert read_json(json.dumps(DOCUMENTS[0]), chunk_size=chunk_size) == DOCUMENTS[:1]
+    assert read_json(" [ ] ", chunk_size=chunk_size) == []
+
+
+def test_json_array_stops_reading_between_documents():
+    text = io.TextIOWrapper(io.BytesIO(json.dumps(DOCUMENTS * 1000).encode()), encoding="utf-8", newline="")
+    documents = ingest.json_documents(text, chunk_size=64)
+    assert next(documents) == DOCUMENTS[0]
+    assert text.buffer.tell() < 10000
+
+
+@pytest.mark.parametrize("body", ['[1, "x"]', '[{"a": 1}, 2]', '"x"', "5", '[{"a": 1} {"b": 2}]', '[{"a": 1}',
+                                  '[{"a": 1},]', '{"a": 1} x', '[{"a": '])
+def test_malformed_json_is_rejected(body):
+    with pytest.raises(ValueError):
+        read_json(body)
+
+
+@pytest.mark.parametrize("body", ['1\n', '{"a": 1}\n["x"]\n', '{"a": \n'])
+def test_ndjson_lines_must_be_objects(body):
+    with pytest.raises(ValueError):
+        read_json(body, "application/x-ndjson")
+
+
+def test_content_hash_ignores_number_types_and_stored_fields():
+    doc = {"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": "10:00:00", "Time": 0, "pH": 7}
+    same = {"pH": 7.0, "Time": 0.0, "Time hh:mm:ss": "10:00:00", "Date m/d/y   ": "10/07/22",
+            "_id": "x", "_key": "k", "_hash": "h", **ingest.derived_fields(doc)}
+    assert ingest.content_hash(doc) == ingest.content_hash(same)
+    assert ingest.content_hash(doc) != ingest.content_hash({**doc, "pH": 7.1})
+    assert ingest.content_hash({"flag": True}) != ingest.content_hash({"flag": 1})
@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+import pytest
+from pymongo.errors import OperationFailure
+import metrics
+import mongoConnection
+import mongoDB
+import responseCache
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_counter_and_histogram_render():
+    counter = metrics.Counter("jobs_total", "Jobs.", ["queue"])
+    counter.inc(("b",))
+    counter.inc(("a",), 2)
+    assert list(counter.samples()) == ['jobs_total{queue="a"} 2', 'jobs_total{queue="b"} 1']
+
+    histogram = metrics.Histogram("wait_seconds", "Wait.", ["queue"], buckets=[0.1, 1])
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(("a",), value)
+    assert list(histogram.samples()) == [
+        'wait_seconds_bucket{queue="a",le="0.1"} 2', 'wait_seconds_bucket{queue="a",le="1"} 3',
+        'wait_seconds_bucket{queue="a",le="+Inf"} 4', 'wait_seconds_sum{queue="a"} 3.65',
+        'wait_seconds_count{queue="a"} 4']
+    assert metrics.sample("up", [("path", 'a"b\\')], 1) == 'up{path="a\\"b\\\\"} 1'
+
+
+def test_reply_documents():
+    assert metrics.reply_documents({"cursor": {"firstBatch": [{}, {}]}}) == 2
+    assert metrics.reply_documents({"cursor": {"nextBatch": [{}]}}) == 1
+    assert metrics.reply_documents({"n": 5, "ok": 1}) == 5
+    assert metrics.reply_documents({"ok": 1}) is None
+
+
+def test_command_monitor_records_outcome_duration_and_documents(monkeypatch):
+    monkeypatch.setattr(metrics, "COMMANDS", metrics.Counter("c", "", ["command", "outcome"]))
+    monkeypatch.setattr(metrics, "COMMAND_SECONDS", metrics.Histogram("s", "", ["command"]))
+    monkeypatch.setattr(metrics, "COMMAND_DOCUMENTS", metrics.Histogram("d", "", ["command"], metrics.DOCUMENT_BUCKETS))
+    monitor = metrics.CommandMonitor()
+    monitor.succeeded(SimpleNamespace(command_name="find", duration_micros=1500,
+                                      reply={"cursor": {"firstBatch": [{}] * 3}}))
+    monitor.succeeded(SimpleNamespace(command_name="ping", duration_micros=100, reply={"ok": 1}))
+    monitor.failed(SimpleNamespace(command_name="find", duration_micros=500))
+    assert metrics.COMMANDS.values == {("find", "succeeded"): 1, ("ping", "succeeded"): 1, ("find", "failed"): 1}
+    assert metrics.COMMAND_SECONDS.values[("find",)][-1] == pytest.approx(0.002)
+    # a ping returns no documents
+    assert list(metrics.COMMAND_DOCUMENTS.values) == [("find",)]
+    assert metrics.COMMAND_DOCUMENTS.values[("find",)][-1] == 3
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import flaskWebApp
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    monkeypatch.setattr(mongoDB, "generation", {"at": None, "value": 0})
+    monkeypatch.setattr(responseCache, "local_cache", responseCache.LRUCache())
+    mongoDB.get_collection().insert_many([{"n": n, "pH": 7 + n / 100, mongoDB.SORT_KEY: n} for n in range(20)])
+    return flaskWebApp.app.test_client()
+
+
+def requests_total(text, route, status):
+    line = f'http_requests_total{{method="GET",route="{route}",status="{status}"}} '
+    return next((int(row[len(line):]) for row in text.splitlines() if row.startswith(line)), 0)
+
+
+def test_requests_are_counted_per_route_and_timed_by_phase(app):
+    before = app.get("/api/metrics").get_data(as_text=True)
+    response = app.get("/api/observations?limit=5")
+    app.get("/api/observations?limit=6")
+    app.get("/api/observations?limit=0")
+    assert response.status_code == 200
+    timing = app.get("/api/observations/downsample?field=pH&points=5").headers["Server-Timing"]
+    assert timing.startswith("compute;dur=") and all(f"{name};dur=" in timing for name in ["query", "pandas", "serialize"])
+
+    scrape = app.get("/api/metrics")
+    assert scrape.status_code == 200 and scrape.content_type == metrics.CONTENT_TYPE
+    text = scrape.get_data(as_text=True)
+    # the rule, not the query string, names the series
+    assert requests_total(text, "/api/observations", 200) == requests_total(before, "/api/observations", 200) + 2
+    assert requests_total(text, "/api/observations", 400) == requests_total(before, "/api/observations", 400) + 1
+    assert 'http_phase_duration_seconds_count{route="/api/observations",phase="query"}' in text
+    assert 'mongodb_pool_connections{state="open"}' in text
+
+
+def test_stats_pushdown_falls_back_on_old_servers(app, monkeypatch):
+    import flaskWebApp
+    def unsupported():
+        raise OperationFailure("Unrecognized expression '$percentile'", code=168)
+    monkeypatch.setattr(flaskWebApp, "stats_pushdown", unsupported)
+    response = app.get("/api/stats?mode=pushdown")
+    assert response.status_code == 200 and response.headers["X-Pushdown-Fallback"] == "incremental"
+    assert response.get_json() == app.get("/api/stats?mode=incremental").get_json()
+
+    def failing():
+        raise OperationFailure("not authorized", code=13)
+    monkeypatch.setattr(flaskWebApp, "stats_pushdown", failing)
+    monkeypatch.setattr(responseCache, "local_cache", responseCache.LRUCache())
+    # other failures are not hidden behind the fallback
+    assert app.get("/api/stats?mode=pushdown").status_code == 500
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+import pytest
+import mongoConnection
+
+
+def test_pool_monitor_report():
+    monitor = mongoConnection.PoolMonitor()
+    for _ in range(3):
+        monitor.connection_created(None)
+    for duration in [0.001, 0.003, 0.002]:
+        monitor.connection_checked_out(SimpleNamespace(duration=duration))
+    monitor.connection_checked_in(None)
+    monitor.connection_closed(None)
+    monitor.connection_check_out_failed(None)
+    report = monitor.report()
+    assert (report["open"], report["inUse"], report["failedCheckouts"]) == (2, 2, 1)
+    assert report["checkoutMs"] == {"last": 2.0, "mean": 2.0, "p95": 2.0, "max": 3.0, "samples": 3}
+    assert "checkoutMs" not in mongoConnection.PoolMonitor().report()
+
+
+def test_client_options_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "8")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "250")
+    monkeypatch.delenv("MONGO_SOCKET_TIMEOUT_MS", raising=False)
+    options = mongoConnection.client_options()
+    assert options["maxPoolSize"] == 8 and options["waitQueueTimeoutMS"] == 250
+    # unset limits are left to the driver
+    assert "socketTimeoutMS" not in options
+
+
+def test_client_is_created_once_on_first_use(monkeypatch):
+    created = []
+    monkeypatch.setattr(mongoConnection, "client", None)
+    monkeypatch.setattr(mongoConnection, "mongo_uri", lambda: "mongodb://localhost:1")
+    monkeypatch.setattr(mongoConnection, "MongoClient", lambda *args, **kwargs: created.append(kwargs) or object())
+    assert created == []
+    first = mongoConnection.get_client()
+    assert mongoConnection.get_client() is first and len(created) == 1
+    assert mongoConnection.pool_monitor in created[0]["event_listeners"]
+
+
+class Database:
+    def __init__(self, error=None):
+        self.error = error
+        self.pings = 0
+
+    def command(self, name):
+        self.pings += 1
+        if self.error:
+            raise self.error
+        return {"ok": 1}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = Database()
+    monkeypatch.setattr(mongoConnection, "last_ping", None)
+    monkeypatch.setattr(mongoConnection, "get_db", lambda: db)
+    return db
+
+
+def test_ping_is_reused_for_the_interval(database, monkeypatch):
+    assert mongoConnection.ping()["ok"] and mongoConnection.ping()["ok"]
+    assert database.pings == 1
+    mongoConnection.last_ping["at"] -= mongoConnection.HEALTH_PING_INTERVAL + 1
+    mongoConnection.ping()
+    assert database.pings == 2
+
+
+def test_health_is_a_503_while_mongodb_is_unreachable(database):
+    import flaskWebApp
+    client = flaskWebApp.app.test_client()
+    response = client.get("/api/health")
+    assert response.status_code == 200 and response.get_json()["status"] == "OK"
+    assert "pool" in response.get_json()["details"]
+
+    database.error = RuntimeError("no server")
+    mongoConnection.last_ping = None
+    response = client.get("/api/health")
+    body = response.get_json()
+    assert response.status_code == 503
+    assert (body["status"], body["mongoDB"], body["details"]["error"]) == ("DEGRADED", "OFFLINE", "no server")
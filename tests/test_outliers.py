@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+import apiCommon
+import outlierEngine
+
+
+def args(**values):
+    return MultiDict({"field": "pH", "method": "z-score", "k": "3", **values})
+
+
+@pytest.mark.parametrize("k", ["nan", "inf", "-inf", "0", "-2", "x"])
+def test_k_must_be_a_positive_number(k):
+    with pytest.raises(ValueError):
+        apiCommon.outlier_params(args(k=k), {"pH"})
+
+
+def test_outlier_params():
+    assert apiCommon.outlier_params(args(k="2.5"), {"pH"}) == ("z-score", 2.5, ["pH"], apiCommon.OUTLIERS_MODE,
+                                                                   "records")
+    with pytest.raises(ValueError, match="Not numeric"):
+        apiCommon.outlier_params(args(field="Latitude,notes"), {"pH", "Latitude"})
+
+
+@pytest.mark.parametrize("method", outlierEngine.METHODS)
+def test_outliers_are_flagged(method):
+    values = np.random.default_rng(2).normal(8, 0.1, 200)
+    values[[10, 150]] = [12.0, 3.0]
+    df = pd.DataFrame({"pH": values, "n": np.arange(200)})
+    mask = outlierEngine.outlier_mask(df, method, 3, ["pH"])
+    assert np.flatnonzero(mask).tolist() == [10, 150]
@@ -0,0 +1,163 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from bson import ObjectId
+import pytest
+import apiCommon
+import mongoConnection
+import mongoDB
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    collection = mongoDB.get_collection()
+    start = datetime(2022, 10, 7, 10, 0, 0)
+    # pairs of rows share a timestamp, so the _id tiebreak is exercised too
+    collection.insert_many([{"n": n, "pH": 7 + n / 100, mongoDB.SORT_KEY: start + timedelta(seconds=n // 2)}
+                            for n in range(25)])
+    return collection
+
+
+def test_cursor_round_trip():
+    last_id = ObjectId()
+    for value in [datetime(2022, 10, 7, 10, 30, 15), datetime(2021, 1, 1, 0, 0, 0, 123000), "10:30:15", 42.5, None]:
+        token = mongoDB.encode_cursor({mongoDB.SORT_KEY: value, "_id": last_id})
+        assert mongoDB.decode_cursor(token) == (value, last_id)
+
+
+def test_datetime_cursor_is_tagged():
+    token = mongoDB.encode_cursor({mongoDB.SORT_KEY: datetime(2022, 10, 7, 10, 30, 15), "_id": ObjectId()})
+    value, _ = json.loads(base64.urlsafe_b64decode(token))
+    assert value == {"$date": "2022-10-07T10:30:15"}
+
+
+@pytest.mark.parametrize("token", ["", "garbage", "!!!", base64.urlsafe_b64encode(b"[1]").decode(),
+                                   base64.urlsafe_b64encode(b'[1, "not-an-id"]').decode(),
+                                   base64.urlsafe_b64encode(b'[{"$date": "yesterday"}, "0" ]').decode()])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(ValueError):
+        mongoDB.decode_cursor(token)
+    with pytest.raises(ValueError):
+        apiCommon.observation_params({"cursor": token})
+
+
+@pytest.mark.parametrize("limit", [1, 7, 25, 30])
+def test_cursor_pages_are_continuous(collection, limit):
+    seen = []
+    token = None
+    while True:
+        params = {"limit": limit, "skip": 0, "count": "exact"}
+        if token:
+            params["cursor"] = token
+        page = mongoDB.query(params)
+        # the exact count comes with the first page only
+        assert page["count"] == (None if token else 25)
+        seen += [item["n"] for item in page["items"]]
+        token = page["next"]
+        if token is None:
+            break
+        assert len(page["items"]) == limit
+    assert seen == list(range(25))
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7])
+def test_cursor_pages_cross_rows_without_timestamp(monkeypatch, limit):
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    collection = mongoDB.get_collection()
+    start = datetime(2022, 10, 7, 10, 0, 0)
+    # legacy rows never backfilled and a row whose date didn't parse sort first
+    collection.insert_many([{"n": 0}, {"n": 1}, {"n": 2, mongoDB.SORT_KEY: None}] +
+                           [{"n": n, mongoDB.SORT_KEY: start + timedelta(seconds=n)} for n in range(3, 8)])
+    seen = []
+    token = None
+    while True:
+        params = {"limit": limit, "skip": 0, "count": "none"}
+        if token:
+            params["cursor"] = token
+        page = mongoDB.query(params)
+        seen += [doc["n"] for doc in page["items"]]
+        token = page["next"]
+        if token is None:
+            break
+    assert seen == list(range(8))
+
+
+def test_cursor_pages_match_skip_pages(collection):
+    first = mongoDB.query({"limit": 10, "skip": 0})
+    by_cursor = mongoDB.query({"limit": 10, "skip": 0, "cursor": first["next"]})
+    by_skip = mongoDB.query({"limit": 10, "skip": 10})
+    assert by_cursor["items"] == by_skip["items"]
+
+
+def test_malformed_cursor_is_a_400(collection):
+    import flaskWebApp
+    response = flaskWebApp.app.test_client().get("/api/observations?cursor=garbage")
+    assert response.status_code == 400
+    assert b"Invalid cursor" in response.data
+
+
+@pytest.mark.parametrize("args", [{"limit": "0"}, {"limit": "-5"}, {"skip": "-1"}, {"limit": "x"}])
+def test_out_of_range_paging_is_rejected(args):
+    with pytest.raises(ValueError):
+        apiCommon.observation_params(args)
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=-5", "skip=-1"])
+def test_out_of_range_paging_is_a_400(collection, query):
+    import flaskWebApp
+    response = flaskWebApp.app.test_client().get("/api/observations?" + query)
+    assert response.status_code == 400
+
+
+def test_paging_bounds_are_kept():
+    assert apiCommon.observation_params({"limit": "1", "skip": "0"})["limit"] == 1
+    assert apiCommon.observation_params({"limit": "5000"})["limit"] == 1000
+
+
+def test_fields_are_projected_before_the_page_is_gathered():
+    pipeline = mongoDB.page_pipeline({}, None, 0, 10, fields=["pH"])
+    page = pipeline[-1]["$facet"]["page"]
+    stages = [next(iter(stage)) for stage in page]
+    assert stages.index("$project") < stages.index("$group")
+    assert page[stages.index("$project")]["$project"] == {mongoDB.SORT_KEY: 1, "pH": 1}
+
+
+def test_fields_pages_return_only_the_requested_fields(collection):
+    first = mongoDB.query({"limit": 10, "skip": 0, "fields": ["pH"]})
+    assert [set(item) for item in first["items"]] == [{"pH"}] * 10
+    second = mongoDB.query({"limit": 10, "skip": 0, "fields": ["pH"], "cursor": first["next"]})
+    assert [item["pH"] for item in second["items"]] == [7 + n / 100 for n in range(10, 20)]
+    with_key = mongoDB.query({"limit": 3, "skip": 0, "fields": ["n", mongoDB.SORT_KEY]})
+    assert set(with_key["items"][0]) == {"n", mongoDB.SORT_KEY}
+
+
+@pytest.mark.parametrize("fields", ["_key", "_hash,pH", "$where", "pH,nope"])
+def test_unknown_fields_are_rejected(fields):
+    with pytest.raises(ValueError):
+        apiCommon.observation_params({"fields": fields}, known_fields={"pH", "n"})
+    assert apiCommon.observation_params({"fields": "pH,n"}, known_fields={"pH", "n"})["fields"] == ["pH", "n"]
+
+
+def test_time_range_is_local_survey_time(collection):
+    params = apiCommon.observation_params({"start": "2022-10-07T10:00:03", "end": "2022-10-07T10:00:04"})
+    assert params["start"] == datetime(2022, 10, 7, 10, 0, 3)
+    page = mongoDB.query(params)
+    assert [doc["n"] for doc in page["items"]] == [6, 7, 8, 9]
+
+
+@pytest.mark.parametrize("value", ["2022-10-07T10:00:03-04:00", "2022-10-07T14:00:03+00:00", "2022-10-07T14:00:03Z"])
+def test_time_range_with_an_offset_is_rejected(value):
+    with pytest.raises(ValueError, match="offset"):
+        apiCommon.observation_params({"start": value})
+
+
+def test_cursor_pages_skip_the_exact_count(collection):
+    first = mongoDB.query({"limit": 10, "skip": 0})
+    assert first["count"] == 25
+    request = mongoDB.page_request({"limit": 10, "skip": 0, "cursor": first["next"]})
+    assert not request["with_count"]
+    assert all("$facet" not in stage for stage in request["pipeline"])
+    assert mongoDB.query({"limit": 10, "skip": 0, "cursor": first["next"]})["count"] is None
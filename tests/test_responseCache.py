@@ -0,0 +1,126 @@
+import pytest
+import mongoConnection
+import mongoDB
+import responseCache
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def meta(monkeypatch):
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    monkeypatch.setattr(mongoDB, "generation", {"at": None, "value": 0})
+    return mongoDB.get_meta_collection()
+
+
+def bump_elsewhere(meta):
+    # an upload handled by another worker
+    meta.update_one({"_id": "generation"}, {"$inc": {"value": 1}}, upsert=True)
+
+
+def test_other_workers_uploads_are_seen_after_the_generation_ttl(meta, monkeypatch):
+    monkeypatch.setattr(mongoDB, "GENERATION_TTL", 60)
+    assert mongoDB.current_generation() == 0
+    bump_elsewhere(meta)
+    # bounded staleness: the cached generation is used until it expires
+    assert mongoDB.current_generation() == 0
+    mongoDB.generation["at"] -= 61
+    assert mongoDB.current_generation() == 1
+
+
+def test_zero_generation_ttl_reads_every_time(meta, monkeypatch):
+    monkeypatch.setattr(mongoDB, "GENERATION_TTL", 0)
+    assert mongoDB.current_generation() == 0
+    bump_elsewhere(meta)
+    assert mongoDB.current_generation() == 1
+
+
+def test_own_upload_is_seen_at_once(meta, monkeypatch):
+    monkeypatch.setattr(mongoDB, "GENERATION_TTL", 60)
+    assert mongoDB.current_generation() == 0
+    mongoDB.bump_generation()
+    assert mongoDB.current_generation() == 1
+
+
+def test_lru_cache_evicts_and_expires(monkeypatch):
+    cache = responseCache.LRUCache(max_entries=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    now = responseCache.time.monotonic()
+    monkeypatch.setattr(responseCache.time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import flaskWebApp
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    monkeypatch.setattr(mongoDB, "generation", {"at": None, "value": 0})
+    monkeypatch.setattr(mongoDB, "GENERATION_TTL", 60)
+    monkeypatch.setattr(responseCache, "local_cache", responseCache.LRUCache())
+    mongoDB.get_collection().insert_many([{"n": n, "pH": 7 + n / 100, mongoDB.SORT_KEY: n} for n in range(20)])
+    return flaskWebApp.app.test_client()
+
+
+def test_cache_key_covers_path_arguments_accept_and_generation():
+    import flaskWebApp
+    keys = set()
+    for path, headers in [("/api/observations?limit=5&skip=0", {}), ("/api/observations?skip=0&limit=5", {}),
+                          ("/api/observations?limit=6&skip=0", {}), ("/api/stats?limit=5&skip=0", {}),
+                          ("/api/observations?limit=5&skip=0", {"Accept": "application/x-ndjson"})]:
+        with flaskWebApp.app.test_request_context(path, headers=headers):
+            keys.add(responseCache.cache_key(1))
+            with_generation = responseCache.cache_key(2)
+    # argument order doesn't matter, everything else does
+    assert len(keys) == 4
+    assert with_generation.startswith("2:") and with_generation.split(":")[1] in {k.split(":")[1] for k in keys}
+
+
+def test_responses_are_cached_until_the_generation_changes(app):
+    first = app.get("/api/observations?limit=5")
+    assert first.status_code == 200 and first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+    assert "Accept" in first.headers["Vary"]
+
+    # served from the cache even if the collection changed behind its back
+    mongoDB.get_collection().delete_many({})
+    second = app.get("/api/observations?limit=5")
+    assert second.headers["X-Cache"] == "HIT" and second.data == first.data and second.headers["ETag"] == etag
+
+    mongoDB.bump_generation()
+    third = app.get("/api/observations?limit=5")
+    assert third.headers["X-Cache"] == "MISS" and third.headers["ETag"] != etag
+    assert third.get_json() == {}
+
+
+def test_if_none_match_is_answered_with_a_304(app):
+    etag = app.get("/api/observations?limit=5").headers["ETag"]
+    for tag in [etag, "W/" + etag, f'"other", {etag}']:
+        response = app.get("/api/observations?limit=5", headers={"If-None-Match": tag})
+        assert response.status_code == 304 and response.data == b"" and response.headers["ETag"] == etag
+    # another query or a newer generation has another tag
+    assert app.get("/api/observations?limit=6", headers={"If-None-Match": etag}).status_code == 200
+    mongoDB.bump_generation()
+    assert app.get("/api/observations?limit=5", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_errors_and_exports_are_not_cached(app):
+    for _ in range(2):
+        error = app.get("/api/observations?limit=0")
+        assert error.status_code == 400 and "ETag" not in error.headers
+        export = app.get("/api/observations", headers={"Accept": "application/x-ndjson"})
+        assert export.headers["X-Cache"] == "MISS" and len(export.data.splitlines()) == 20
+    assert len(responseCache.local_cache.entries) == 0
+
+
+def test_cache_is_bypassed_without_a_generation(app, monkeypatch):
+    def unreachable():
+        raise RuntimeError("no server")
+    monkeypatch.setattr(mongoDB, "generation", {"at": None, "value": 0})
+    monkeypatch.setattr(mongoDB, "get_meta_collection", unreachable)
+    response = app.get("/api/observations?limit=5")
+    assert response.status_code == 200 and "X-Cache" not in response.headers
@@ -0,0 +1,67 @@
+import gzip
+import json
+from datetime import date, datetime, time
+import numpy as np
+import pytest
+from bson import ObjectId
+import serializer
+
+VALUES = {"array": np.arange(3), "floats": np.array([1.5, np.nan]), "scalar": np.float32(2.5), "int": np.int64(7),
+          "nan": float("nan"), "inf": float("inf"), "when": datetime(2022, 10, 7, 10, 30), "day": date(2022, 10, 7),
+          "clock": time(10, 30), "id": ObjectId("0123456789abcdef01234567"), "nested": [{"x": np.bool_(True)}]}
+EXPECTED = {"array": [0, 1, 2], "floats": [1.5, None], "scalar": 2.5, "int": 7, "nan": None, "inf": None,
+            "when": "2022-10-07T10:30:00", "day": "2022-10-07", "clock": "10:30:00", "id": "0123456789abcdef01234567",
+            "nested": [{"x": True}]}
+
+
+@pytest.mark.parametrize("encoder", ["orjson", "json"])
+def test_dumps_writes_numpy_dates_and_nan(monkeypatch, encoder):
+    if encoder == "orjson" and serializer.orjson is None:
+        pytest.skip("orjson not installed")
+    monkeypatch.setattr(serializer, "ENCODER", encoder)
+    assert json.loads(serializer.dumps(VALUES)) == EXPECTED
+    assert serializer.loads(serializer.dumps({"a": [1, 2]})) == {"a": [1, 2]}
+
+
+@pytest.fixture
+def app():
+    import flask
+    app = flask.Flask(__name__)
+    app.json = serializer.FastJSONProvider(app)
+    app.after_request(serializer.compress_response)
+
+    @app.route("/rows/<int:n>")
+    def rows(n):
+        response = flask.jsonify({"items": [{"n": i, "pH": np.float64(7.5)} for i in range(n)]})
+        response.set_etag("tag")
+        return response
+
+    @app.route("/stream")
+    def stream():
+        return flask.Response((b"x" * 2000 for _ in range(2)), mimetype="text/plain")
+    return app.test_client()
+
+
+def test_large_responses_are_compressed(app):
+    plain = app.get("/rows/200")
+    response = app.get("/rows/200", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in plain.headers
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain.data
+    assert json.loads(plain.data)["items"][0] == {"n": 0, "pH": 7.5}
+    assert "Accept-Encoding" in response.headers["Vary"]
+    # same content, other bytes: the tag is kept but weak
+    assert response.headers["ETag"] == 'W/"tag"' and plain.headers["ETag"] == '"tag"'
+
+
+@pytest.mark.skipif(serializer.zstandard is None, reason="zstandard not installed")
+def test_zstd_is_preferred_when_accepted(app):
+    response = app.get("/rows/200", headers={"Accept-Encoding": "gzip, zstd"})
+    assert response.headers["Content-Encoding"] == "zstd"
+    assert serializer.zstandard.ZstdDecompressor().decompressobj().decompress(response.data) == app.get("/rows/200").data
+
+
+def test_small_streamed_and_unaccepted_responses_are_left_alone(app):
+    assert "Content-Encoding" not in app.get("/rows/2", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in app.get("/stream", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in app.get("/rows/200", headers={"Accept-Encoding": "br"}).headers
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+import statsEngine
+
+
+def batches(values, sizes):
+    start = 0
+    for size in sizes:
+        yield values[start:start + size]
+        start += size
+
+
+def merged(values, sizes):
+    agg = statsEngine.new_field("x")
+    for batch in batches(values, sizes):
+        statsEngine.merge_field(agg, statsEngine.summarize("x", batch))
+    return agg
+
+
+def described(agg):
+    return statsEngine.describe_state({"fields": [agg]})["x"]
+
+
+@pytest.mark.parametrize("sizes", [[5000], [1] * 50 + [4950], [1000] * 5, [7, 993, 2500, 1500]])
+def test_merged_batches_match_single_pass(sizes):
+    values = np.random.default_rng(1).normal(25.0, 3.0, 5000).tolist()
+    single = described(statsEngine.summarize("x", values))
+    result = described(merged(values, sizes))
+
+    assert result["count"] == single["count"] == 5000
+    assert result["mean"] == pytest.approx(single["mean"], rel=1e-12)
+    assert result["std"] == pytest.approx(single["std"], rel=1e-9)
+    assert result["std"] == pytest.approx(np.std(values, ddof=1), rel=1e-9)
+    assert result["min"] == min(values)
+    assert result["max"] == max(values)
+
+
+def test_merge_into_empty_and_with_empty():
+    agg = statsEngine.summarize("x", [1.0, 2.0, 4.0])
+    assert statsEngine.merge_field(statsEngine.new_field("x"), agg)["count"] == 3
+    assert statsEngine.merge_field(agg, statsEngine.new_field("x"))["mean"] == pytest.approx(7 / 3)
+    assert described(statsEngine.summarize("x", [3.0]))["std"] is None
+
+
+def test_sketch_exact_for_few_distinct_values():
+    # distinct values are merged losslessly, so quantiles match np.quantile exactly
+    values = np.random.default_rng(2).integers(0, 50, 20000).astype(float).tolist()
+    result = described(merged(values, [3000] * 6 + [2000]))
+    for label, q in statsEngine.PERCENTILES.items():
+        assert result[label] == pytest.approx(np.quantile(values, q))
+
+
+@pytest.mark.parametrize("distribution", ["normal", "lognormal", "uniform"])
+def test_sketch_quantiles_within_tolerance(distribution):
+    # with SKETCH_SIZE centroids a quantile lands within about 1/SKETCH_SIZE of
+    # its rank; 1% of the rank (and of the value range) is the stated tolerance
+    rng = np.random.default_rng(3)
+    values = getattr(rng, distribution)(size=50000).tolist()
+    result = described(merged(values, [1000] * 50))
+    data = np.sort(values)
+    for label, q in statsEngine.PERCENTILES.items():
+        rank = np.searchsorted(data, result[label]) / len(data)
+        assert abs(rank - q) <= 0.01, label
+        assert abs(result[label] - np.quantile(values, q)) <= 0.01 * (data[-1] - data[0]), label
+
+
+def test_summarize_documents_skips_non_numbers():
+    documents = [{"pH": 7.5, "Site": "a", "flag": True}, {"pH": float("nan")}, {"pH": 8}]
+    summary = statsEngine.summarize_documents(documents)
+    assert list(summary) == ["pH"]
+    assert summary["pH"]["count"] == 2
+
+
+@pytest.fixture
+def collections():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    return db.observations, db.stats
+
+
+def upload(observations, stats, values, since=None):
+    documents = [{"x": float(value)} for value in values]
+    observations.insert_many(documents)
+    return statsEngine.apply_summary(stats, statsEngine.summarize_documents(documents), since=since)
+
+
+def stored_count(stats):
+    return statsEngine.describe(stats)["x"]["count"]
+
+
+class ScanThenUpload:
+    """Observations collection whose first scan lets an upload land before the rebuild writes its result."""
+
+    def __init__(self, observations, stats):
+        self.observations = observations
+        self.stats = stats
+        self.scans = 0
+
+    def find(self, *args, **kwargs):
+        documents = list(self.observations.find(*args, **kwargs))
+        self.scans += 1
+        if self.scans == 1:
+            upload(self.observations, self.stats, [100, 101])
+        return documents
+
+
+def test_rebuild_does_not_overwrite_a_concurrent_upload(collections):
+    observations, stats = collections
+    upload(observations, stats, range(10))
+    scanning = ScanThenUpload(observations, stats)
+    statsEngine.rebuild(scanning, stats)
+    # the first scan missed the upload's rows, so the rebuild started over
+    assert scanning.scans == 2
+    assert stored_count(stats) == 12
+
+
+def test_upload_after_a_rebuild_that_counted_its_rows_is_not_merged(collections):
+    observations, stats = collections
+    upload(observations, stats, range(10))
+    since = statsEngine.rebuild_count(stats)
+    # the upload's rows are written, then a rebuild (of another upload) counts them
+    observations.insert_many([{"x": 100.0}, {"x": 101.0}])
+    statsEngine.rebuild(observations, stats)
+    assert stored_count(stats) == 12
+    assert not statsEngine.apply_summary(stats, statsEngine.summarize_documents([{"x": 100.0}, {"x": 101.0}]),
+                                         since=since)
+    assert stored_count(stats) == 12
+    # without a rebuild in between the summary is merged
+    assert upload(observations, stats, [5], since=statsEngine.rebuild_count(stats))
+    assert stored_count(stats) == 13
+
+
+def test_pandas_and_incremental_stats_describe_the_same_fields():
+    import apiCommon
+    from datetime import datetime, timedelta
+    rng = np.random.default_rng(4)
+    start = datetime(2022, 10, 7, 10, 0, 0)
+    documents = [{"pH": float(rng.choice([7.5, 7.75, 8.0])), "depth": int(rng.integers(0, 5)), "site": "a",
+                  "timestamp": start + timedelta(seconds=i), "meta": {"survey": "2022-10-07"}}
+                 for i in range(300)]
+    pandas = apiCommon.pandas_stats(documents)
+    incremental = statsEngine.describe_state({"fields": list(statsEngine.summarize_documents(documents).values())})
+    assert set(pandas) == set(incremental) == {"pH", "depth"}
+    for field in pandas:
+        for name in ["count", "mean", "min", "max", "25%", "50%", "75%"]:
+            assert pandas[field][name] == pytest.approx(incremental[field][name]), (field, name)
+    assert apiCommon.pandas_stats([]) == {}
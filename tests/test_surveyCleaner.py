@@ -0,0 +1,77 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+import surveyCleaner
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database")
+SURVEYS = surveyCleaner.raw_files([DATABASE])
+
+
+def cleaned_bytes(path, out_dir, stream_rows=None):
+    os.makedirs(out_dir, exist_ok=True)
+    result = surveyCleaner.clean_file(str(path), str(out_dir), stream_rows)
+    with open(result["output"], "rb") as f:
+        return f.read(), result
+
+
+def assert_streaming_matches(path, tmp_path):
+    expected, in_memory = cleaned_bytes(path, tmp_path / "memory")
+    for stream_rows in [1, 7, 1000000]:
+        output, streamed = cleaned_bytes(path, tmp_path / f"stream-{stream_rows}", stream_rows)
+        assert output == expected, stream_rows
+        assert (streamed["rows"], streamed["removed"]) == (in_memory["rows"], in_memory["removed"])
+
+
+@pytest.mark.parametrize("survey", [SURVEYS[0]] if SURVEYS else [], ids=os.path.basename)
+def test_streaming_output_is_identical_to_in_memory(survey, tmp_path):
+    path = tmp_path / os.path.basename(survey)
+    shutil.copy(survey, path)
+    assert_streaming_matches(path, tmp_path)
+
+
+def test_streaming_keeps_the_dtypes_of_a_full_read(tmp_path):
+    # a column that is int in the first chunks and float later, one with gaps, text and an outlier
+    rng = np.random.default_rng(1)
+    n = 60
+    df = pd.DataFrame({
+        "Time hh:mm:ss": [f"10:{i // 60:02d}:{i % 60:02d}" for i in range(n)],
+        "depth": list(range(30)) + list(rng.normal(15, 5, 30).round(3)),
+        "temp": np.where(np.arange(n) % 11 == 0, np.nan, rng.normal(28, 1, n).round(2)),
+        "site": ["a", "b", "c"] * 20,
+    })
+    df.loc[45, "depth"] = 1000.0
+    path = tmp_path / "synthetic.csv"
+    df[["depth", "Time hh:mm:ss", "temp", "site"]].to_csv(path, index=False)
+    assert_streaming_matches(path, tmp_path)
+
+
+def test_raw_files_skip_cleaned_outputs(tmp_path):
+    for name in ["b.csv", "a.csv", "cleaned_a.csv", "notes.txt"]:
+        (tmp_path / name).write_text("x\n1\n")
+    expected = [str(tmp_path / "a.csv"), str(tmp_path / "b.csv")]
+    assert surveyCleaner.raw_files([str(tmp_path)]) == expected
+    # a file named twice is cleaned once
+    assert surveyCleaner.raw_files([str(tmp_path / "*.csv"), str(tmp_path / "a.csv")]) == expected
+
+
+def test_run_cleans_into_out_dir_and_uploads_in_chunks(tmp_path, monkeypatch):
+    rows = "".join(f"10:00:{i:02d},{7 + i / 100}\n" for i in range(5))
+    for name in ["one.csv", "two.csv"]:
+        (tmp_path / name).write_text("Time hh:mm:ss,pH\n" + rows)
+    posted = []
+    def post_chunk(base_url, header, index, lines):
+        posted.append((base_url, header, len(lines)))
+        return {"batch": index, "rows": len(lines), "inserted": len(lines), "replaced": 0, "skipped": 0}
+    monkeypatch.setattr(surveyCleaner, "post_chunk", post_chunk)
+
+    out_dir = tmp_path / "out"
+    results = surveyCleaner.run(surveyCleaner.raw_files([str(tmp_path)]), str(out_dir), "http://api", workers=2,
+                                chunk_rows=2)
+    assert sorted(os.listdir(out_dir)) == ["cleaned_one.csv", "cleaned_two.csv"]
+    for result in results:
+        assert (result["rows"], result["removed"], result["chunks"], result["inserted"]) == (5, 0, 3, 5)
+        assert pd.read_csv(result["output"]).equals(pd.read_csv(result["source"]))
+    assert sorted(size for _, _, size in posted) == [1, 1, 2, 2, 2, 2]
+    assert {(url, header) for url, header, _ in posted} == {("http://api", "Time hh:mm:ss,pH\n")}
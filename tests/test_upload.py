@@ -0,0 +1,159 @@
+import threading
+import time
+import pytest
+import ingest
+import mongoConnection
+import mongoDB
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def row(second, ph):
+    return {"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": f"10:00:{second:02d}", "Time": float(second), "pH": ph}
+
+
+@pytest.fixture
+def timeseries(monkeypatch):
+    # mongomock has no time-series collections; the storage mode only picks the write path
+    monkeypatch.setattr(mongoConnection, "client", mongomock.MongoClient())
+    monkeypatch.setattr(mongoDB, "STORAGE", "timeseries")
+    monkeypatch.setattr(mongoDB, "bump_generation", lambda: None)
+    monkeypatch.setattr(mongoDB.statsEngine, "rebuild", lambda *args: None)
+    monkeypatch.setattr(mongoDB.statsEngine, "apply_summary", lambda *args, **kwargs: True)
+    return mongoDB.get_collection()
+
+
+def stored(collection):
+    return sorted((doc["_key"], doc["pH"]) for doc in collection.find())
+
+
+def test_changed_row_is_replaced(timeseries):
+    mongoDB.upload_MONGO([row(0, 7.0), row(1, 7.1)])
+    result = mongoDB.upload_MONGO([row(0, 7.0), row(1, 7.5)])
+    assert (result["skipped"], result["inserted"], result["replaced"]) == (1, 0, 1)
+    assert [ph for _, ph in stored(timeseries)] == [7.0, 7.5]
+
+
+def test_replacement_is_written_before_the_old_version_is_deleted(timeseries, monkeypatch):
+    mongoDB.upload_MONGO([row(0, 7.0), row(1, 7.1), row(2, 7.2)])
+    old_ids = {doc["pH"]: doc["_id"] for doc in timeseries.find()}
+    calls = []
+    collection_type = type(timeseries)
+    insert_many, delete_many = collection_type.insert_many, collection_type.delete_many
+    def logged_insert(self, documents, *args, **kwargs):
+        calls.append(("insert", [doc["pH"] for doc in documents]))
+        return insert_many(self, documents, *args, **kwargs)
+    def logged_delete(self, filter, *args, **kwargs):
+        calls.append(("delete", filter))
+        return delete_many(self, filter, *args, **kwargs)
+    monkeypatch.setattr(collection_type, "insert_many", logged_insert)
+    monkeypatch.setattr(collection_type, "delete_many", logged_delete)
+
+    result = mongoDB.upload_MONGO([row(0, 7.0), row(1, 7.5), row(2, 7.6), row(3, 7.3)])
+    assert (result["skipped"], result["inserted"], result["replaced"]) == (1, 1, 2)
+    # batches are cut per key lane, so check every delete on its own: it only names old _ids
+    # of replaced rows, and their new versions were inserted before it
+    replacement = {old_ids[7.1]: 7.5, old_ids[7.2]: 7.6}
+    inserted = [ph for call, values in calls if call == "insert" for ph in values]
+    assert sorted(inserted) == [7.3, 7.5, 7.6]
+    deleted = []
+    for i, (call, values) in enumerate(calls):
+        if call == "delete":
+            assert list(values) == ["_id"]
+            written_before = [ph for earlier, phs in calls[:i] if earlier == "insert" for ph in phs]
+            for old_id in values["_id"]["$in"]:
+                assert replacement[old_id] in written_before
+                deleted.append(old_id)
+    assert sorted(deleted) == sorted(replacement)
+    assert [ph for _, ph in stored(timeseries)] == [7.0, 7.5, 7.6, 7.3]
+    assert timeseries.find_one({"pH": 7.0})["_id"] == old_ids[7.0]
+
+
+def test_timeseries_needs_mongodb_7(timeseries):
+    # mongomock reports 5.0
+    assert not mongoDB.timeseries_supported(mongoDB.get_db())
+
+
+def test_row_losing_its_timestamp_keeps_the_stored_version(timeseries, monkeypatch):
+    mongoDB.upload_MONGO([row(0, 7.0)])
+    # same natural key, but the date and time no longer parse
+    monkeypatch.setattr(ingest, "timestamp", lambda doc: None)
+    result = mongoDB.upload_MONGO([row(0, 7.5)])
+    assert result["replaced"] == 0 and result["batches"][0]["errors"]
+    assert stored(timeseries) == [(ingest.natural_key(row(0, 7.0)), 7.0)]
+
+
+def test_rejected_reinsert_keeps_the_stored_version(timeseries, monkeypatch):
+    mongoDB.upload_MONGO([row(0, 7.0)])
+    def rejected(self, documents, ordered=True):
+        raise mongoDB.BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "rejected"}]})
+    monkeypatch.setattr(type(timeseries), "insert_many", rejected)
+    result = mongoDB.upload_MONGO([row(0, 7.5)])
+    assert result["replaced"] == 0 and result["batches"][0]["errors"] == ["rejected"]
+    assert stored(timeseries) == [(ingest.natural_key(row(0, 7.0)), 7.0)]
+
+
+def test_key_stored_twice_is_healed(timeseries):
+    mongoDB.upload_MONGO([row(0, 7.0)])
+    # left by a write interrupted between the insert and the delete
+    copy = timeseries.find_one({}, {"_id": 0})
+    timeseries.insert_one(copy)
+    result = mongoDB.upload_MONGO([row(0, 7.0)])
+    assert result["replaced"] == 1
+    assert stored(timeseries) == [(ingest.natural_key(row(0, 7.0)), 7.0)]
+
+
+def test_batches_in_flight_never_share_a_key():
+    lock = threading.Lock()
+    in_flight = []
+    overlaps = []
+
+    def write(index, batch):
+        keys = {ingest.natural_key(doc) for doc in batch}
+        with lock:
+            overlaps.extend(keys & flying for flying in in_flight)
+            in_flight.append(keys)
+        time.sleep(0.002)
+        with lock:
+            in_flight.remove(keys)
+        return {"batch": index, "keys": keys, "rows": len(batch)}
+
+    # every key is sent several times, far apart in the body
+    documents = [row(second, 7.0 + repeat / 10) for repeat in range(5) for second in range(60)]
+    results = ingest.run_batches(documents, write, size=7, workers=4, key=ingest.natural_key)
+    assert not [overlap for overlap in overlaps if overlap]
+    assert sum(result["rows"] for result in results) == len(documents)
+
+
+@pytest.mark.parametrize("body, content_type", [('[1, "x"]', "application/json"),
+                                                ('{"a": 1}\n[2]\n', "application/x-ndjson")])
+def test_non_object_documents_are_a_400(timeseries, body, content_type):
+    import flaskWebApp
+    response = flaskWebApp.app.test_client().post("/api/upload", data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert b"JSON objects" in response.data
+
+
+def test_same_rows_as_csv_then_json_are_skipped(timeseries):
+    import flaskWebApp
+    client = flaskWebApp.app.test_client()
+    csv = "Date m/d/y   ,Time hh:mm:ss,Time,pH\n10/07/22,10:00:00,0,7.0\n10/07/22,10:00:01,1,7.5\n"
+    assert client.post("/api/upload", data=csv, content_type="text/csv").get_json()["inserted"] == 2
+    body = '[{"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": "10:00:00", "Time": 0, "pH": 7},' \
+           ' {"Date m/d/y   ": "10/07/22", "Time hh:mm:ss": "10:00:01", "Time": 1, "pH": 7.5}]'
+    result = client.post("/api/upload", data=body, content_type="application/json").get_json()
+    assert (result["skipped"], result["inserted"], result["replaced"]) == (2, 0, 0)
+    assert timeseries.count_documents({}) == 2
+
+
+def test_migrate_copies_timed_rows_once(timeseries):
+    source = mongoConnection.client.db_migrate.collection
+    # rows stored before keys and derived fields existed
+    source.insert_many([row(second, 7.0 + second / 10) for second in range(3)] + [{"pH": 6.0}])
+    target = mongoConnection.client.db_migrate.timeseries
+    target.insert_one(ingest.with_key(row(0, 7.0)))
+    assert mongoDB.migrate(source, target) == {"copied": 2, "present": 1, "untimed": 1}
+    assert target.count_documents({}) == 3
+    assert all(ingest.TIMESTAMP_FIELD in doc and "_key" in doc for doc in target.find())
+    # an interrupted migration can be run again
+    assert mongoDB.migrate(source, target) == {"copied": 0, "present": 3, "untimed": 1}